@@ -0,0 +1,158 @@
+"""Scaling benchmarks for the scan and plot pipeline (run with `asv run`).
+
+Each stage is timed on synthetic datasets 10x, 100x and 1000x the size of `edf_sample/2002`
+(3 recordings), with `peakmem_` benchmarks recording peak memory. Results are kept in
+`benchmarks/results` so regressions can be found with `asv compare` / `asv publish`.
+"""
+import os
+import pickle
+import tempfile
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+# pylint: disable=wrong-import-position
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from ea_coverage import (
+    gen_stats,
+    gen_stats_all,
+    plot_bars,
+    plot_timeline,
+)
+from ea_coverage.data import check_filepaths, get_coverage_dataframes
+from ea_coverage.globals import EDF_PATH, PATIENT_IDS
+from ea_coverage.intervals import IntervalTable
+from ea_coverage.synth import gen_synth
+from ea_coverage.utils import load_results
+from ea_coverage.vis import add_ax_index, create_coverage_timeline
+# pylint: enable=wrong-import-position
+
+SAMPLE_RECORDINGS = 3
+SCALES = [10, 100, 1000]
+PATIENT_ID = '2002'
+DATA_TYPE = 'BVP'
+RECORDING_MINUTES = 5
+
+
+class _Dataset:
+    """Generates one synthetic dataset (with results) per scale, shared by every suite."""
+    params = SCALES
+    param_names = ['scale']
+    timeout = 3600
+
+    def setup_cache(self):
+        roots = {}
+        for scale in SCALES:
+            root = tempfile.mkdtemp(prefix=f'ea_coverage_bench_{scale}x_')
+            os.chdir(root)
+            recordings = SAMPLE_RECORDINGS * scale
+            gen_synth(
+                EDF_PATH,
+                patient_ids=[PATIENT_ID],
+                data_types=[DATA_TYPE],
+                days=recordings,
+                recordings=recordings,
+                recording_minutes=RECORDING_MINUTES,
+                dropouts=2,
+                dropout_minutes=1,
+            )
+            gen_stats(PATIENT_ID, DATA_TYPE, use_cache=False)
+            roots[scale] = root
+        return roots
+
+    def setup(self, roots, scale):
+        os.chdir(roots[scale])
+
+
+class ScanSuite(_Dataset):
+
+    def setup(self, roots, scale):
+        super().setup(roots, scale)
+        self.filepaths, _ = check_filepaths(PATIENT_ID, DATA_TYPE)
+
+    def time_check_filepaths(self, roots, scale):
+        check_filepaths(PATIENT_ID, DATA_TYPE)
+
+    def time_get_coverage_dataframes(self, roots, scale):
+        get_coverage_dataframes(self.filepaths)
+
+    def time_get_coverage_dataframes_header_only(self, roots, scale):
+        get_coverage_dataframes(self.filepaths, min_dropout=-1, header_only=True)
+
+    def time_get_coverage_dataframes_memmap(self, roots, scale):
+        get_coverage_dataframes(self.filepaths, reader='memmap')
+
+    def peakmem_get_coverage_dataframes(self, roots, scale):
+        get_coverage_dataframes(self.filepaths)
+
+    def peakmem_get_coverage_dataframes_memmap(self, roots, scale):
+        get_coverage_dataframes(self.filepaths, reader='memmap')
+
+
+class PlotSuite(_Dataset):
+
+    def setup(self, roots, scale):
+        super().setup(roots, scale)
+        self.results = load_results(PATIENT_ID, DATA_TYPE)
+        # the synthetic dataset only has one dtype, so it's repeated on every timeline row
+        self.patient_coverage = {
+            dtype: (
+                IntervalTable.from_results(self.results, 'coverage', DATA_TYPE),
+                IntervalTable.from_results(self.results, 'dropouts', DATA_TYPE),
+            )
+            for dtype in ['ACC', 'BVP', 'EDA', 'HR', 'TEMP']
+        }
+
+    def teardown(self, roots, scale):
+        plt.close('all')
+
+    def time_add_ax_index(self, roots, scale):
+        add_ax_index(self.results['coverage'].copy(), self.results['files'], DATA_TYPE)
+
+    def time_load_dropouts_min_dropout(self, roots, scale):
+        load_results(PATIENT_ID, DATA_TYPE, keys=['dropouts'], min_dropout=128 * 30)
+
+    def time_plot_bars(self, roots, scale):
+        plot_bars(PATIENT_ID, DATA_TYPE)
+
+    def peakmem_plot_bars(self, roots, scale):
+        plot_bars(PATIENT_ID, DATA_TYPE)
+
+    def time_create_coverage_timeline(self, roots, scale):
+        create_coverage_timeline(PATIENT_ID, self.patient_coverage, pd.Series([], dtype=object))
+
+    def peakmem_create_coverage_timeline(self, roots, scale):
+        create_coverage_timeline(PATIENT_ID, self.patient_coverage, pd.Series([], dtype=object))
+
+
+class TimelineSuite:
+    """Timeline rendering backends on every patient (all dtypes, 3x the sample recordings)."""
+    params = ['plotly', 'matplotlib']
+    param_names = ['backend']
+    timeout = 3600
+
+    def setup_cache(self):
+        root = tempfile.mkdtemp(prefix='ea_coverage_bench_timeline_')
+        os.chdir(root)
+        recordings = SAMPLE_RECORDINGS * 3
+        gen_synth(
+            EDF_PATH,
+            patient_ids=PATIENT_IDS,
+            days=recordings,
+            recordings=recordings,
+            recording_minutes=RECORDING_MINUTES,
+        )
+        gen_stats_all(use_cache=False)
+        with open('sztimes.pkl', 'wb') as f:
+            pickle.dump({pid: pd.Series([], dtype=object) for pid in PATIENT_IDS}, f)
+        return root
+
+    def setup(self, root, backend):
+        os.chdir(root)
+
+    def time_plot_timeline_all_patients(self, root, backend):
+        for patient_id in PATIENT_IDS:
+            plot_timeline(patient_id, backend=backend)
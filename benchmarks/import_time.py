@@ -0,0 +1,99 @@
+"""Import-time budget for the CLI.
+
+`timeraw_` benchmarks time `import ea_coverage` and each subcommand's `--help` in a fresh
+interpreter under asv. The budget can also be enforced directly (e.g. in CI), which fails if
+importing any subcommand takes longer than `BUDGET` seconds or pulls in a heavy dependency it
+doesn't need:
+
+    $ python -m benchmarks.import_time
+"""
+import subprocess
+import sys
+
+from ea_coverage.__main__ import COMMANDS
+
+BUDGET = 1.0  # seconds
+
+HEAVY_MODULES = ['mne', 'matplotlib', 'plotly', 'pandas']
+
+# heavy modules each subcommand is allowed to import
+ALLOWED_MODULES = {
+    '': [],
+    'convert-results': ['pandas'],
+    'gen-stats': ['pandas', 'mne'],
+    'gen-stats-all': ['pandas', 'mne'],
+    'gen-synth': ['pandas'],
+    'overlap': ['pandas'],
+    'plot-bars': ['pandas'],
+    'plot-bars-all': ['pandas'],
+    'plot-timeline': ['pandas', 'plotly'],
+    'plot-wear-time': ['pandas'],
+    'prune-cache': ['pandas'],
+}
+
+_HELP_CODE = """
+from ea_coverage.__main__ import main
+try:
+    main([{command!r}, '--help'] if {command!r} else ['--help'])
+except SystemExit:
+    pass
+"""
+
+# resolves a subcommand the way `main` does, before fire parses any arguments
+_IMPORT_CODE = """
+import sys
+import time
+start = time.perf_counter()
+import ea_coverage
+from ea_coverage.__main__ import COMMANDS
+if {command!r}:
+    getattr(ea_coverage, COMMANDS[{command!r}])
+print(time.perf_counter() - start, *(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def timeraw_import_ea_coverage():
+    return "import ea_coverage"
+
+
+def timeraw_help():
+    return _HELP_CODE.format(command='')
+
+
+def timeraw_subcommand_help(command):
+    return _HELP_CODE.format(command=command)
+
+
+timeraw_subcommand_help.params = list(COMMANDS)
+timeraw_subcommand_help.param_names = ['command']
+
+
+def check_import_time(budget: float = BUDGET, repeat: int = 3) -> bool:
+    """Imports each subcommand in a fresh interpreter and checks it against the budget.
+
+    Args:
+        budget: Maximum import time (seconds) for each subcommand, best of `repeat` runs.
+        repeat: Number of runs per subcommand.
+
+    Returns:
+        Whether every subcommand was within budget and only imported allowed modules.
+    """
+    ok = True
+    for command in ['', *COMMANDS]:
+        code = _IMPORT_CODE.format(command=command, heavy=HEAVY_MODULES)
+        runs = [
+            subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                           check=True).stdout.split() for _ in range(repeat)
+        ]
+        elapsed = min(float(run[0]) for run in runs)
+        unexpected = sorted(set(runs[0][1:]) - set(ALLOWED_MODULES.get(command, HEAVY_MODULES)))
+        passed = elapsed <= budget and not unexpected
+        ok &= passed
+
+        print(f"{'ok  ' if passed else 'FAIL'} {command or '(package)':<16} {elapsed:.2f} s"
+              + (f", unexpected imports: {unexpected}" if unexpected else ""))
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_import_time() else 1)
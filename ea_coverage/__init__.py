@@ -1,5 +1,58 @@
-from .gen_stats import gen_stats
-from .plot_bars import plot_bars
-from .plot_timeline import plot_timeline
-from .utils import *
+"""Coverage of the Eval AI dataset.
+
+Submodules are imported on first attribute access (PEP 562), so `import ea_coverage` and each
+CLI subcommand only pay for the dependencies (mne, matplotlib, plotly, ...) they use.
+"""
+import sys
+from importlib import import_module
+
 from .globals import *
+
+# public name -> submodule that defines it
+_LAZY_ATTRS = {
+    'CatalogWarning': 'catalog',
+    'catalog_results': 'catalog',
+    'print_dodgy_files': 'catalog',
+    'query_coverage': 'catalog',
+    'query_dodgy_files': 'catalog',
+    'query_dropouts': 'catalog',
+    'query_files': 'catalog',
+    'query_results': 'catalog',
+    'gen_stats': 'stats',
+    'gen_stats_all': 'stats',
+    'prune_cache': 'stats',
+    'update_stats': 'stats',
+    'CoverageIndex': 'intervals',
+    'IntervalTable': 'intervals',
+    'load_coverage_index': 'intervals',
+    'get_overlap': 'overlaps',
+    'overlap': 'overlaps',
+    'plot_bars': 'bar_plots',
+    'plot_bars_all': 'bar_plots',
+    'plot_timeline': 'timeline_plots',
+    'CoveragePyramid': 'pyramid',
+    'load_pyramid': 'pyramid',
+    'daily_wear_time': 'pyramid',
+    'hourly_heatmap': 'pyramid',
+    'plot_wear_time': 'pyramid',
+    'gen_synth': 'synth',
+    'watch': 'watcher',
+    'FORMAT_VERSION': 'utils',
+    'META_FILENAME': 'utils',
+    'results_path': 'utils',
+    'save_results': 'utils',
+    'load_results': 'utils',
+    'convert_results': 'utils',
+    'dropout_sweep': 'utils',
+    'print_dropout_sweep': 'utils',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(f'.{_LAZY_ATTRS[name]}', __name__), name)
+
+
+def __dir__():
+    return sorted(set(vars(sys.modules[__name__])) | set(_LAZY_ATTRS))
@@ -1,14 +1,64 @@
+import sys
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
 import fire
 
-from . import gen_stats, plot_bars, plot_timeline
+import ea_coverage
+from ea_coverage.globals import OUTPUT_PATH
+
+COMMANDS = {
+    'catalog-results': 'catalog_results',
+    'convert-results': 'convert_results',
+    'dodgy-files': 'print_dodgy_files',
+    'dropout-sweep': 'print_dropout_sweep',
+    'gen-stats': 'gen_stats',
+    'gen-stats-all': 'gen_stats_all',
+    'gen-synth': 'gen_synth',
+    'overlap': 'overlap',
+    'plot-bars': 'plot_bars',
+    'plot-bars-all': 'plot_bars_all',
+    'plot-timeline': 'plot_timeline',
+    'plot-wear-time': 'plot_wear_time',
+    'prune-cache': 'prune_cache',
+    'update-stats': 'update_stats',
+    'watch': 'watch',
+}
+
+
+def main(argv=None):
+    """Entry point. `ea-coverage --profile[=cprofile|pyinstrument] <command> ...` profiles the
+    command, saving the profile to `OUTPUT_PATH/profiles`."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    profiler = None
+    if argv and argv[0].split('=')[0] == '--profile':
+        profiler = argv.pop(0).partition('=')[2] or 'cprofile'
+
+    # only import the requested subcommand (and its dependencies)
+    if argv and argv[0] in COMMANDS:
+        commands = {argv[0]: getattr(ea_coverage, COMMANDS[argv[0]])}
+    else:
+        commands = {name: _lazy_command(name) for name in COMMANDS}
+
+    context = nullcontext()
+    if profiler is not None:
+        from ea_coverage.metrics import profiled  # pylint: disable=import-outside-toplevel
+        name = f"{argv[0] if argv else 'ea-coverage'}_{datetime.now():%Y%m%d-%H%M%S}"
+        context = profiled(profiler, Path(OUTPUT_PATH) / 'profiles', name)
+    with context:
+        fire.Fire(commands, command=argv)
+
+
+def _lazy_command(name: str):
+    """Placeholder for a subcommand that's only imported if it's called."""
 
+    def command(*args, **kwargs):
+        return getattr(ea_coverage, COMMANDS[name])(*args, **kwargs)
 
-def main():
-    fire.Fire({
-        'gen-stats': gen_stats,
-        'plot-bars': plot_bars,
-        'plot-timeline': plot_timeline,
-    })
+    command.__doc__ = f"Run `ea-coverage {name} --help` for usage."
+    return command
 
 
 if __name__ == '__main__':
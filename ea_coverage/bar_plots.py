@@ -0,0 +1,253 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple, Optional
+from datetime import datetime
+
+import numpy as np
+
+from ea_coverage.vis import add_bars, add_envelope, ax_positions
+from .envelopes import ENVELOPES
+from .intervals import NS_IN_SEC, IntervalTable
+from .globals import DTYPES, PATIENT_IDS, SPLIT, OUTPUT_PATH
+from .utils import load_results, results_mtime
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+DAY_IN_HR = 24
+
+# figure reused by every plot rendered in a `plot_bars_all` worker
+_FIGURE = None
+
+
+def bars_path(
+    patient_id: str,
+    data_type: str,
+    envelope: Optional[str] = None,
+    min_dropout: Optional[int] = None,
+) -> Path:
+    """Returns the path a coverage bar plot (at a given dropout threshold, with an envelope
+    overlay) is saved to."""
+    suffix = f'_min_dropout_{min_dropout}' if min_dropout is not None else ''
+    suffix += f'_envelope_{envelope}' if envelope is not None else ''
+    return Path(OUTPUT_PATH) / f'{patient_id}_{data_type.lower()}_coverage{suffix}.png'
+
+
+def plot_bars(
+        patient_id: str,
+        data_type: str,
+        figsize: Tuple[float, float] = (18, 8),
+        fig: Optional['plt.Figure'] = None,
+        min_dropout: Optional[int] = None,
+        envelope: Optional[str] = None,
+        channel: int = 0,
+) -> Path:
+    """Plot results.
+
+    Args:
+        patient_id: Patient ID.
+        data_type: Data type.
+        figsize: Figure size (inches).
+        fig: Figure to clear and draw on. If not given, a new figure is created and closed once
+            it's saved.
+        min_dropout: Plot dropouts of at least this many samples, selected from the run table
+            (defaults to the `min_dropout` the results were generated with). If given, the plot
+            is saved to a separate file.
+        envelope: Overlay the signal envelope saved by `gen_stats` on each bar, one of
+            `ea_coverage.envelopes.ENVELOPES` (e.g. '1min'). The plot is saved to a separate file.
+        channel: Channel of the envelope to overlay.
+
+    Returns:
+        Path the plot was saved to.
+    """
+    # matplotlib is slow to import, so only pay for it when actually plotting
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    patient_id = str(patient_id)
+    fp = bars_path(patient_id, data_type, envelope, min_dropout)
+    assert envelope is None or envelope in ENVELOPES, \
+        f"Invalid envelope, expected one of {list(ENVELOPES)}"
+    close = fig is None
+    if fig is None:
+        fig = plt.figure(figsize=figsize)
+    else:
+        fig.clear()
+        fig.set_size_inches(figsize)
+    ax = fig.add_subplot()
+    width = 0.95  # the width of the bars: can also be len(x) sequence
+
+    print(f"Loading results {patient_id}, {data_type}...")
+    results = load_results(
+        patient_id,
+        data_type,
+        keys=['coverage', 'dropouts', 'files', 'min_dropout'],
+        columns=['file_id', 'time_edf', 'label_start', 'label_duration', 'dir_timestamp'],
+        min_dropout=min_dropout,
+    )
+    coverage = IntervalTable.from_results(results, 'coverage', data_type)
+    dropouts = IntervalTable.from_results(results, 'dropouts', data_type)
+    files = results['files']
+    min_dropout = results['min_dropout']
+
+    # get bounds of plot
+    ax_index = np.concatenate([ax_positions(coverage)[0], ax_positions(dropouts)[0]])
+    file_ids = np.concatenate([coverage.file_ids, dropouts.file_ids])
+    label_ends = np.concatenate([
+        intervals.ends - intervals.file_starts[intervals.file_ids]
+        for intervals in [coverage, dropouts]
+    ])
+
+    start_index = ax_index.min()
+    end_index = ax_index.max()
+    max_val = label_ends.max() / NS_IN_SEC
+
+    x_lim = (start_index - 1.1 * width / 2, end_index + 1.1 * width / 2)
+    y_lim = (0, max(2.5 * 24, 1.1 * max_val / (60 * 60)))
+
+    ax.plot(x_lim, [1 * DAY_IN_HR, 1 * DAY_IN_HR], 'k--')
+    ax.plot(x_lim, [2 * DAY_IN_HR, 2 * DAY_IN_HR], 'k--')
+
+    if len(coverage) > 0:
+        print("  Plotting coverage..")
+        ax = add_bars(
+            coverage,
+            ax,
+            color='g',
+            alpha=0.5,
+            legend='COVERAGE',
+            width=width,
+        )
+
+    if len(dropouts) > 0:
+        print("  Plotting dropouts..")
+        ax = add_bars(
+            dropouts,
+            ax,
+            color='r',
+            alpha=0.5,
+            legend='DROPOUT',
+            width=width * 0.9,
+        )
+
+    if envelope is not None:
+        print("  Plotting envelope..")
+        key = f'envelope_{envelope}'
+        envelope_results = load_results(patient_id,
+                                        data_type,
+                                        keys=[key],
+                                        columns=['file_id', 'bucket', f'min_{channel}',
+                                                 f'max_{channel}'])
+        assert key in envelope_results, \
+            f"No envelopes for {patient_id} ({data_type}), rerun gen-stats"
+        assert f'min_{channel}' in envelope_results[key], f"No channel {channel} in {data_type}"
+        ax = add_envelope(
+            envelope_results[key],
+            coverage.file_starts,
+            files,
+            ax,
+            ENVELOPES[envelope],
+            channel,
+            color='k',
+            width=width * 0.8,
+        )
+
+    # Set all x-axis guff
+    order = np.argsort(ax_index, kind='stable')
+    ticks = ax_index[order]
+    labels = files['dir_timestamp'].to_numpy()[file_ids[order]].astype(str)
+    ax.set_xticks(ticks, labels)
+    ax.tick_params(axis='x', labelrotation=-90)
+    ax.set_xlabel('Data directory timestamp')
+
+    ax.legend()
+    ax.set_xlim(x_lim)
+    ax.set_ylim(y_lim)
+
+    ax.set_ylabel('Hours since 00:00 of date from EDF file')
+
+    title_str = f'Coverage of {data_type.lower()} files for patient {patient_id}'
+    if min_dropout >= 0:
+        title_str += f', min dropout = {min_dropout/128} sec'
+
+    testing_start = int(SPLIT[patient_id]) / (60*60*24)
+    ax.plot([testing_start, testing_start], [0, 3*24], 'k-', alpha=0.25)
+    ax.set_title(title_str)
+    fig.tight_layout()
+
+    fp.parent.mkdir(parents=True, exist_ok=True)
+
+    fig.savefig(str(fp))
+    if close:
+        plt.close(fig)
+    return fp
+
+
+def plot_bars_all(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    force: bool = False,
+):
+    """Renders coverage bar plots for every (patient, dtype) pair over a pool of processes.
+
+    Plots are rendered with the Agg backend, and each worker reuses a single figure. Plots that
+    are newer than the results they're made from are skipped. Plots that fail to render are
+    reported without stopping the others.
+
+    Args:
+        patient_ids: Patient IDs to plot (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to plot (defaults to all of `DTYPES`).
+        workers: Number of worker processes (defaults to the number of CPUs).
+        force: Re-render every plot, even if it's up to date.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    data_types = list(data_types or DTYPES)
+    assert all(pid in PATIENT_IDS for pid in patient_ids), "Invalid patient_ids"
+    assert all(dtype in DTYPES for dtype in data_types), "Invalid data_types"
+
+    jobs = []
+    for patient_id, data_type in product(patient_ids, data_types):
+        source_mtime = results_mtime(patient_id, data_type)
+        if source_mtime is None:
+            print(f"No results for {patient_id} ({data_type}), skipping")
+            continue
+        fp = bars_path(patient_id, data_type)
+        if not force and fp.exists() and fp.stat().st_mtime > source_mtime:
+            continue
+        jobs.append((patient_id, data_type))
+
+    n_skipped = len(patient_ids) * len(data_types) - len(jobs)
+    print(f"Rendering {len(jobs)} plots ({n_skipped} up to date or missing results)...")
+    if not jobs:
+        return
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_plot_worker) as executor:
+        futures = {executor.submit(_plot_bars_job, *job): job for job in jobs}
+        for future in as_completed(futures):
+            patient_id, data_type = futures[future]
+            try:
+                print(f"  Saved {future.result()}")
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"  Failed to render {patient_id} ({data_type}): "
+                      f"{type(err).__name__}: {err}")
+                failed.append((patient_id, data_type))
+    if failed:
+        print(f"{len(failed)} of {len(jobs)} plots failed: "
+              + ', '.join(f'{patient_id} ({data_type})' for patient_id, data_type in failed))
+
+
+def _init_plot_worker():
+    """Pool initializer that renders off-screen."""
+    import matplotlib  # pylint: disable=import-outside-toplevel
+    matplotlib.use('Agg')
+
+
+def _plot_bars_job(patient_id: str, data_type: str) -> Path:
+    """Renders one plot on the worker's reused figure."""
+    global _FIGURE  # pylint: disable=global-statement
+    if _FIGURE is None:
+        import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+        _FIGURE = plt.figure()
+    return plot_bars(patient_id, data_type, fig=_FIGURE)
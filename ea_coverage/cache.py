@@ -0,0 +1,83 @@
+"""Persistent per-file cache of `get_file_stats` outputs.
+
+Entries are keyed on the edf filepath and are only reused when the file's fingerprint (size,
+mtime and a hash of its header) and the processing parameters match, so re-runs only process
+new or modified recordings.
+"""
+import hashlib
+import os
+from pathlib import Path
+from pickle import dump, load
+from typing import Optional, Tuple
+
+from .data import FileStats
+from .edf import HEADER_SIZE, SIGNAL_HEADER_SIZE
+from .globals import INTERIM_PATH
+
+CACHE_DIR = 'cache'
+
+Fingerprint = Tuple[int, int, str]
+
+
+def file_fingerprint(filepath: Path) -> Fingerprint:
+    """Returns (size, mtime in ns, hash of the edf header) for a file."""
+    stat = os.stat(filepath)
+    with open(filepath, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        n_signals = int(header[252:256].decode('ascii').strip() or 0)
+        header += f.read(n_signals * SIGNAL_HEADER_SIZE)
+    return stat.st_size, stat.st_mtime_ns, hashlib.blake2b(header, digest_size=16).hexdigest()
+
+
+class FileStatsCache:
+    """Cache of per-file stats for a patient and dtype, stored in `INTERIM_PATH/cache`.
+
+    Args:
+        patient_id: Patient ID.
+        data_type: Data type.
+        params: Processing parameters (e.g. `min_dropout`, `criterion`). Entries computed with
+            different parameters are treated as stale.
+    """
+
+    def __init__(self, patient_id: str, data_type: str, params: Optional[dict] = None):
+        self.params = params or {}
+        self.filepath = (Path(INTERIM_PATH) / CACHE_DIR
+                         / f'{patient_id}_{data_type.lower()}_filestats.pkl')
+        self.entries = {}
+        if self.filepath.exists():
+            with open(self.filepath, 'rb') as f:
+                self.entries = load(f)
+        self.hits, self.misses = 0, 0
+
+    def get(self, filepath: Path) -> Optional[FileStats]:
+        """Returns cached stats for a file, or None if missing or stale."""
+        entry = self.entries.get(str(filepath))
+        if (entry is not None and entry['params'] == self.params
+                and entry['fingerprint'] == file_fingerprint(filepath)):
+            self.hits += 1
+            return entry['file_stats']
+        self.misses += 1
+        return None
+
+    def put(self, filepath: Path, file_stats: FileStats):
+        """Stores stats for a file."""
+        self.entries[str(filepath)] = {
+            'fingerprint': file_fingerprint(filepath),
+            'params': self.params,
+            'file_stats': file_stats,
+        }
+
+    def prune(self) -> int:
+        """Removes entries for files that no longer exist, returning the number removed."""
+        missing = [fp for fp in self.entries if not Path(fp).exists()]
+        for fp in missing:
+            del self.entries[fp]
+        return len(missing)
+
+    def save(self):
+        """Writes the cache to disk (via a temporary file so it's never left half-written)."""
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_filepath = self.filepath.with_suffix('.tmp')
+        with open(tmp_filepath, 'wb') as f:
+            dump(self.entries, f)
+        os.replace(tmp_filepath, self.filepath)
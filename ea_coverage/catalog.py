@@ -0,0 +1,483 @@
+"""SQLite catalog of saved results, for indexed lookups across patients and dtypes.
+
+`save_results` indexes each result it saves in `INTERIM_PATH/catalog.sqlite`: where it's stored
+and with which parameters, and its files, dodgy files, coverage intervals and dropout runs, with
+absolute start and end times (unix seconds). Questions about the whole cohort ("which files were
+dodgy", "what's covered between these dates") are then answered by SQL instead of loading every
+result.
+
+The catalog is written in WAL mode, and each result is replaced in a single transaction, so
+several `gen_stats` processes can save at once and readers never see a partially indexed result.
+It can be rebuilt from the saved results with `catalog_results`.
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+from itertools import product
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .globals import DTYPES, INTERIM_PATH, PATIENT_IDS
+
+CATALOG_FILENAME = 'catalog.sqlite'
+SCHEMA_VERSION = 1
+
+# seconds to wait for another process's write transaction before giving up
+BUSY_TIMEOUT = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    patient_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    path TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    min_dropout INTEGER,
+    min_run INTEGER,
+    criterion TEXT,
+    n_files INTEGER NOT NULL,
+    n_dodgy INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, data_type)
+);
+CREATE TABLE IF NOT EXISTS files (
+    patient_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    filepath TEXT NOT NULL,
+    split TEXT,
+    dir_timestamp INTEGER,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    sfreq REAL NOT NULL,
+    n_samples INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, data_type, file_id)
+);
+CREATE INDEX IF NOT EXISTS files_split ON files (split, patient_id, data_type);
+CREATE INDEX IF NOT EXISTS files_start ON files (start);
+CREATE TABLE IF NOT EXISTS dodgy_files (
+    patient_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    filepath TEXT NOT NULL,
+    error TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dodgy_files_result ON dodgy_files (patient_id, data_type);
+CREATE TABLE IF NOT EXISTS coverage (
+    patient_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_result_start ON coverage (patient_id, data_type, start);
+CREATE TABLE IF NOT EXISTS runs (
+    patient_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    start_sample INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    kind TEXT,
+    start REAL NOT NULL,
+    end REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_result_length ON runs (patient_id, data_type, length);
+"""
+
+# tables holding rows of each result, which are replaced when it's saved again
+_RESULT_TABLES = ['results', 'files', 'dodgy_files', 'coverage', 'runs']
+
+
+class CatalogWarning(UserWarning):
+    """Issued when saved results couldn't be indexed, so the catalog is stale until it's rebuilt
+    with `catalog_results`."""
+
+
+def catalog_path() -> Path:
+    """Returns the path of the catalog database."""
+    return Path(INTERIM_PATH) / CATALOG_FILENAME
+
+
+def connect(fp: Optional[Path] = None) -> sqlite3.Connection:
+    """Opens the catalog (creating it if needed) in WAL mode.
+
+    Args:
+        fp: Path of the database (defaults to `catalog_path()`).
+
+    Returns:
+        Connection in autocommit mode, see `transaction` for atomic writes.
+    """
+    fp = Path(fp or catalog_path())
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(fp), timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        with transaction(conn):
+            # another process may have created the schema while this one waited for the lock
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            # an old schema is dropped, and can be rebuilt from the saved results with
+            # `catalog_results`
+            if version not in (0, SCHEMA_VERSION):
+                for table in _RESULT_TABLES:
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+            for statement in _SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Runs the statements in the block as one write transaction, rolled back on errors."""
+    # IMMEDIATE takes the write lock up front, so concurrent writers queue instead of deadlocking
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def index_results(results: dict, path: Path, conn: Optional[sqlite3.Connection] = None):
+    """Replaces the catalog entry of a result in a single transaction.
+
+    Args:
+        results: Results saved by `save_results`, with a file table (see `build_file_table`).
+        path: Where the results are saved.
+        conn: Catalog connection (defaults to a new connection to `catalog_path()`).
+    """
+    patient_id, data_type = str(results['patient_id']), results['data_type']
+    files, filestats = results['files'], results['filestats']
+    key = {'patient_id': patient_id, 'data_type': data_type}
+
+    file_start = _unix_seconds(filestats['time_edf'])
+    file_rows = pd.DataFrame({
+        **key,
+        'file_id': files['file_id'].to_numpy(dtype=np.int64),
+        'filepath': files['filepath'].astype(str).to_numpy(),
+        'split': files['split'].astype(object).to_numpy(),
+        'dir_timestamp': files['dir_timestamp'].to_numpy(dtype=np.int64),
+        'start': file_start,
+        'end': file_start + filestats['duration'].to_numpy(dtype=float),
+        'sfreq': filestats['sfreq'].to_numpy(dtype=float),
+        'n_samples': filestats['n_samples'].to_numpy(dtype=np.int64),
+    })
+
+    coverage = results['coverage']
+    coverage_start = (file_start[coverage['file_id'].to_numpy()]
+                      + coverage['label_start'].to_numpy(dtype=float))
+    coverage_rows = pd.DataFrame({
+        **key,
+        'file_id': coverage['file_id'].to_numpy(dtype=np.int64),
+        'start': coverage_start,
+        'end': coverage_start + coverage['label_duration'].to_numpy(dtype=float),
+    })
+
+    dodgy_rows = pd.DataFrame({
+        **key,
+        'filepath': [str(fp) for fp in results['dodgy_filepaths']],
+        'error': [str(error) for error in results['dodgy_filepaths'].values()],
+    }, columns=['patient_id', 'data_type', 'filepath', 'error'])
+
+    # results saved before run tables were added have no runs to index
+    runs = results.get('runs')
+    run_rows = None
+    if runs is not None:
+        file_ids = runs['file_id'].to_numpy(dtype=np.int64)
+        sfreq = filestats['sfreq'].to_numpy(dtype=float)[file_ids]
+        start_samples = runs['start_sample'].to_numpy(dtype=np.int64)
+        lengths = runs['length'].to_numpy(dtype=np.int64)
+        run_rows = pd.DataFrame({
+            **key,
+            'file_id': file_ids,
+            'start_sample': start_samples,
+            'length': lengths,
+            # every run of a result is found with its criterion
+            'kind': results.get('criterion'),
+            'start': file_start[file_ids] + start_samples / sfreq,
+            'end': file_start[file_ids] + (start_samples + lengths) / sfreq,
+        })
+
+    own_conn = conn is None
+    conn = conn or connect()
+    try:
+        with transaction(conn):
+            for table in _RESULT_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE patient_id = ? AND data_type = ?',
+                             (patient_id, data_type))
+            conn.execute(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (patient_id, data_type, str(path), time.time(), results.get('min_dropout'),
+                 results.get('min_run'), results.get('criterion'), len(files),
+                 len(results['dodgy_filepaths'])),
+            )
+            for table, rows in [('files', file_rows), ('dodgy_files', dodgy_rows),
+                                ('coverage', coverage_rows), ('runs', run_rows)]:
+                if rows is not None and len(rows) > 0:
+                    _insert(conn, table, rows)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def lookup_results(patient_id: str, data_type: str) -> Optional[Path]:
+    """Returns where the catalog says results for a patient and dtype are saved, or None."""
+    fp = catalog_path()
+    if not fp.exists():
+        return None
+    with _reading() as conn:
+        row = conn.execute('SELECT path FROM results WHERE patient_id = ? AND data_type = ?',
+                           (str(patient_id), data_type)).fetchone()
+    return Path(row[0]) if row is not None else None
+
+
+def query_results(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Catalogued results, with where they're saved, their parameters and number of files.
+
+    Args:
+        patient_ids: Only include these patients (defaults to all).
+        data_types: Only include these dtypes (defaults to all).
+    """
+    where, params = _result_filter('results', patient_ids, data_types)
+    return _query(f'SELECT * FROM results {where} ORDER BY patient_id, data_type', params)
+
+
+def query_files(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    split: Optional[str] = None,
+    start: Optional[Union[str, pd.Timestamp]] = None,
+    end: Optional[Union[str, pd.Timestamp]] = None,
+) -> pd.DataFrame:
+    """Catalogued (valid) files, optionally only those of a split or overlapping a time range.
+
+    Args:
+        patient_ids: Only include these patients (defaults to all).
+        data_types: Only include these dtypes (defaults to all).
+        split: Only include files of this split (training or testing).
+        start: Only include files that end after this time (UTC if no timezone is given).
+        end: Only include files that start before this time.
+
+    Returns:
+        DataFrame with columns `patient_id`, `data_type`, `file_id`, `filepath`, `split`,
+        `dir_timestamp`, `start`, `end`, `sfreq` and `n_samples`.
+    """
+    where, params = _interval_filter('files', patient_ids, data_types, split, start, end)
+    return _with_times(
+        _query(f'SELECT * FROM files {where} ORDER BY patient_id, data_type, file_id', params))
+
+
+def query_dodgy_files(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Catalogued dodgy files, with columns `patient_id`, `data_type`, `filepath` and `error`.
+
+    Args:
+        patient_ids: Only include these patients (defaults to all).
+        data_types: Only include these dtypes (defaults to all).
+    """
+    where, params = _result_filter('dodgy_files', patient_ids, data_types)
+    return _query(
+        f'SELECT * FROM dodgy_files {where} ORDER BY patient_id, data_type, filepath', params)
+
+
+def query_coverage(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    split: Optional[str] = None,
+    start: Optional[Union[str, pd.Timestamp]] = None,
+    end: Optional[Union[str, pd.Timestamp]] = None,
+) -> pd.DataFrame:
+    """Catalogued coverage intervals, optionally only those of a split or overlapping a time range.
+
+    Args:
+        patient_ids: Only include these patients (defaults to all).
+        data_types: Only include these dtypes (defaults to all).
+        split: Only include intervals of files of this split (training or testing).
+        start: Only include intervals that end after this time (UTC if no timezone is given).
+        end: Only include intervals that start before this time.
+
+    Returns:
+        DataFrame with columns `patient_id`, `data_type`, `file_id`, `filepath`, `split`,
+        `start` and `end`.
+    """
+    where, params = _interval_filter('coverage', patient_ids, data_types, split, start, end)
+    return _with_times(
+        _query(
+            'SELECT coverage.patient_id, coverage.data_type, coverage.file_id, files.filepath, '
+            'files.split, coverage.start, coverage.end FROM coverage ' + _join_files('coverage')
+            + where
+            + ' ORDER BY coverage.patient_id, coverage.data_type, coverage.start', params))
+
+
+def query_dropouts(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    min_dropout: Optional[int] = None,
+    split: Optional[str] = None,
+    start: Optional[Union[str, pd.Timestamp]] = None,
+    end: Optional[Union[str, pd.Timestamp]] = None,
+) -> pd.DataFrame:
+    """Catalogued dropouts, optionally only those of a split or overlapping a time range.
+
+    Args:
+        patient_ids: Only include these patients (defaults to all).
+        data_types: Only include these dtypes (defaults to all).
+        min_dropout: The minimum number of samples to consider a dropout (defaults to the
+            `min_dropout` each result was generated with). Runs shorter than a result's `min_run`
+            weren't kept, see `ea_coverage.runs`.
+        split: Only include dropouts in files of this split (training or testing).
+        start: Only include dropouts that end after this time (UTC if no timezone is given).
+        end: Only include dropouts that start before this time.
+
+    Returns:
+        DataFrame with columns `patient_id`, `data_type`, `file_id`, `filepath`, `split`,
+        `start_sample`, `length`, `kind` (the criterion the run was found with), `start` and
+        `end`.
+    """
+    where, params = _interval_filter('runs', patient_ids, data_types, split, start, end)
+    where += (' AND ' if where else 'WHERE ') + 'runs.length >= MAX(COALESCE(?, ('
+    where += 'SELECT min_dropout FROM results WHERE results.patient_id = runs.patient_id '
+    where += 'AND results.data_type = runs.data_type)), 1)'
+    params.append(min_dropout)
+    return _with_times(
+        _query(
+            'SELECT runs.patient_id, runs.data_type, runs.file_id, files.filepath, files.split, '
+            'runs.start_sample, runs.length, runs.kind, runs.start, runs.end FROM runs '
+            + _join_files('runs') + where
+            + ' ORDER BY runs.patient_id, runs.data_type, runs.start', params))
+
+
+def print_dodgy_files(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+):
+    """Prints the catalogued dodgy files of every (or the given) patient and dtype."""
+    dodgy = query_dodgy_files(patient_ids, data_types)
+    if dodgy.empty:
+        print("No dodgy files")
+    else:
+        print(dodgy.to_string(index=False))
+
+
+def catalog_results(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+):
+    """(Re)indexes saved results in the catalog, e.g. results saved before it existed.
+
+    Args:
+        patient_ids: Patient IDs to index (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to index (defaults to all of `DTYPES`).
+    """
+    # the catalog is written by `save_results`, so only import results when it's (re)built
+    from .utils import load_results, results_path  # pylint: disable=import-outside-toplevel
+
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    conn = connect()
+    try:
+        for patient_id, data_type in product(patient_ids, data_types or DTYPES):
+            fp = results_path(patient_id, data_type)
+            if not fp.exists() and not fp.with_suffix('.pkl').exists():
+                continue
+            results = load_results(patient_id, data_type)
+            print(f"Indexing {patient_id} ({data_type})")
+            index_results(results, fp if fp.exists() else fp.with_suffix('.pkl'), conn)
+    finally:
+        conn.close()
+
+
+def _join_files(table: str) -> str:
+    """JOIN clause adding the file of each row of a table."""
+    return (f'JOIN files ON files.patient_id = {table}.patient_id '
+            f'AND files.data_type = {table}.data_type AND files.file_id = {table}.file_id ')
+
+
+def _result_filter(
+    table: str,
+    patient_ids: Optional[List[str]],
+    data_types: Optional[List[str]],
+) -> tuple:
+    """WHERE clause (and its parameters) selecting the rows of some patients and dtypes."""
+    clauses, params = [], []
+    for column, values in [('patient_id', patient_ids), ('data_type', data_types)]:
+        if values is not None:
+            values = [str(value) for value in ([values] if isinstance(values, (str, int)) else
+                                               values)]
+            clauses.append(f"{table}.{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def _interval_filter(
+    table: str,
+    patient_ids: Optional[List[str]],
+    data_types: Optional[List[str]],
+    split: Optional[str],
+    start: Optional[Union[str, pd.Timestamp]],
+    end: Optional[Union[str, pd.Timestamp]],
+) -> tuple:
+    """WHERE clause (and its parameters) selecting the intervals of some patients, dtypes and
+    split that overlap a time range."""
+    where, params = _result_filter(table, patient_ids, data_types)
+    clauses = [where[len('WHERE '):]] if where else []
+    if split is not None:
+        clauses.append('files.split = ?')
+        params.append(split)
+    if start is not None:
+        clauses.append(f'{table}.end > ?')
+        params.append(_timestamp_seconds(start))
+    if end is not None:
+        clauses.append(f'{table}.start < ?')
+        params.append(_timestamp_seconds(end))
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def _query(sql: str, params: list) -> pd.DataFrame:
+    with _reading() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+@contextmanager
+def _reading() -> Iterator[sqlite3.Connection]:
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _insert(conn: sqlite3.Connection, table: str, rows: pd.DataFrame):
+    columns = ', '.join(rows.columns)
+    placeholders = ', '.join('?' * len(rows.columns))
+    conn.executemany(
+        f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+        rows.astype(object).itertuples(index=False, name=None),
+    )
+
+
+def _unix_seconds(times: pd.Series) -> np.ndarray:
+    """Converts timezone-aware timestamps to unix seconds."""
+    utc = pd.to_datetime(times, utc=True).dt.tz_localize(None)
+    return utc.to_numpy(dtype='datetime64[ns]').view(np.int64) / 1e9
+
+
+def _timestamp_seconds(value: Union[str, pd.Timestamp]) -> float:
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.timestamp()
+
+
+def _with_times(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the unix second `start` and `end` columns of a query to UTC timestamps."""
+    for column in ['start', 'end']:
+        df[column] = pd.to_datetime(df[column], unit='s', utc=True)
+    return df
@@ -0,0 +1,542 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Dict, Tuple, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from .dropouts import DEFAULT_CHUNK_SIZE, find_dropouts, make_criterion
+from .envelopes import EnvelopeBuilder, build_envelope_tables, scale_envelope
+from .edf import HEADER_SIZE, SIGNAL_HEADER_SIZE, EdfHeader, EdfReader, read_edf_header
+from .globals import EDF_PATH
+from .metrics import Metrics, timed_chunks
+from .signal_stats import SignalStats, tracked_chunks
+
+if TYPE_CHECKING:
+    import mne
+
+    from .cache import FileStatsCache
+    from .journal import FileStatsJournal
+
+SPLITS = ['training', 'testing']
+
+# sample readers for `get_file_stats`
+READERS = ['mne', 'memmap']
+
+# threads and queued files for `check_filepaths`, which is bound by file system latency
+DEFAULT_WALK_WORKERS = 8
+DEFAULT_READ_AHEAD = 64
+
+FILESTATS_COLUMNS = [
+    'file_id', 'filepath', 'time_edf', 'sfreq', 'n_samples', 'n_channels', 'duration'
+]
+# bumped when `get_file_stats` outputs change, so cached and journaled results are recomputed
+FILE_STATS_VERSION = 3
+LABEL_COLUMNS = ['file_id', 'filepath', 'time_edf', 'label_start', 'label_duration']
+# dropout rows also keep their position in samples and criterion, for `ea_coverage.runs`
+DROPOUT_COLUMNS = LABEL_COLUMNS + ['start_sample', 'length', 'kind']
+
+FileStats = Tuple[dict, List[dict], List[dict]]
+# (filestats, coverage, dropouts, envelope tables), see `collect_file_stats`
+CoverageFrames = Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Dict[str, pd.DataFrame]]
+
+
+def check_filepaths(
+    patient_id: str,
+    data_type: str,
+    data_dir: str = EDF_PATH,
+    workers: int = DEFAULT_WALK_WORKERS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+) -> Tuple[List[Path], Dict[Path, str]]:
+    """Finds and validates edf files for a given patient and dtype.
+
+    Expects files at `<data_dir>/<patient_id>/{training,testing}/<timestamp>/Empatica-<dtype>.edf`.
+    Directories are listed with `os.scandir`, and each file is stat'ed and has its header parsed
+    on a pool of threads, which hides the per-file latency of network mounts. Files are checked
+    in listing order, so the results are the same as a sequential walk. Headers are only used to
+    validate files and aren't kept, so files are read again when they're processed.
+
+    Args:
+        patient_id: The patient ID to process.
+        data_type: The data type to process.
+        data_dir: Root directory of the edf dataset.
+        workers: Number of threads checking files concurrently (1 checks them sequentially).
+        read_ahead: Maximum number of files queued or being checked ahead of the one being
+            collected, which bounds the number of checks in flight (it counts files, not bytes).
+
+    Returns:
+        Tuple of (list of valid filepaths sorted by directory timestamp, dict mapping dodgy
+        filepaths to error messages).
+    """
+    return check_patient_filepaths(patient_id, [data_type], data_dir, workers,
+                                   read_ahead)[data_type]
+
+
+def check_patient_filepaths(
+    patient_id: str,
+    data_types: List[str],
+    data_dir: str = EDF_PATH,
+    workers: int = DEFAULT_WALK_WORKERS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+) -> Dict[str, Tuple[List[Path], Dict[Path, str]]]:
+    """Finds and validates edf files for several dtypes of a patient in a single walk.
+
+    Every recording directory holds a file per dtype, so each split directory is listed once and
+    the files of all `data_types` in a directory are checked together (see `check_filepaths`).
+
+    Args:
+        patient_id: The patient ID to process.
+        data_types: The data types to process.
+        data_dir: Root directory of the edf dataset.
+        workers: Number of threads checking files concurrently (1 checks them sequentially).
+        read_ahead: Maximum number of files queued or being checked ahead of the one being
+            collected.
+
+    Returns:
+        Dict mapping each dtype to the `check_filepaths` tuple of (valid filepaths, dodgy
+        filepaths).
+    """
+    dir_paths = (dir_path for split in SPLITS
+                 for dir_path in _scan_dirs(Path(data_dir) / patient_id / split))
+    checked = check_dir_filepaths(dir_paths, data_types, workers, read_ahead)
+    for dtype, (filepaths, dodgy_filepaths) in checked.items():
+        prefix = f"{dtype}: " if len(data_types) > 1 else ""
+        print(f"{prefix}Found {len(filepaths)} valid files ({len(dodgy_filepaths)} dodgy)")
+    return checked
+
+
+def check_dir_filepaths(
+    dir_paths: Iterable[Path],
+    data_types: List[str],
+    workers: int = DEFAULT_WALK_WORKERS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+) -> Dict[str, Tuple[List[Path], Dict[Path, str]]]:
+    """Validates the edf files of several dtypes in some recording directories.
+
+    Args:
+        dir_paths: Recording directories (`<data_dir>/<patient_id>/<split>/<timestamp>`).
+        data_types: The data types to check.
+        workers: Number of threads checking files concurrently (1 checks them sequentially).
+        read_ahead: Maximum number of files queued or being checked ahead of the one being
+            collected.
+
+    Returns:
+        Dict mapping each dtype to the `check_filepaths` tuple of (valid filepaths, dodgy
+        filepaths).
+    """
+    assert workers >= 1, "workers must be at least 1"
+    assert read_ahead >= 1, "read_ahead must be at least 1"
+    checked = {dtype: ([], {}) for dtype in data_types}
+    candidates = ((dtype, Path(dir_path) / f'Empatica-{dtype}.edf')
+                  for dir_path in dir_paths
+                  for dtype in data_types)
+    for dtype, fp, error in _check_concurrently(candidates, workers, read_ahead):
+        filepaths, dodgy_filepaths = checked[dtype]
+        if error is None:
+            filepaths.append(fp)
+        else:
+            dodgy_filepaths[fp] = error
+
+    for filepaths, _ in checked.values():
+        filepaths.sort(key=lambda fp: int(fp.parent.stem))
+    return checked
+
+
+def _scan_dirs(split_dir: Path) -> List[str]:
+    """Sorted paths of the entries of a split directory, like `sorted(split_dir.glob('*'))`."""
+    try:
+        with os.scandir(split_dir) as entries:
+            return sorted(entry.path for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _check_concurrently(
+    candidates: Iterable[Tuple[str, Path]],
+    workers: int,
+    read_ahead: int,
+) -> Iterator[Tuple[str, Path, Optional[str]]]:
+    """Yields (dtype, filepath, error message or None) in order, checking up to `read_ahead`
+    files ahead."""
+    if workers == 1:
+        for dtype, fp in candidates:
+            yield dtype, fp, _check_filepath(fp)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for dtype, fp in candidates:
+            if len(pending) >= read_ahead:
+                done_dtype, done_fp, future = pending.popleft()
+                yield done_dtype, done_fp, future.result()
+            pending.append((dtype, fp, executor.submit(_check_filepath, fp)))
+        while pending:
+            done_dtype, done_fp, future = pending.popleft()
+            yield done_dtype, done_fp, future.result()
+
+
+def _check_filepath(filepath: Path) -> Optional[str]:
+    """Returns an error message if an edf file can't be used, otherwise None."""
+    if not filepath.parent.stem.isdigit():
+        return f"Directory name {filepath.parent.stem} is not a timestamp"
+    try:
+        size = os.stat(filepath).st_size
+    except (FileNotFoundError, NotADirectoryError):
+        return "File not found"
+    if size == 0:
+        return "File is empty"
+    try:
+        header = read_edf_header(filepath)
+    except Exception as err:  # pylint: disable=broad-except
+        return f"{type(err).__name__}: {err}"
+    if header.n_records == 0:
+        return "File contains no data records"
+    return None
+
+
+def get_file_stats(
+    filepath: Path,
+    min_dropout: int = 128 * 60,
+    header_only: bool = False,
+    criterion: str = 'flat',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    reader: str = 'mne',
+) -> FileStats:
+    """Calculates stats, coverage and dropout labels for a single edf file.
+
+    Args:
+        filepath: Path to edf file.
+        min_dropout: The minimum number of samples to consider a dropout. -1 disables dropout
+            detection, 0 looks for all dropouts of any length.
+        header_only: Only parse the edf header and never read sample data. Dropout detection is
+            disabled in this mode.
+        criterion: Dropout criterion, one of `ea_coverage.dropouts.CRITERIA`.
+        chunk_size: Number of samples read into memory at a time for dropout detection.
+        reader: How samples are read, one of `READERS`. 'mne' decodes them with
+            `mne.io.read_raw_edf`, and 'memmap' reads them in place with
+            `ea_coverage.edf.EdfReader`, only scaling them to physical values if the criterion
+            needs it.
+
+    Returns:
+        Tuple of (filestats row, list of coverage rows, list of dropout rows). The filestats row
+        includes a `metrics` dict of per-file counters (see `ea_coverage.metrics.FILE_COUNTERS`),
+        which isn't kept in the filestats DataFrame. Unless dropout detection is disabled, it
+        also includes `signal_stats`, per-channel stats of the samples read by the dropout scan
+        (see `ea_coverage.signal_stats.SIGNAL_STATS`), which become filestats columns, and
+        `envelope`, their 1 s min/max envelope (see `ea_coverage.envelopes`).
+    """
+    if header_only:
+        return _get_header_file_stats(filepath)
+
+    assert reader in READERS, f"Invalid reader, expected one of {READERS}"
+
+    start = time.perf_counter()
+    if reader == 'memmap':
+        edf = EdfReader(filepath)
+        header = edf.header
+        time_edf = pd.Timestamp(edf.header.start_time)
+        sfreq = edf.header.sfreq
+        n_samples = edf.n_samples
+        n_channels = edf.n_channels
+        physical = not make_criterion(criterion).scale_invariant
+        chunks = edf.iter_chunks(chunk_size, physical=physical)
+    else:
+        # mne is slow to import and isn't needed for header-only stats
+        import mne  # pylint: disable=import-outside-toplevel
+
+        raw = mne.io.read_raw_edf(str(filepath), preload=False, verbose=False)
+        header = read_edf_header(filepath)
+        physical = True
+        time_edf = pd.Timestamp(raw.info['meas_date'])
+        sfreq = raw.info['sfreq']
+        n_samples = raw.n_times
+        n_channels = len(raw.ch_names)
+        chunks = _iter_raw_chunks(raw, chunk_size)
+    file_metrics = {
+        'bytes_read': HEADER_SIZE + SIGNAL_HEADER_SIZE * n_channels,
+        'header_time': time.perf_counter() - start,
+    }
+
+    filestats = {
+        'filepath': filepath,
+        'time_edf': time_edf,
+        'sfreq': sfreq,
+        'n_samples': n_samples,
+        'n_channels': n_channels,
+        'duration': n_samples / sfreq,
+        'metrics': file_metrics,
+    }
+    coverage = [_label(filepath, time_edf, 0.0, n_samples / sfreq)]
+
+    dropouts = []
+    if min_dropout >= 0:
+        start = time.perf_counter()
+        stats = _signal_stats(header, physical, reader)
+        envelope = EnvelopeBuilder(n_channels, sfreq)
+        chunks = tracked_chunks(tracked_chunks(timed_chunks(chunks, file_metrics), stats),
+                                envelope)
+        for start_sample, length in find_dropouts(chunks, min_dropout, criterion):
+            dropouts.append({
+                **_label(filepath, time_edf, start_sample / sfreq, length / sfreq),
+                'start_sample': start_sample,
+                'length': length,
+                'kind': criterion,
+            })
+        file_metrics['bytes_read'] = os.path.getsize(filepath)
+        file_metrics['dropout_time'] = (time.perf_counter() - start
+                                        - file_metrics.get('decode_time', 0.0))
+        # report both in the physical values `mne` would read, so they don't depend on the reader
+        units = _mne_units(header, physical, reader)
+        filestats['signal_stats'] = stats if units is None else stats.scale(*units)
+        filestats['envelope'] = (envelope.finish() if units is None else scale_envelope(
+            envelope.finish(), *units))
+
+    return filestats, coverage, dropouts
+
+
+def _signal_stats(header: EdfHeader, physical: bool, reader: str) -> SignalStats:
+    """Empty stats for the chunks of a file, counting samples at the header's limits as
+    clipped.
+
+    Digital samples are clipped at the digital limits. Physical samples are clipped within half a
+    digital step of the physical limits, in the units of the reader (see `EdfHeader.unit_scale`).
+    """
+    channels = header.data_channels
+    if not physical:
+        return SignalStats(len(channels), header.digital_min[channels],
+                           header.digital_max[channels])
+    unit_scale = header.unit_scale[channels] if reader == 'mne' else 1.0
+    return SignalStats(len(channels), header.physical_min[channels] * unit_scale,
+                       header.physical_max[channels] * unit_scale,
+                       np.abs(header.gain[channels]) * unit_scale / 2)
+
+
+def _mne_units(header: EdfHeader, physical: bool,
+               reader: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(gain, offset) from the values in the chunks of a file to the physical values `mne` would
+    read, or None if they're the same."""
+    channels = header.data_channels
+    if reader == 'mne':
+        return None
+    unit_scale = header.unit_scale[channels]
+    if physical:
+        return unit_scale, np.zeros(len(channels))
+    return header.gain[channels] * unit_scale, header.offset[channels] * unit_scale
+
+
+def _iter_raw_chunks(raw: 'mne.io.BaseRaw', chunk_size: int) -> Iterator[np.ndarray]:
+    """Yields consecutive chunks of samples from an unloaded raw edf."""
+    for start in range(0, raw.n_times, chunk_size):
+        yield raw.get_data(start=start, stop=min(start + chunk_size, raw.n_times))
+
+
+def _get_header_file_stats(filepath: Path) -> FileStats:
+    """Calculates stats and coverage for a single edf file from its header alone."""
+    start = time.perf_counter()
+    header = read_edf_header(filepath)
+    time_edf = pd.Timestamp(header.start_time)
+
+    filestats = {
+        'filepath': filepath,
+        'time_edf': time_edf,
+        'sfreq': header.sfreq,
+        'n_samples': header.n_samples,
+        'n_channels': len(header.data_channels),
+        'duration': header.duration,
+        'metrics': {
+            'bytes_read': header.header_bytes,
+            'header_time': time.perf_counter() - start,
+        },
+    }
+    coverage = [_label(filepath, time_edf, 0.0, header.duration)]
+    return filestats, coverage, []
+
+
+def get_coverage_dataframes(
+    filepaths: List[Path],
+    min_dropout: int = 128 * 60,
+    header_only: bool = False,
+    criterion: str = 'flat',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    reader: str = 'mne',
+    cache: Optional['FileStatsCache'] = None,
+    metrics: Optional[Metrics] = None,
+) -> CoverageFrames:
+    """Calculates stats, coverage and dropout labels for a list of edf files.
+
+    Args:
+        filepaths: List of valid edf filepaths.
+        min_dropout: The minimum number of samples to consider a dropout. -1 disables dropout
+            detection, 0 looks for all dropouts of any length.
+        header_only: Only parse the edf headers and never read sample data. Dropout detection is
+            disabled in this mode.
+        criterion: Dropout criterion, one of `ea_coverage.dropouts.CRITERIA`.
+        chunk_size: Number of samples read into memory at a time for dropout detection.
+        reader: How samples are read, one of `READERS` (see `get_file_stats`).
+        cache: Optional `ea_coverage.cache.FileStatsCache`. Files with a valid entry aren't
+            re-read, and newly processed files are added to it.
+        metrics: Optional `ea_coverage.metrics.Metrics` to add per-file counters to.
+
+    Returns:
+        Tuple of (filestats, coverage, dropouts) DataFrames and a dict of envelope tables (see
+        `collect_file_stats`).
+    """
+    file_stats = [
+        _cached_file_stats(fp, min_dropout, header_only, criterion, chunk_size, reader, cache,
+                           None, metrics) for fp in tqdm(filepaths, unit='file', disable=None)
+    ]
+    return collect_file_stats(file_stats)
+
+
+def get_patient_coverage_dataframes(
+    filepaths: Dict[str, List[Path]],
+    min_dropout: int = 128 * 60,
+    header_only: bool = False,
+    criterion: str = 'flat',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    reader: str = 'mne',
+    caches: Optional[Dict[str, 'FileStatsCache']] = None,
+    journals: Optional[Dict[str, 'FileStatsJournal']] = None,
+    metrics: Optional[Dict[str, Metrics]] = None,
+) -> Dict[str, CoverageFrames]:
+    """Calculates stats, coverage and dropout labels for several dtypes of a patient in one pass.
+
+    Files are processed a recording directory at a time (every dtype of the earliest directory
+    first), rather than a dtype at a time, and are then split back into per-dtype results that
+    match `get_coverage_dataframes` for each dtype.
+
+    Args:
+        filepaths: Dict mapping dtypes to lists of valid edf filepaths (sorted by directory
+            timestamp, see `check_patient_filepaths`).
+        min_dropout: The minimum number of samples to consider a dropout. -1 disables dropout
+            detection, 0 looks for all dropouts of any length.
+        header_only: Only parse the edf headers and never read sample data.
+        criterion: Dropout criterion, one of `ea_coverage.dropouts.CRITERIA`.
+        chunk_size: Number of samples read into memory at a time for dropout detection.
+        reader: How samples are read, one of `READERS` (see `get_file_stats`).
+        caches: Optional dict mapping dtypes to `ea_coverage.cache.FileStatsCache`s.
+        journals: Optional dict mapping dtypes to `ea_coverage.journal.FileStatsJournal`s. Files
+            journaled by an interrupted run aren't re-read, and every newly processed file is
+            appended as soon as it's done.
+        metrics: Optional dict mapping dtypes to `ea_coverage.metrics.Metrics`. The time spent
+            on each file is added to its dtype's `file_stats` stage.
+
+    Returns:
+        Dict mapping dtypes to tuples of (filestats, coverage, dropouts) DataFrames and envelope
+        tables (see `collect_file_stats`).
+    """
+    caches, journals, metrics = caches or {}, journals or {}, metrics or {}
+    # sorting is stable, so each dtype's files stay in order
+    jobs = sorted(((data_type, fp) for data_type, fps in filepaths.items() for fp in fps),
+                  key=lambda job: int(job[1].parent.stem))
+
+    file_stats = {data_type: [] for data_type in filepaths}
+    for data_type, fp in tqdm(jobs, unit='file', disable=None):
+        job_metrics = metrics.get(data_type)
+        with job_metrics.stage('file_stats') if job_metrics is not None else nullcontext():
+            file_stats[data_type].append(
+                _cached_file_stats(fp, min_dropout, header_only, criterion, chunk_size, reader,
+                                   caches.get(data_type), journals.get(data_type), job_metrics))
+
+    return {data_type: collect_file_stats(stats) for data_type, stats in file_stats.items()}
+
+
+def _cached_file_stats(
+    filepath: Path,
+    min_dropout: int,
+    header_only: bool,
+    criterion: str,
+    chunk_size: int,
+    reader: str,
+    cache: Optional['FileStatsCache'],
+    journal: Optional['FileStatsJournal'],
+    metrics: Optional[Metrics],
+) -> FileStats:
+    """`get_file_stats`, reusing a journal or cache entry if there is one.
+
+    Newly processed files are appended to the journal, and both new and journaled files are
+    added to the cache.
+    """
+    stats = journal.get(filepath) if journal is not None else None
+    resumed = stats is not None
+    if not resumed and cache is not None:
+        stats = cache.get(filepath)
+    cached = stats is not None
+    if not cached:
+        stats = get_file_stats(filepath, min_dropout, header_only, criterion, chunk_size, reader)
+        if journal is not None:
+            journal.put(filepath, stats)
+    if cache is not None and (resumed or not cached):
+        cache.put(filepath, stats)
+    if metrics is not None:
+        metrics.add_file(stats[0].get('metrics'), cached)
+    return stats
+
+
+def collect_file_stats(file_stats: Iterable[FileStats]) -> CoverageFrames:
+    """Concatenates the outputs of `get_file_stats` into filestats, coverage, dropouts and
+    envelope tables.
+
+    Each file is assigned a `file_id` in order, matching the rows of `build_file_table`. Dropouts
+    have `DROPOUT_COLUMNS`, which `ea_coverage.runs.build_run_table` turns into a run table. The
+    envelope tables are a dict mapping `envelope_<name>` to a table for each of
+    `ea_coverage.envelopes.ENVELOPES`.
+    """
+    filestats, coverage, dropouts, envelopes = [], [], [], []
+    stats_columns = {}  # ordered set of signal stats columns
+    for file_id, (file_filestats, file_coverage, file_dropouts) in enumerate(file_stats):
+        signal_stats = file_filestats.get('signal_stats')
+        signal_row = signal_stats.to_row() if signal_stats is not None else {}
+        stats_columns.update(dict.fromkeys(signal_row))
+        filestats.append({**file_filestats, **signal_row, 'file_id': file_id})
+        envelopes.append(file_filestats.get('envelope'))
+        coverage.extend({**row, 'file_id': file_id} for row in file_coverage)
+        dropouts.extend({**row, 'file_id': file_id} for row in file_dropouts)
+
+    return (
+        pd.DataFrame(filestats, columns=FILESTATS_COLUMNS + list(stats_columns)).astype(
+            {'file_id': np.int32}),
+        pd.DataFrame(coverage, columns=LABEL_COLUMNS).astype({'file_id': np.int32}),
+        pd.DataFrame(dropouts, columns=DROPOUT_COLUMNS).astype({
+            'file_id': np.int32,
+            'start_sample': np.int64,
+            'length': np.int64,
+        }),
+        build_envelope_tables(envelopes),
+    )
+
+
+def build_file_table(filepaths: List[Path]) -> pd.DataFrame:
+    """Builds the table of files that labels reference by `file_id`.
+
+    Row `i` describes the file with `file_id == i`, so columns can be looked up with
+    `files[col].to_numpy()[labels['file_id']]` instead of parsing paths row by row.
+
+    Args:
+        filepaths: Filepaths in `file_id` order (e.g. `filestats['filepath']`).
+
+    Returns:
+        DataFrame with columns `file_id`, `filepath`, `dir_timestamp` (int64 timestamp from the
+        recording directory name) and `split` (categorical, training or testing).
+    """
+    filepaths = [Path(fp) for fp in filepaths]
+    return pd.DataFrame({
+        'file_id': np.arange(len(filepaths), dtype=np.int32),
+        'filepath': pd.Series(filepaths, dtype=object),
+        'dir_timestamp': np.array([int(fp.parent.stem) for fp in filepaths], dtype=np.int64),
+        'split': pd.Categorical([fp.parent.parent.stem for fp in filepaths], categories=SPLITS),
+    })
+
+
+def _label(filepath: Path, time_edf: pd.Timestamp, start: float, duration: float) -> dict:
+    return {
+        'filepath': filepath,
+        'time_edf': time_edf,
+        'label_start': start,
+        'label_duration': duration,
+    }
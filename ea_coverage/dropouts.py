@@ -0,0 +1,179 @@
+"""Chunked run-length kernel for dropout detection.
+
+Signals are consumed as an iterable of `(n_channels, n_samples)` chunks so memory is bounded by
+the chunk size, not the file size. A criterion marks each sample as dropout or not, and runs of
+marked samples are tracked across chunk boundaries.
+"""
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 128 * 60 * 60
+
+
+class Criterion:
+    """Marks samples that belong to a dropout.
+
+    Attributes:
+        context: Number of trailing samples from the previous chunk prepended to each chunk.
+        lead: Number of samples each run is extended backwards by, for criteria that only mark
+            a sample once it's been compared to earlier samples.
+        scale_invariant: Whether the criterion marks the same samples in unscaled (digital)
+            data, so readers can skip converting to physical values.
+    """
+    context = 0
+    lead = 0
+    scale_invariant = False
+
+    def __call__(self, chunk: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the samples in `chunk[:, self.context:]` that are dropout."""
+        raise NotImplementedError
+
+
+class ZeroCriterion(Criterion):
+    """Every channel is exactly zero (or NaN)."""
+
+    def __call__(self, chunk):
+        return np.all((chunk == 0) | np.isnan(chunk), axis=0)
+
+
+class FlatCriterion(Criterion):
+    """Every channel is unchanged from the previous sample (or NaN)."""
+    context = 1
+    lead = 1
+    scale_invariant = True
+
+    def __call__(self, chunk):
+        current = chunk[:, 1:]
+        return np.all((current == chunk[:, :-1]) | np.isnan(current), axis=0)
+
+
+class VarianceCriterion(Criterion):
+    """Every channel has a rolling variance below `threshold` (or is NaN) over `window` samples."""
+
+    def __init__(self, threshold: float = 1e-6, window: int = 128):
+        assert window > 0, "window must be positive"
+        self.threshold = threshold
+        self.window = window
+        self.context = window - 1
+        self.lead = window - 1
+
+    def __call__(self, chunk):
+        valid = ~np.isnan(chunk)
+        values = np.where(valid, chunk, 0.0)
+
+        def rolling_sum(x):
+            cumsum = np.cumsum(x, axis=1)
+            cumsum = np.concatenate((np.zeros((x.shape[0], 1)), cumsum), axis=1)
+            return cumsum[:, self.window:] - cumsum[:, :-self.window]
+
+        count = rolling_sum(valid.astype(float))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = rolling_sum(values) / count
+            var = rolling_sum(values**2) / count - mean**2
+
+        return np.all((var < self.threshold) | (count == 0), axis=0)
+
+
+CRITERIA = {
+    'zero': ZeroCriterion,
+    'flat': FlatCriterion,
+    'variance': VarianceCriterion,
+}
+
+
+def make_criterion(criterion: Union[str, Criterion] = 'flat', **kwargs) -> Criterion:
+    """Returns a `Criterion` from its name in `CRITERIA` (or passes an instance through)."""
+    if isinstance(criterion, Criterion):
+        return criterion
+    assert criterion in CRITERIA, f"Invalid criterion, expected one of {list(CRITERIA)}"
+    return CRITERIA[criterion](**kwargs)
+
+
+def iter_chunks(data: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """Yields views of `data` (n_channels, n_samples) in chunks along the sample axis."""
+    for start in range(0, data.shape[1], chunk_size):
+        yield data[:, start:start + chunk_size]
+
+
+def find_dropouts(
+    chunks: Union[np.ndarray, Iterable[np.ndarray]],
+    min_dropout: int,
+    criterion: Union[str, Criterion] = 'flat',
+) -> List[Tuple[int, int]]:
+    """Finds runs of dropout samples in a chunked signal.
+
+    Args:
+        chunks: Iterable of consecutive arrays of shape (n_channels, n_samples), or a single
+            array which is processed in chunks of `DEFAULT_CHUNK_SIZE`.
+        min_dropout: Minimum run length (in samples) to report.
+        criterion: Name of a criterion in `CRITERIA`, or a `Criterion` instance.
+
+    Returns:
+        List of (start sample, length) tuples.
+    """
+    if isinstance(chunks, np.ndarray):
+        chunks = iter_chunks(chunks)
+    criterion = make_criterion(criterion)
+    min_length = max(min_dropout, 1)
+
+    starts, ends = [], []
+    offset = 0  # index of the first sample of the current chunk
+    open_start = None  # start of a run that hasn't ended yet
+    context = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float)
+        n_samples = chunk.shape[1]
+        if n_samples == 0:
+            continue
+
+        if context is None:
+            context = np.full((chunk.shape[0], criterion.context), np.nan)
+        mask = criterion(np.concatenate((context, chunk), axis=1))
+        mask[:max(criterion.context - offset, 0)] = False  # context isn't filled yet
+        if criterion.context > 0:
+            context = np.concatenate((context, chunk), axis=1)[:, -criterion.context:]
+
+        chunk_starts, chunk_ends, open_start = _chunk_runs(mask, offset, open_start)
+        starts.append(chunk_starts)
+        ends.append(chunk_ends)
+        offset += n_samples
+
+    if open_start is not None:
+        starts.append(np.array([open_start]))
+        ends.append(np.array([offset]))
+
+    if not starts:
+        return []
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+    starts = np.maximum(starts - criterion.lead, 0)
+    lengths = ends - starts
+
+    keep = lengths >= min_length
+    return list(zip(starts[keep].tolist(), lengths[keep].tolist()))
+
+
+def _chunk_runs(
+    mask: np.ndarray,
+    offset: int,
+    open_start: Optional[int],
+) -> Tuple[np.ndarray, np.ndarray, Optional[int]]:
+    """Finds the runs that end within a chunk, carrying over any run that's still open.
+
+    Returns:
+        Tuple of (run starts, run ends, start of the run left open at the end of the chunk).
+    """
+    edges = np.diff(mask.astype(np.int8), prepend=np.int8(open_start is not None), append=0)
+    starts = np.flatnonzero(edges == 1) + offset
+    ends = np.flatnonzero(edges == -1) + offset
+
+    if open_start is not None:
+        starts = np.concatenate(([open_start], starts))
+
+    new_open_start = None
+    if mask[-1]:
+        new_open_start = starts[-1]
+        starts = starts[:-1]
+        ends = ends[:-1]  # the appended 0 closes the run at the chunk edge
+
+    return starts, ends, new_open_start
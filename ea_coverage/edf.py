@@ -0,0 +1,366 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+HEADER_SIZE = 256
+SIGNAL_HEADER_SIZE = 256
+ANNOTATIONS_LABEL = 'EDF Annotations'
+
+# physical dimensions `mne.io.read_raw_edf` scales to SI units
+MNE_UNIT_SCALES = {'uV': 1e-6, '\u00b5V': 1e-6, '\u03bcV': 1e-6, 'mV': 1e-3}
+
+# (name, width) of each field in the fixed part of the header
+_HEADER_FIELDS = [
+    ('version', 8),
+    ('patient', 80),
+    ('recording', 80),
+    ('startdate', 8),
+    ('starttime', 8),
+    ('header_bytes', 8),
+    ('reserved', 44),
+    ('n_records', 8),
+    ('record_duration', 8),
+    ('n_signals', 4),
+]
+
+# (name, width) of each per-signal field, stored field-by-field for all signals
+_SIGNAL_FIELDS = [
+    ('label', 16),
+    ('transducer', 80),
+    ('physical_dim', 8),
+    ('physical_min', 8),
+    ('physical_max', 8),
+    ('digital_min', 8),
+    ('digital_max', 8),
+    ('prefiltering', 80),
+    ('samples_per_record', 8),
+    ('reserved', 32),
+]
+
+
+class EdfHeader(NamedTuple):
+    """Contents of an EDF/EDF+ header needed to locate and scale the data records."""
+    filepath: Path
+    start_time: datetime
+    header_bytes: int
+    n_records: int
+    record_duration: float
+    labels: List[str]
+    samples_per_record: np.ndarray
+    physical_min: np.ndarray
+    physical_max: np.ndarray
+    digital_min: np.ndarray
+    digital_max: np.ndarray
+    data_channels: List[int]
+    physical_dims: List[str]
+
+    @property
+    def sfreq(self) -> float:
+        """Sample rate of the data channels (Hz)."""
+        return float(self.samples_per_record[self.data_channels].max() / self.record_duration)
+
+    @property
+    def n_samples(self) -> int:
+        """Number of samples in each data channel."""
+        return int(self.n_records * self.samples_per_record[self.data_channels].max())
+
+    @property
+    def duration(self) -> float:
+        """Duration of the recording (seconds)."""
+        return self.n_records * self.record_duration
+
+    @property
+    def gain(self) -> np.ndarray:
+        """Per-signal factor from digital to physical values."""
+        return (self.physical_max - self.physical_min) / (self.digital_max - self.digital_min)
+
+    @property
+    def offset(self) -> np.ndarray:
+        """Per-signal offset from digital to physical values."""
+        return self.physical_min - self.digital_min * self.gain
+
+    @property
+    def unit_scale(self) -> np.ndarray:
+        """Per-signal factor `mne.io.read_raw_edf` applies to physical values, which it converts
+        from uV and mV to V."""
+        return np.array([MNE_UNIT_SCALES.get(dim, 1.0) for dim in self.physical_dims])
+
+
+def read_edf_header(filepath: Path) -> EdfHeader:
+    """Parses the header of an EDF/EDF+ file without reading any sample data.
+
+    Only the fixed 256 byte header and the 256 bytes per signal that follow it are read. The
+    start time is treated as UTC, consistent with `mne.io.read_raw_edf`.
+
+    Args:
+        filepath: Path to edf file.
+
+    Returns:
+        Parsed header.
+
+    Raises:
+        ValueError: If the header is truncated or malformed.
+    """
+    filepath = Path(filepath)
+    with open(filepath, 'rb') as f:
+        raw_header = f.read(HEADER_SIZE)
+        if len(raw_header) < HEADER_SIZE:
+            raise ValueError(f"Truncated header ({len(raw_header)} bytes)")
+        header = _split_fields(raw_header, _HEADER_FIELDS)
+
+        n_signals = int(header['n_signals'])
+        raw_signals = f.read(n_signals * SIGNAL_HEADER_SIZE)
+        if len(raw_signals) < n_signals * SIGNAL_HEADER_SIZE:
+            raise ValueError(f"Truncated signal header ({len(raw_signals)} bytes)")
+
+    signals, offset = {}, 0
+    for name, width in _SIGNAL_FIELDS:
+        signals[name] = [
+            raw_signals[offset + i * width:offset + (i + 1) * width].decode('ascii').strip()
+            for i in range(n_signals)
+        ]
+        offset += n_signals * width
+
+    header_bytes = int(header['header_bytes'])
+    record_duration = float(header['record_duration'])
+    samples_per_record = np.array(signals['samples_per_record'], dtype=np.int64)
+    data_channels = [i for i, label in enumerate(signals['label']) if label != ANNOTATIONS_LABEL]
+    if record_duration <= 0 or not data_channels:
+        raise ValueError("Header contains no data")
+
+    # n_records may be -1 if the recording wasn't closed properly, so infer it from the file size
+    n_records = int(header['n_records'])
+    if n_records < 0:
+        record_bytes = 2 * int(samples_per_record.sum())
+        n_records = (filepath.stat().st_size - header_bytes) // record_bytes
+
+    return EdfHeader(
+        filepath=filepath,
+        start_time=_parse_start_time(header['startdate'], header['starttime']),
+        header_bytes=header_bytes,
+        n_records=n_records,
+        record_duration=record_duration,
+        labels=signals['label'],
+        samples_per_record=samples_per_record,
+        physical_min=np.array(signals['physical_min'], dtype=float),
+        physical_max=np.array(signals['physical_max'], dtype=float),
+        digital_min=np.array(signals['digital_min'], dtype=float),
+        digital_max=np.array(signals['digital_max'], dtype=float),
+        data_channels=data_channels,
+        physical_dims=signals['physical_dim'],
+    )
+
+
+class EdfReader:
+    """Reads the samples of an EDF file in place, by memory-mapping its data records.
+
+    Ranges of data records are mapped as read-only `(n_records, record_samples)` int16 arrays, so
+    slicing records or channels returns views of the file rather than decoded copies. Only the
+    records asked for are mapped, and they're unmapped once the views are dropped, so reading a
+    file chunk by chunk doesn't keep all of it resident. Digital
+    values are only converted to physical values (`digital * gain + offset`) when asked for, and
+    then only for the samples requested. Unlike `mne.io.read_raw_edf`, physical values are left in
+    the header's units (mne converts known units such as uV to SI units), and every data channel
+    must have the same sample rate.
+
+    Args:
+        filepath: Path to edf file.
+        header: Parsed header, if it's already been read.
+
+    Raises:
+        ValueError: If the header is malformed or data channels have different sample rates.
+    """
+
+    def __init__(self, filepath: Path, header: Optional[EdfHeader] = None):
+        self.filepath = Path(filepath)
+        self.header = header if header is not None else read_edf_header(filepath)
+        self.samples_per_record = int(self.header.samples_per_record[self.header.data_channels[0]])
+        if np.any(self.header.samples_per_record[self.header.data_channels]
+                  != self.samples_per_record):
+            raise ValueError("Data channels have different sample rates")
+
+        # offset of each channel's samples within a record
+        self._channel_offsets = np.concatenate(([0], np.cumsum(self.header.samples_per_record)))
+        self.record_samples = int(self._channel_offsets[-1])
+
+        # a file that wasn't closed properly may end part way through a record
+        file_size = self.filepath.stat().st_size
+        available = max((file_size - self.header.header_bytes) // (2 * self.record_samples), 0)
+        self.n_records = int(min(self.header.n_records, available))
+
+        self.gain = self.header.gain
+        self.offset = self.header.offset
+
+    @property
+    def n_channels(self) -> int:
+        """Number of data channels."""
+        return len(self.header.data_channels)
+
+    @property
+    def n_samples(self) -> int:
+        """Number of samples in each data channel."""
+        return self.n_records * self.samples_per_record
+
+    def records(self, start_record: int = 0, stop_record: Optional[int] = None) -> np.ndarray:
+        """Maps a range of data records (sliced like `records[start_record:stop_record]`) as a
+        read-only `(n_records, record_samples)` int16 array."""
+        selected = range(self.n_records)[start_record:stop_record]
+        if len(selected) == 0:  # numpy can't map an empty range
+            return np.zeros((0, self.record_samples), dtype='<i2')
+        return np.memmap(self.filepath,
+                         dtype='<i2',
+                         mode='r',
+                         offset=self.header.header_bytes + 2 * self.record_samples * selected.start,
+                         shape=(len(selected), self.record_samples))
+
+    def channel(self, channel: int, start_record: int = 0,
+                stop_record: Optional[int] = None) -> np.ndarray:
+        """Digital samples of a data channel over a range of records, as a
+        `(n_records, samples_per_record)` view of the file (no samples are copied)."""
+        return self._channel_view(self.records(start_record, stop_record), channel)
+
+    def read(
+        self,
+        start_record: int = 0,
+        stop_record: Optional[int] = None,
+        channels: Optional[Sequence[int]] = None,
+        physical: bool = True,
+    ) -> np.ndarray:
+        """Samples of data channels over a range of records.
+
+        Args:
+            start_record: First record to read.
+            stop_record: Record to stop before (defaults to the end of the file).
+            channels: Indices of the data channels to read (defaults to all).
+            physical: Scale to physical values (float64). Otherwise the digital int16 values are
+                returned, which is enough for criteria that only compare samples for equality.
+
+        Returns:
+            Array of shape (n_channels, n_samples).
+        """
+        channels = range(self.n_channels) if channels is None else channels
+        records = self.records(start_record, stop_record)
+        data = np.stack([self._channel_view(records, ch).reshape(-1) for ch in channels])
+        if physical:
+            data = self.scale(data, channels)
+        return data
+
+    def scale(self, data: np.ndarray, channels: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Converts digital samples of shape (n_channels, n_samples) to physical values."""
+        idx = np.asarray(self.header.data_channels)[list(
+            range(self.n_channels) if channels is None else channels)]
+        return data * self.gain[idx, None] + self.offset[idx, None]
+
+    def iter_chunks(self, chunk_size: int, physical: bool = True) -> Iterator[np.ndarray]:
+        """Yields consecutive chunks of about `chunk_size` samples (whole records) of every data
+        channel (see `read`)."""
+        chunk_records = max(chunk_size // self.samples_per_record, 1)
+        for start in range(0, self.n_records, chunk_records):
+            yield self.read(start, start + chunk_records, physical=physical)
+
+    def _channel_view(self, records: np.ndarray, channel: int) -> np.ndarray:
+        idx = self.header.data_channels[channel]
+        return records[:, self._channel_offsets[idx]:self._channel_offsets[idx + 1]]
+
+
+def _split_fields(raw: bytes, fields: list) -> dict:
+    """Splits fixed-width ascii fields."""
+    values, offset = {}, 0
+    for name, width in fields:
+        values[name] = raw[offset:offset + width].decode('ascii').strip()
+        offset += width
+    return values
+
+
+def _parse_start_time(startdate: str, starttime: str) -> datetime:
+    """Parses `dd.mm.yy` and `hh.mm.ss` header fields (years 85-99 are 19xx, EDF spec)."""
+    day, month, year = (int(v) for v in startdate.split('.'))
+    hour, minute, second = (int(v) for v in starttime.split('.'))
+    year += 1900 if year >= 85 else 2000
+    return datetime(year, month, day, hour, minute, second, tzinfo=timezone.utc)
+
+
+def write_edf(
+    filepath: Path,
+    data: np.ndarray,
+    start_time: datetime,
+    labels: List[str],
+    sfreq: float = 128.0,
+    samples_per_record: int = 1000,
+):
+    """Writes signals to a 16-bit EDF file.
+
+    Args:
+        filepath: Path to write to.
+        data: Physical values, array of shape (n_channels, n_samples). Padded with the last
+            sample to a whole number of data records.
+        start_time: Start of the recording (UTC).
+        labels: Channel labels.
+        sfreq: Sample rate (Hz) of every channel.
+        samples_per_record: Samples per channel in each data record.
+    """
+    n_channels, n_samples = data.shape
+    n_records = -(-n_samples // samples_per_record)
+    pad = n_records * samples_per_record - n_samples
+    data = np.pad(data, ((0, 0), (0, pad)), mode='edge')
+
+    digital_min, digital_max = -32768, 32767
+    physical_min, physical_max = data.min(axis=1), data.max(axis=1)
+    physical_max = np.where(physical_max > physical_min, physical_max, physical_min + 1)
+    # use the values as they'll be read back from the (8 character) header fields
+    physical_min = np.array([float(_field(v, 8)) for v in physical_min])
+    physical_max = np.array([float(_field(v, 8)) for v in physical_max])
+    scale = (digital_max - digital_min) / (physical_max - physical_min)
+    digital = np.round((data - physical_min[:, None]) * scale[:, None] + digital_min)
+    digital = np.clip(digital, digital_min, digital_max).astype('<i2')
+
+    start_time = start_time.astimezone(timezone.utc)
+    header = ''.join([
+        _field('0', 8),
+        _field('X X X X', 80),
+        _field('Startdate ' + start_time.strftime('%d-%b-%Y').upper() + ' X X X', 80),
+        start_time.strftime('%d.%m.%y'),
+        start_time.strftime('%H.%M.%S'),
+        _field(HEADER_SIZE + n_channels * SIGNAL_HEADER_SIZE, 8),
+        _field('', 44),
+        _field(n_records, 8),
+        _field(samples_per_record / sfreq, 8),
+        _field(n_channels, 4),
+    ])
+    signal_fields = [
+        [_field(label, 16) for label in labels],
+        [_field('', 80)] * n_channels,
+        [_field('', 8)] * n_channels,
+        [_field(v, 8) for v in physical_min],
+        [_field(v, 8) for v in physical_max],
+        [_field(digital_min, 8)] * n_channels,
+        [_field(digital_max, 8)] * n_channels,
+        [_field('', 80)] * n_channels,
+        [_field(samples_per_record, 8)] * n_channels,
+        [_field('', 32)] * n_channels,
+    ]
+    header += ''.join(''.join(values) for values in signal_fields)
+
+    # records hold `samples_per_record` samples of each channel in turn
+    records = digital.reshape(n_channels, n_records, samples_per_record).transpose(1, 0, 2)
+
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(np.ascontiguousarray(records).tobytes())
+
+
+def _field(value, width: int) -> str:
+    """Formats a value as a left-justified, space padded ascii header field."""
+    if isinstance(value, (float, np.floating)):
+        text = f'{value:.{width}g}'
+        for precision in range(width, 0, -1):
+            text = f'{value:.{precision}g}'
+            if len(text) <= width:
+                break
+    else:
+        text = str(value)
+    assert len(text) <= width, f"{text} doesn't fit in {width} characters"
+    return text.ljust(width)
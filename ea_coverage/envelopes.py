@@ -0,0 +1,149 @@
+"""Min/max envelope previews of each recording.
+
+`EnvelopeBuilder` is updated from the chunks the dropout scan reads, and keeps the minimum and
+maximum of each channel over 1 s buckets. Coarser envelopes are built from those buckets, and all
+of them are saved with the results as float32 tables, so plots can show what a recording contains
+without reading the edf files (see `plot_bars(..., envelope='1min')`).
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# envelope name -> bucket length (seconds), saved as `envelope_<name>` results
+ENVELOPES = {'1s': 1, '1min': 60}
+
+# (mins, maxs) of shape (n_channels, n_buckets), per 1 s bucket
+Envelope = Tuple[np.ndarray, np.ndarray]
+
+
+class EnvelopeBuilder:
+    """Per-channel minimum and maximum of consecutive buckets of samples.
+
+    Args:
+        n_channels: Number of channels.
+        sfreq: Sample rate (Hz).
+        bucket_seconds: Length of each bucket (seconds). Buckets are at least a sample long.
+    """
+
+    def __init__(self, n_channels: int, sfreq: float, bucket_seconds: float = 1.0):
+        self.bucket_samples = max(int(round(sfreq * bucket_seconds)), 1)
+        self._mins, self._maxs = [], []
+        self._carry = np.zeros((n_channels, 0))  # samples of an incomplete bucket
+
+    def update(self, chunk: np.ndarray) -> 'EnvelopeBuilder':
+        """Adds the next chunk of samples, of shape (n_channels, n_samples)."""
+        if self._carry.shape[1] > 0:
+            chunk = np.concatenate((self._carry, chunk), axis=1)
+        n_full = chunk.shape[1] // self.bucket_samples * self.bucket_samples
+        if n_full > 0:
+            buckets = chunk[:, :n_full].reshape(len(chunk), -1, self.bucket_samples)
+            self._mins.append(np.fmin.reduce(buckets, axis=2).astype(np.float32))
+            self._maxs.append(np.fmax.reduce(buckets, axis=2).astype(np.float32))
+        self._carry = np.array(chunk[:, n_full:])
+        return self
+
+    def finish(self) -> Envelope:
+        """Returns the (mins, maxs) of every bucket, including a final incomplete one."""
+        mins, maxs = list(self._mins), list(self._maxs)
+        if self._carry.shape[1] > 0:
+            mins.append(np.fmin.reduce(self._carry, axis=1, keepdims=True).astype(np.float32))
+            maxs.append(np.fmax.reduce(self._carry, axis=1, keepdims=True).astype(np.float32))
+        if not mins:
+            empty = np.zeros((len(self._carry), 0), dtype=np.float32)
+            return empty, empty.copy()
+        return np.concatenate(mins, axis=1), np.concatenate(maxs, axis=1)
+
+
+def scale_envelope(envelope: Envelope, gain: np.ndarray, offset: np.ndarray) -> Envelope:
+    """Returns the envelope of `samples * gain + offset` (e.g. physical from digital values)."""
+    gain = np.asarray(gain, dtype=float)[:, None]
+    offset = np.asarray(offset, dtype=float)[:, None]
+    lows, highs = envelope[0] * gain + offset, envelope[1] * gain + offset
+    return np.fmin(lows, highs).astype(np.float32), np.fmax(lows, highs).astype(np.float32)
+
+
+def coarsen_envelope(envelope: Envelope, factor: int) -> Envelope:
+    """Merges every `factor` consecutive buckets of an envelope."""
+    mins, maxs = envelope
+    if mins.shape[1] == 0:
+        return mins, maxs
+    starts = np.arange(0, mins.shape[1], factor)
+    return np.fmin.reduceat(mins, starts, axis=1), np.fmax.reduceat(maxs, starts, axis=1)
+
+
+def build_envelope_tables(envelopes: List[Optional[Envelope]]) -> Dict[str, pd.DataFrame]:
+    """Builds an envelope table for each of `ENVELOPES` from the 1 s envelopes of files.
+
+    Args:
+        envelopes: 1 s envelope of each file in `file_id` order, or None for files that weren't
+            read.
+
+    Returns:
+        Dict mapping `envelope_<name>` to a DataFrame with columns `file_id`, `bucket` (index of
+        the bucket within the file) and `min_<ch>`, `max_<ch>` for each channel.
+    """
+    n_channels = max((len(envelope[0]) for envelope in envelopes if envelope is not None),
+                     default=0)
+    tables = {}
+    for name, seconds in ENVELOPES.items():
+        file_ids, buckets, mins, maxs = [], [], [], []
+        for file_id, envelope in enumerate(envelopes):
+            if envelope is None:
+                continue
+            envelope = coarsen_envelope(envelope, seconds)
+            n_buckets = envelope[0].shape[1]
+            file_ids.append(np.full(n_buckets, file_id, dtype=np.int32))
+            buckets.append(np.arange(n_buckets, dtype=np.int32))
+            mins.append(envelope[0])
+            maxs.append(envelope[1])
+
+        table = {
+            'file_id': np.concatenate(file_ids) if file_ids else np.zeros(0, dtype=np.int32),
+            'bucket': np.concatenate(buckets) if buckets else np.zeros(0, dtype=np.int32),
+        }
+        for prefix, values in [('min', mins), ('max', maxs)]:
+            values = (np.concatenate(values, axis=1)
+                      if values else np.zeros((n_channels, 0), dtype=np.float32))
+            table.update({f'{prefix}_{ch}': values[ch] for ch in range(n_channels)})
+        tables[f'envelope_{name}'] = pd.DataFrame(table)
+    return tables
+
+
+def envelope_segments(
+    envelope: pd.DataFrame,
+    file_starts: np.ndarray,
+    bucket_seconds: float,
+    channel: int = 0,
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Splits an envelope table into per-file segments to draw, scaled to [0, 1].
+
+    Args:
+        envelope: Envelope table (see `build_envelope_tables`).
+        file_starts: Start of each file (int64 UTC epoch ns).
+        bucket_seconds: Bucket length of the envelope (seconds).
+        channel: Channel to draw.
+
+    Yields:
+        Tuples of (file_id, bucket edges as UTC epoch ns, mins, maxs), with a value per edge so
+        the envelope can be drawn as steps. Values are scaled by the channel's range over the
+        whole table.
+    """
+    if len(envelope) == 0:
+        return
+    file_ids = envelope['file_id'].to_numpy()
+    buckets = envelope['bucket'].to_numpy().astype(np.int64)
+    mins = envelope[f'min_{channel}'].to_numpy()
+    maxs = envelope[f'max_{channel}'].to_numpy()
+
+    low, high = np.nanmin(mins), np.nanmax(maxs)
+    span = high - low if high > low else 1.0
+    mins, maxs = (mins - low) / span, (maxs - low) / span
+
+    bucket_ns = int(bucket_seconds * 1e9)
+    bounds = np.flatnonzero(np.diff(file_ids)) + 1
+    for rows in np.split(np.arange(len(file_ids)), bounds):
+        file_id = int(file_ids[rows[0]])
+        edges = file_starts[file_id] + np.append(buckets[rows], buckets[rows[-1]] + 1) * bucket_ns
+        yield (file_id, edges, np.append(mins[rows], mins[rows[-1]]),
+               np.append(maxs[rows], maxs[rows[-1]]))
@@ -0,0 +1,328 @@
+"""Sorted interval index for time-window coverage queries.
+
+Intervals are stored as merged, sorted int64 arrays of UTC epoch nanoseconds, so every query is
+a handful of `np.searchsorted` calls and windows can be evaluated in batches.
+"""
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .globals import DTYPES
+from .utils import load_results
+
+NS_IN_SEC = 10**9
+# `IntervalTable` durations are whole milliseconds, so an int32 holds up to ~24.8 days
+DURATION_UNIT = 10**6
+
+TimeLike = Union[str, int, float, np.datetime64, pd.Timestamp]
+
+
+def to_ns(t) -> Union[int, np.ndarray]:
+    """Converts datetime-likes (naive means UTC) or epoch seconds to UTC epoch ns."""
+    scalar = np.ndim(t) == 0
+    values = pd.Series(np.atleast_1d(t) if scalar else t)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        ns = values.to_numpy(dtype=np.int64) * NS_IN_SEC
+    elif pd.api.types.is_numeric_dtype(values.dtype):
+        ns = np.round(values.to_numpy(dtype=float) * NS_IN_SEC).astype(np.int64)
+    else:
+        times = pd.to_datetime(values, utc=True).dt.tz_localize(None)
+        ns = times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return ns[0] if scalar else ns
+
+
+def label_intervals(labels: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (start, end) arrays of UTC epoch ns for coverage or dropout labels."""
+    if len(labels) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    time_edf = to_ns(labels['time_edf'])
+    starts = time_edf + np.round(labels['label_start'].to_numpy() * NS_IN_SEC).astype(np.int64)
+    ends = starts + np.round(labels['label_duration'].to_numpy() * NS_IN_SEC).astype(np.int64)
+    return starts, ends
+
+
+class IntervalTable:
+    """Compact struct-of-arrays coverage or dropout labels.
+
+    Holds 15 bytes per interval instead of a DataFrame row with a `Path` and a tz-aware timestamp.
+    Filepaths, directory timestamps and splits are looked up in the shared file table, and the
+    start of each file (`time_edf`) is kept once per file.
+
+    Args:
+        starts: Interval starts (int64 UTC epoch ns).
+        durations: Interval durations (int32 ms).
+        file_ids: Row of `files` each interval comes from (uint16).
+        dtype_codes: Index into `DTYPES` of each interval's data type (uint8).
+        files: File table the `file_ids` refer to (see `build_file_table`).
+        file_starts: Start of each file in `files` (int64 UTC epoch ns, used for `time_edf`).
+    """
+    __slots__ = ('starts', 'durations', 'file_ids', 'dtype_codes', 'files', 'file_starts')
+
+    def __init__(
+        self,
+        starts: np.ndarray,
+        durations: np.ndarray,
+        file_ids: np.ndarray,
+        dtype_codes: np.ndarray,
+        files: pd.DataFrame,
+        file_starts: np.ndarray,
+    ):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        durations = np.asarray(durations)
+        if durations.dtype != np.int32:
+            assert np.all(np.abs(durations) <= np.iinfo(np.int32).max), \
+                "Interval durations don't fit in int32 ms (longer than ~24.8 days)"
+        self.durations = durations.astype(np.int32, copy=False)
+        self.file_ids = np.asarray(file_ids, dtype=np.uint16)
+        self.dtype_codes = np.asarray(dtype_codes, dtype=np.uint8)
+        self.files = files
+        self.file_starts = np.asarray(file_starts, dtype=np.int64)
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        labels: pd.DataFrame,
+        files: pd.DataFrame,
+        data_type: str,
+        file_starts: Optional[np.ndarray] = None,
+    ) -> 'IntervalTable':
+        """Converts labels in the DataFrame schema (`file_id`, `time_edf`, `label_start`,
+        `label_duration`) for one dtype.
+
+        Args:
+            labels: Coverage or dropout labels.
+            files: File table that `labels['file_id']` refers to.
+            data_type: Data type of the labels.
+            file_starts: Start of each file (UTC epoch ns). Defaults to the `time_edf` of the
+                labels; pass it to share it between the coverage and dropouts of a result.
+        """
+        assert len(files) <= np.iinfo(np.uint16).max + 1, "Too many files for uint16 file ids"
+        file_ids = labels['file_id'].to_numpy()
+        if file_starts is None:
+            file_starts = np.zeros(len(files), dtype=np.int64)
+            if len(labels) > 0:
+                file_starts[file_ids] = to_ns(labels['time_edf'])
+
+        starts, ends = label_intervals(labels)
+        return cls(
+            starts,
+            np.round((ends - starts) / DURATION_UNIT),
+            file_ids,
+            np.full(len(labels), DTYPES.index(data_type)),
+            files,
+            file_starts,
+        )
+
+    @classmethod
+    def from_results(cls, results: dict, key: str, data_type: str) -> 'IntervalTable':
+        """Converts `results[key]` (e.g. 'coverage' or 'dropouts') of a results dict."""
+        return cls.from_dataframe(results[key], results['files'], data_type)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Converts back to the DataFrame schema of `coverage` and `dropouts`."""
+        file_starts = self.file_starts[self.file_ids]
+        return pd.DataFrame({
+            'file_id': self.file_ids.astype(np.int32),
+            'filepath': self.files['filepath'].to_numpy()[self.file_ids],
+            'time_edf': pd.to_datetime(file_starts, utc=True),
+            'label_start': (self.starts - file_starts) / NS_IN_SEC,
+            'label_duration': self.durations * (DURATION_UNIT / NS_IN_SEC),
+        })
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, idx) -> 'IntervalTable':
+        """Selects intervals by mask, indices or slice, sharing the file table."""
+        return IntervalTable(self.starts[idx], self.durations[idx], self.file_ids[idx],
+                             self.dtype_codes[idx], self.files, self.file_starts)
+
+    @property
+    def ends(self) -> np.ndarray:
+        """Interval ends (int64 UTC epoch ns)."""
+        return self.starts + self.durations.astype(np.int64) * DURATION_UNIT
+
+    def file_column(self, col: str) -> np.ndarray:
+        """Looks up a column of the file table for every interval."""
+        return self.files[col].to_numpy()[self.file_ids]
+
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Merges overlapping and touching intervals into sorted, disjoint intervals."""
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+
+    # a new interval begins wherever a start is beyond every end before it
+    new = np.concatenate(([True], starts[1:] > ends[:-1]))
+    last = np.concatenate((np.flatnonzero(new)[1:] - 1, [len(starts) - 1]))
+    return starts[new], ends[last]
+
+
+def subtract_intervals(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    sub_starts: np.ndarray,
+    sub_ends: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Removes the intervals (sub_starts, sub_ends) from (starts, ends)."""
+    starts, ends = merge_intervals(starts, ends)
+    sub_starts, sub_ends = merge_intervals(sub_starts, sub_ends)
+
+    # split the timeline at every endpoint and keep the pieces covered by one set but not the other
+    points = np.unique(np.concatenate((starts, ends, sub_starts, sub_ends)))
+    if len(points) < 2:
+        return starts[:0], ends[:0]
+    piece_starts, piece_ends = points[:-1], points[1:]
+    keep = _contains(starts, ends, piece_starts) & ~_contains(sub_starts, sub_ends, piece_starts)
+    return merge_intervals(piece_starts[keep], piece_ends[keep])
+
+
+def sweep_intervals(
+    interval_sets: List[Tuple[np.ndarray, np.ndarray]],
+    min_count: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the periods covered by at least `min_count` of the interval sets.
+
+    A sweep line over the sorted endpoints of every set (each merged first, so overlaps within a
+    set count once), in O(n log n) for n intervals in total.
+
+    Args:
+        interval_sets: List of (starts, ends) arrays.
+        min_count: Minimum number of sets covering a period. `len(interval_sets)` gives the
+            intersection of all sets, 1 gives their union.
+
+    Returns:
+        Merged (starts, ends) arrays.
+    """
+    merged = [merge_intervals(starts, ends) for starts, ends in interval_sets]
+    times = np.concatenate([np.concatenate((s, e)) for s, e in merged] + [np.empty(0, np.int64)])
+    deltas = np.concatenate([np.repeat([1, -1], len(s)) for s, _ in merged] + [np.empty(0, int)])
+    if len(times) == 0:
+        return times, times
+
+    # ends sort before starts at the same time, so touching intervals don't overlap
+    order = np.lexsort((deltas, times))
+    times, counts = times[order], np.cumsum(deltas[order])
+    keep = counts[:-1] >= min_count
+    return merge_intervals(times[:-1][keep], times[1:][keep])
+
+
+def intersect_intervals(
+        interval_sets: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Periods covered by every interval set."""
+    return sweep_intervals(interval_sets, len(interval_sets))
+
+
+def union_intervals(
+        interval_sets: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Periods covered by any interval set."""
+    return sweep_intervals(interval_sets, 1)
+
+
+class CoverageIndex:
+    """Merged, sorted coverage intervals for a patient and dtype.
+
+    Args:
+        starts: Interval starts (UTC epoch ns).
+        ends: Interval ends (UTC epoch ns).
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        self.starts, self.ends = merge_intervals(
+            np.asarray(starts, dtype=np.int64),
+            np.asarray(ends, dtype=np.int64),
+        )
+        # covered ns before the start of each interval
+        self._cumulative = np.concatenate(([0], np.cumsum(self.ends - self.starts)))
+
+    @classmethod
+    def from_results(cls, results: dict, subtract_dropouts: bool = True) -> 'CoverageIndex':
+        """Builds an index from `coverage` (minus `dropouts`) of a results dict."""
+        starts, ends = label_intervals(results['coverage'])
+        if subtract_dropouts:
+            starts, ends = subtract_intervals(starts, ends, *label_intervals(results['dropouts']))
+        return cls(starts, ends)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def total(self) -> float:
+        """Total covered time (seconds)."""
+        return self._cumulative[-1] / NS_IN_SEC
+
+    def covered(self, t0: TimeLike, t1: TimeLike) -> Union[float, np.ndarray]:
+        """Covered time (seconds) in the window(s) [t0, t1).
+
+        Args:
+            t0: Window start(s). Datetime-like (naive means UTC) or epoch seconds, scalar or array.
+            t1: Window end(s), same shape as `t0`.
+
+        Returns:
+            Covered seconds per window.
+        """
+        t0, t1 = to_ns(t0), to_ns(t1)
+        return (self._covered_before(t1) - self._covered_before(t0)) / NS_IN_SEC
+
+    def fraction(self, t0: TimeLike, t1: TimeLike) -> Union[float, np.ndarray]:
+        """Fraction of the window(s) [t0, t1) that's covered."""
+        duration = (to_ns(t1) - to_ns(t0)) / NS_IN_SEC
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.covered(t0, t1) / duration
+
+    def contains(self, t: TimeLike) -> Union[bool, np.ndarray]:
+        """Whether time(s) `t` are covered."""
+        return _contains(self.starts, self.ends, to_ns(t))
+
+    def gaps(self, t0: TimeLike, t1: TimeLike) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """Uncovered (start, end) periods in the window [t0, t1)."""
+        t0, t1 = int(to_ns(t0)), int(to_ns(t1))
+        first = np.searchsorted(self.ends, t0, side='right')
+        last = np.searchsorted(self.starts, t1, side='left')
+        covered_starts = np.clip(self.starts[first:last], t0, t1)
+        covered_ends = np.clip(self.ends[first:last], t0, t1)
+
+        gap_starts = np.concatenate(([t0], covered_ends))
+        gap_ends = np.concatenate((covered_starts, [t1]))
+        keep = gap_ends > gap_starts
+        return [(pd.Timestamp(start, tz='UTC'), pd.Timestamp(end, tz='UTC'))
+                for start, end in zip(gap_starts[keep], gap_ends[keep])]
+
+    def _covered_before(self, t: np.ndarray) -> np.ndarray:
+        """Covered ns before time(s) `t` (ns)."""
+        if len(self) == 0:
+            return np.zeros_like(t)
+        idx = np.searchsorted(self.starts, t, side='right') - 1
+        safe_idx = np.maximum(idx, 0)
+        partial = np.clip(t - self.starts[safe_idx], 0, self.ends[safe_idx] - self.starts[safe_idx])
+        return np.where(idx >= 0, self._cumulative[safe_idx] + partial, 0)
+
+
+def load_coverage_index(
+    patient_id: str,
+    data_type: str,
+    subtract_dropouts: bool = True,
+) -> CoverageIndex:
+    """Loads results for a patient and dtype and builds a `CoverageIndex` from them."""
+    results = load_results(
+        patient_id,
+        data_type,
+        keys=['coverage', 'dropouts'],
+        columns=['time_edf', 'label_start', 'label_duration'],
+    )
+    return CoverageIndex.from_results(results, subtract_dropouts)
+
+
+def _contains(starts: np.ndarray, ends: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Whether times `t` fall in any of the sorted, disjoint intervals."""
+    idx = np.searchsorted(starts, t, side='right') - 1
+    if len(starts) == 0:
+        return np.zeros(np.shape(t), dtype=bool)
+    return (idx >= 0) & (t < ends[np.maximum(idx, 0)])
@@ -0,0 +1,122 @@
+"""Append-only journal of per-file `get_file_stats` outputs for resuming interrupted runs.
+
+Each processed file is appended (and flushed) to `INTERIM_PATH/journal` as soon as it's done, so a
+run killed by an OOM, a network error or Ctrl-C can continue with `resume=True` instead of starting
+over. The journal is removed once the results it feeds have been saved.
+
+The journal is a sequence of length-prefixed pickles: the processing parameters, then one record
+per file. A record torn by a crash mid-write is dropped on resume.
+"""
+import os
+import struct
+import threading
+from pathlib import Path
+from pickle import UnpicklingError, dumps, loads
+from typing import Optional
+
+from .cache import file_fingerprint
+from .data import FileStats
+from .globals import INTERIM_PATH
+
+JOURNAL_DIR = 'journal'
+
+_LENGTH = struct.Struct('<Q')
+
+
+class FileStatsJournal:
+    """Journal of per-file stats for a patient and dtype, stored in `INTERIM_PATH/journal`.
+
+    Args:
+        patient_id: Patient ID.
+        data_type: Data type.
+        params: Processing parameters. A journal written with different parameters isn't resumed.
+        resume: Load the entries of an existing journal and append to it. Otherwise any existing
+            journal is discarded.
+    """
+
+    def __init__(
+        self,
+        patient_id: str,
+        data_type: str,
+        params: Optional[dict] = None,
+        resume: bool = False,
+    ):
+        self.params = params or {}
+        self.filepath = (Path(INTERIM_PATH) / JOURNAL_DIR
+                         / f'{patient_id}_{data_type.lower()}_filestats.journal')
+        self.entries = {}
+        self.resumed = 0
+        self._lock = threading.Lock()
+
+        valid_size = self._load() if resume and self.filepath.exists() else 0
+        if resume and self.entries:
+            print(f"  Resuming {patient_id} ({data_type}): {len(self.entries)} files journaled")
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        if valid_size > 0:
+            self._file = open(self.filepath, 'r+b')
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+        else:
+            self._file = open(self.filepath, 'wb')
+            self._write(self.params)
+
+    def get(self, filepath: Path) -> Optional[FileStats]:
+        """Returns journaled stats for a file, or None if it wasn't journaled or has changed."""
+        entry = self.entries.get(str(filepath))
+        if entry is not None and entry['fingerprint'] == file_fingerprint(filepath):
+            self.resumed += 1
+            return entry['file_stats']
+        return None
+
+    def put(self, filepath: Path, file_stats: FileStats):
+        """Appends stats for a file to the journal (safe to call from several threads)."""
+        self._write({
+            'filepath': str(filepath),
+            'fingerprint': file_fingerprint(filepath),
+            'file_stats': file_stats,
+        })
+
+    def remove(self):
+        """Closes and deletes the journal, once its entries are saved elsewhere."""
+        self.close()
+        if self.filepath.exists():
+            self.filepath.unlink()
+
+    def close(self):
+        """Closes the journal, leaving it on disk to be resumed."""
+        with self._lock:
+            if not self._file.closed:
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    def _write(self, record: dict):
+        data = dumps(record)
+        with self._lock:
+            self._file.write(_LENGTH.pack(len(data)) + data)
+            self._file.flush()
+
+    def _load(self) -> int:
+        """Loads entries from an existing journal, returning the size of its intact records (0 if
+        it can't be resumed)."""
+        with open(self.filepath, 'rb') as f:
+            data = f.read()
+
+        records, offset = [], 0
+        while offset + _LENGTH.size <= len(data):
+            (length, ) = _LENGTH.unpack_from(data, offset)
+            end = offset + _LENGTH.size + length
+            if end > len(data):
+                break
+            try:
+                records.append(loads(data[offset + _LENGTH.size:end]))
+            except (UnpicklingError, EOFError, ValueError):
+                break
+            offset = end
+
+        if not records:
+            return 0
+        if records[0] != self.params:
+            print(f"  Not resuming from {self.filepath}, it was written with other parameters")
+            return 0
+        self.entries = {record['filepath']: record for record in records[1:]}
+        return offset
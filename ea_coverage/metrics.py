@@ -0,0 +1,178 @@
+"""Lightweight instrumentation for long `gen_stats` runs.
+
+`Metrics` accumulates wall time per stage and per-file counters (bytes read, samples decoded and
+time spent opening, decoding and searching each file for dropouts), and is saved as a
+`<patient>_<dtype>_metrics.json` next to the results. `profiled` wraps a whole CLI invocation in
+cProfile or pyinstrument.
+"""
+import json
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+MB = 1024 * 1024
+
+# per-file counters returned by `get_file_stats`, summed over processed files
+FILE_COUNTERS = ['bytes_read', 'samples_decoded', 'header_time', 'decode_time', 'dropout_time']
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+
+class Metrics:
+    """Stage timers and per-file counters for one patient and dtype."""
+
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self.stages = {}
+        self.counters = Counter({key: 0 for key in FILE_COUNTERS})
+        self.files = Counter(processed=0, cached=0, dodgy=0)
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Adds the wall time spent in the block to stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_file(self, file_metrics: Optional[dict], cached: bool = False):
+        """Counts a processed (or cached) file, adding its counters from `get_file_stats`."""
+        if cached or file_metrics is None:
+            self.files['cached'] += 1
+            return
+        self.files['processed'] += 1
+        self.counters.update({key: file_metrics.get(key, 0) for key in FILE_COUNTERS})
+
+    def summary(self) -> dict:
+        """Returns every metric as a JSON-serialisable dict."""
+        file_time = self.stages.get('file_stats', 0.0)
+        rates = {'files_per_sec': 0.0, 'mb_per_sec': 0.0}
+        if file_time > 0:
+            rates = {
+                'files_per_sec': self.files['processed'] / file_time,
+                'mb_per_sec': self.counters['bytes_read'] / MB / file_time,
+            }
+
+        return {
+            'started': self.started.isoformat(),
+            'wall_time': time.perf_counter() - self._start,
+            'stages': dict(self.stages),
+            'files': dict(self.files),
+            **{key: _to_builtin(value) for key, value in self.counters.items()},
+            **rates,
+            **peak_rss(),
+        }
+
+    def save(self, fp: Path, **extra) -> Path:
+        """Writes the summary (and any `extra` fields) to a json file."""
+        fp = Path(fp)
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        with open(fp, 'w') as f:
+            json.dump({**extra, **self.summary()}, f, indent=2)
+        return fp
+
+    def print_summary(self):
+        """Prints stage timings and throughput."""
+        summary = self.summary()
+        stages = ', '.join(f'{name} {seconds:.1f} s' for name, seconds in self.stages.items())
+        peak_rss_mb = summary['peak_rss_mb']
+        peak_rss_str = 'n/a' if peak_rss_mb is None else f'{peak_rss_mb:.0f} MB'
+        print(f"  Stages: {stages}")
+        print(f"  {summary['files']['processed']} files processed "
+              f"({summary['files_per_sec']:.2f} files/s, {summary['mb_per_sec']:.1f} MB/s), "
+              f"decode {summary['decode_time']:.1f} s, dropouts {summary['dropout_time']:.1f} s, "
+              f"peak RSS {peak_rss_str}")
+
+
+def timed_chunks(chunks: Iterable[np.ndarray], file_metrics: dict) -> Iterator[np.ndarray]:
+    """Passes chunks through, adding the time spent reading them and their size to a file's
+    `decode_time` and `samples_decoded` counters."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            file_metrics['decode_time'] = (file_metrics.get('decode_time', 0.0)
+                                           + time.perf_counter() - start)
+        file_metrics['samples_decoded'] = file_metrics.get('samples_decoded', 0) + chunk.size
+        yield chunk
+
+
+def peak_rss() -> dict:
+    """Peak resident set size (MB) of this process and of its (finished) child processes, or
+    None where it can't be measured."""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:  # not available on Windows
+        return {'peak_rss_mb': None, 'peak_rss_children_mb': None}
+
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / MB,
+        'peak_rss_children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / MB,
+    }
+
+
+@contextmanager
+def profiled(profiler: str = 'cprofile', output_dir: Path = Path('.'), name: str = 'profile'):
+    """Profiles the block, saving the results to `output_dir`.
+
+    Only the current process is profiled, so for `gen-stats-all` this shows the time spent
+    scheduling and collecting rather than in the workers.
+
+    Args:
+        profiler: 'cprofile' (saves `<name>.prof`, view with e.g. snakeviz) or 'pyinstrument'
+            (saves `<name>.html`, requires `pip install pyinstrument`).
+        output_dir: Directory to save the profile to.
+        name: Filename stem of the profile.
+    """
+    assert profiler in PROFILERS, f"profiler must be one of {PROFILERS}"
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ImportError("pyinstrument profiling requires `pip install pyinstrument`") from err
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            fp = output_dir / f'{name}.html'
+            fp.write_text(prof.output_html())
+            print(prof.output_text(unicode=True, color=False))
+            print(f"Saved profile to {fp}")
+        return
+
+    import cProfile  # pylint: disable=import-outside-toplevel
+    import pstats  # pylint: disable=import-outside-toplevel
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        fp = output_dir / f'{name}.prof'
+        prof.dump_stats(str(fp))
+        pstats.Stats(prof).sort_stats('cumulative').print_stats(20)
+        print(f"Saved profile to {fp}")
+
+
+def _to_builtin(value):
+    """Converts numpy scalars to python numbers for json."""
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,129 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .data import SPLITS
+from .globals import DTYPES, OUTPUT_PATH, PATIENT_IDS
+from .intervals import (
+    NS_IN_SEC,
+    intersect_intervals,
+    label_intervals,
+    subtract_intervals,
+    union_intervals,
+)
+from .utils import load_results
+
+
+def get_overlap(
+    patient_id: str,
+    data_types: Optional[List[str]] = None,
+    split: Optional[str] = None,
+    subtract_dropouts: bool = True,
+    results: Optional[Dict[str, dict]] = None,
+) -> pd.DataFrame:
+    """Finds when all (and any) of a set of dtypes were recorded at the same time.
+
+    Args:
+        patient_id: Patient ID.
+        data_types: Data types to combine (defaults to all of `DTYPES`).
+        split: Only use recordings from 'training' or 'testing' directories (defaults to both).
+        subtract_dropouts: Remove dropouts from each dtype's coverage first.
+        results: Results of each dtype, as loaded by `load_overlap_results` (loaded if not
+            given). Pass them to compute several splits without reloading.
+
+    Returns:
+        DataFrame of intervals with columns `kind` ('intersection' or 'union'), `start`, `end`
+        and `duration` (seconds).
+    """
+    data_types = list(data_types or DTYPES)
+    assert split is None or split in SPLITS, f"split must be one of {SPLITS}"
+    if results is None:
+        results = load_overlap_results(patient_id, data_types)
+
+    interval_sets = []
+    for data_type in data_types:
+        coverage, dropouts = results[data_type]['coverage'], results[data_type]['dropouts']
+        if split is not None:
+            file_split = results[data_type]['files']['split'].to_numpy()
+            coverage = coverage[file_split[coverage['file_id'].to_numpy()] == split]
+            dropouts = dropouts[file_split[dropouts['file_id'].to_numpy()] == split]
+
+        starts, ends = label_intervals(coverage)
+        if subtract_dropouts:
+            starts, ends = subtract_intervals(starts, ends, *label_intervals(dropouts))
+        interval_sets.append((starts, ends))
+
+    overlap = []
+    for kind, (starts, ends) in [
+        ('intersection', intersect_intervals(interval_sets)),
+        ('union', union_intervals(interval_sets)),
+    ]:
+        overlap.append(
+            pd.DataFrame({
+                'kind': kind,
+                'start': pd.to_datetime(starts, utc=True),
+                'end': pd.to_datetime(ends, utc=True),
+                'duration': (ends - starts) / NS_IN_SEC,
+            }))
+    return pd.concat(overlap, ignore_index=True)
+
+
+def load_overlap_results(patient_id: str, data_types: List[str]) -> Dict[str, dict]:
+    """Loads the coverage, dropouts and file table of each dtype, as used by `get_overlap`."""
+    results = {}
+    for data_type in data_types:
+        results[data_type] = load_results(
+            patient_id,
+            data_type,
+            keys=['coverage', 'dropouts', 'files'],
+            columns=['file_id', 'time_edf', 'label_start', 'label_duration', 'split'],
+        )
+        assert results[data_type], \
+            f"No results for {patient_id} ({data_type}), run gen-stats first"
+    return results
+
+
+def overlap(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    subtract_dropouts: bool = True,
+):
+    """Summarises when all selected dtypes were recorded simultaneously, per patient and split.
+
+    Prints total intersection and union hours per patient and split, and saves the intervals to
+    `OUTPUT_PATH/overlap/<patient_id>_overlap.csv`.
+
+    Args:
+        patient_ids: Patient IDs to process (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to combine (defaults to all of `DTYPES`).
+        subtract_dropouts: Remove dropouts from each dtype's coverage first.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    assert all(pid in PATIENT_IDS for pid in patient_ids), "Invalid patient_ids"
+
+    data_types = list(data_types or DTYPES)
+
+    summary = []
+    for patient_id in patient_ids:
+        # every split is computed from the same results, so they're only loaded once
+        results = load_overlap_results(patient_id, data_types)
+        patient_overlap = []
+        for split in [None, *SPLITS]:
+            split_overlap = get_overlap(patient_id, data_types, split, subtract_dropouts, results)
+            split_overlap.insert(0, 'split', split or 'all')
+            patient_overlap.append(split_overlap)
+
+            totals = split_overlap.groupby('kind')['duration'].sum()
+            summary.append({
+                'patient_id': patient_id,
+                'split': split or 'all',
+                'intersection_hours': totals.get('intersection', 0.0) / 3600,
+                'union_hours': totals.get('union', 0.0) / 3600,
+            })
+
+        fp = Path(OUTPUT_PATH) / 'overlap' / f'{patient_id}_overlap.csv'
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        pd.concat(patient_overlap, ignore_index=True).to_csv(fp, index=False)
+
+    print(pd.DataFrame(summary).to_string(index=False))
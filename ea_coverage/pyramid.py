@@ -0,0 +1,214 @@
+"""Multi-resolution coverage pyramid for range aggregates.
+
+Coverage (minus dropouts) is binned into covered seconds per UTC minute, and rolled up into
+covered seconds per hour and per day. Any range sum is then the sum of at most 59 minute bins and
+23 hour bins at each end, plus the day bins in between, no matter how many intervals it spans.
+"""
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .globals import DTYPES, OUTPUT_PATH
+from .intervals import NS_IN_SEC, TimeLike, label_intervals, subtract_intervals, to_ns
+from .utils import load_results
+
+SEC_IN_MIN = 60
+MIN_IN_HR = 60
+HR_IN_DAY = 24
+NS_IN_DAY = HR_IN_DAY * MIN_IN_HR * SEC_IN_MIN * NS_IN_SEC
+
+PYRAMID_KEYS = ['pyramid_origin', 'pyramid_minutes', 'pyramid_hours', 'pyramid_days']
+
+
+class CoveragePyramid:
+    """Covered seconds per minute, hour and day, starting from a UTC midnight.
+
+    Args:
+        origin: Start of the first bin (UTC epoch ns, midnight).
+        minutes: Covered seconds per minute (uint8). Hour and day bins are rolled up from these.
+        hours: Covered seconds per hour (uint16), if already computed.
+        days: Covered seconds per day (uint32, a day doesn't fit in uint16), if already computed.
+    """
+
+    def __init__(
+        self,
+        origin: int,
+        minutes: np.ndarray,
+        hours: Optional[np.ndarray] = None,
+        days: Optional[np.ndarray] = None,
+    ):
+        self.origin = int(origin)
+        self.minutes = minutes
+        if hours is None:
+            hours = minutes.reshape(-1, MIN_IN_HR).sum(axis=1, dtype=np.uint16)
+        if days is None:
+            days = hours.reshape(-1, HR_IN_DAY).sum(axis=1, dtype=np.uint32)
+        self.hours, self.days = hours, days
+
+    @classmethod
+    def from_intervals(cls, starts: np.ndarray, ends: np.ndarray) -> 'CoveragePyramid':
+        """Bins (merged, sorted) intervals of UTC epoch ns."""
+        if len(starts) == 0:
+            return cls(0, np.zeros(0, dtype=np.uint8))
+
+        origin = starts[0] // NS_IN_DAY * NS_IN_DAY
+        n_days = -(-(ends[-1] - origin) // NS_IN_DAY)
+        edges = origin + np.arange(n_days * HR_IN_DAY * MIN_IN_HR + 1, dtype=np.int64) * (
+            SEC_IN_MIN * NS_IN_SEC)
+
+        # covered ns before each minute edge, from a running total over the intervals
+        cumulative = np.concatenate(([0], np.cumsum(ends - starts)))
+        idx = np.searchsorted(starts, edges, side='right') - 1
+        safe_idx = np.maximum(idx, 0)
+        partial = np.clip(edges - starts[safe_idx], 0, ends[safe_idx] - starts[safe_idx])
+        covered = np.where(idx >= 0, cumulative[safe_idx] + partial, 0)
+
+        minutes = np.round(np.diff(covered) / NS_IN_SEC).astype(np.uint8)
+        return cls(origin, minutes)
+
+    @classmethod
+    def from_results(cls, results: dict) -> 'CoveragePyramid':
+        """Loads the pyramid stored in a results dict, or builds it from coverage and dropouts."""
+        if 'pyramid_minutes' in results:
+            return cls(*(results[key] for key in PYRAMID_KEYS))
+        starts, ends = label_intervals(results['coverage'])
+        starts, ends = subtract_intervals(starts, ends, *label_intervals(results['dropouts']))
+        return cls.from_intervals(starts, ends)
+
+    def to_results(self) -> dict:
+        """Returns the pyramid as results keys (see `PYRAMID_KEYS`)."""
+        return dict(zip(PYRAMID_KEYS, [self.origin, self.minutes, self.hours, self.days]))
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        """UTC date of each day bin."""
+        return pd.date_range(pd.Timestamp(self.origin, tz='UTC'), periods=len(self.days), freq='D')
+
+    def covered(self, t0: TimeLike, t1: TimeLike) -> float:
+        """Covered seconds in [t0, t1), to minute resolution (partial minutes are rounded)."""
+        m0, m1 = (int(np.clip(
+            round((to_ns(t) - self.origin) / (SEC_IN_MIN * NS_IN_SEC)), 0, len(self.minutes)))
+                  for t in (t0, t1))
+        if m1 <= m0:
+            return 0.0
+
+        h0, h1 = -(-m0 // MIN_IN_HR), m1 // MIN_IN_HR
+        if h1 <= h0:
+            return float(self.minutes[m0:m1].sum(dtype=np.int64))
+        total = (self.minutes[m0:h0 * MIN_IN_HR].sum(dtype=np.int64)
+                 + self.minutes[h1 * MIN_IN_HR:m1].sum(dtype=np.int64))
+
+        d0, d1 = -(-h0 // HR_IN_DAY), h1 // HR_IN_DAY
+        if d1 <= d0:
+            return float(total + self.hours[h0:h1].sum(dtype=np.int64))
+        return float(total + self.hours[h0:d0 * HR_IN_DAY].sum(dtype=np.int64)
+                     + self.hours[d1 * HR_IN_DAY:h1].sum(dtype=np.int64)
+                     + self.days[d0:d1].sum(dtype=np.int64))
+
+    def daily_wear_time(self) -> pd.Series:
+        """Covered hours per UTC day."""
+        return pd.Series(self.days / 3600, index=self.dates, name='hours')
+
+    def hourly_heatmap(self) -> pd.DataFrame:
+        """Fraction of each hour covered, with a row per UTC day and a column per hour of day."""
+        return pd.DataFrame(self.hours.reshape(-1, HR_IN_DAY) / 3600,
+                            index=self.dates,
+                            columns=pd.RangeIndex(HR_IN_DAY, name='hour'))
+
+
+def build_pyramid(coverage: pd.DataFrame, dropouts: pd.DataFrame) -> dict:
+    """Builds the pyramid for coverage minus dropouts, as results keys for `save_results`."""
+    return CoveragePyramid.from_results({'coverage': coverage, 'dropouts': dropouts}).to_results()
+
+
+def load_pyramid(patient_id: str, data_type: str) -> CoveragePyramid:
+    """Loads the coverage pyramid for a patient and dtype (built on the fly for older results)."""
+    results = load_results(patient_id, data_type, keys=PYRAMID_KEYS)
+    if 'pyramid_minutes' not in results:
+        results = load_results(
+            patient_id,
+            data_type,
+            keys=['coverage', 'dropouts'],
+            columns=['time_edf', 'label_start', 'label_duration'],
+        )
+    assert results, f"No results for {patient_id} ({data_type}), run gen-stats first"
+    return CoveragePyramid.from_results(results)
+
+
+def daily_wear_time(patient_id: str, data_types: Optional[List[str]] = None) -> pd.DataFrame:
+    """Covered hours per UTC day for each dtype (one column per dtype)."""
+    data_types = list(data_types or DTYPES)
+    return pd.concat(
+        {dtype: load_pyramid(patient_id, dtype).daily_wear_time() for dtype in data_types},
+        axis=1,
+    ).fillna(0.0)
+
+
+def hourly_heatmap(patient_id: str, data_type: str) -> pd.DataFrame:
+    """Fraction of each hour covered (rows are UTC days, columns hours of day)."""
+    return load_pyramid(patient_id, data_type).hourly_heatmap()
+
+
+def plot_wear_time(
+    patient_id: str,
+    mode: str = 'daily',
+    data_types: Optional[List[str]] = None,
+    figsize: Tuple[float, float] = (18, 8),
+) -> Path:
+    """Plots daily wear time bars per dtype, or an hour-of-day heatmap per dtype.
+
+    Saves to `OUTPUT_PATH/<patient_id>_<mode>_wear_time.png`.
+
+    Args:
+        patient_id: Patient ID.
+        mode: 'daily' (covered hours per day, one bar group per day) or 'heatmap' (fraction of
+            each hour covered, days by hour of day).
+        data_types: Data types to plot (defaults to all of `DTYPES`).
+        figsize: Figure size (inches).
+
+    Returns:
+        Path the plot was saved to.
+    """
+    # matplotlib is slow to import, so only pay for it when actually plotting
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    patient_id = str(patient_id)
+    assert mode in ['daily', 'heatmap'], "mode must be 'daily' or 'heatmap'"
+    data_types = list(data_types or DTYPES)
+
+    if mode == 'daily':
+        wear_time = daily_wear_time(patient_id, data_types)
+        fig, ax = plt.subplots(figsize=figsize)
+        width = 0.8 / len(data_types)
+        x = np.arange(len(wear_time))
+        for i, dtype in enumerate(data_types):
+            ax.bar(x + (i - (len(data_types) - 1) / 2) * width,
+                   wear_time[dtype],
+                   width,
+                   label=dtype)
+        step = max(len(x) // 40, 1)
+        ax.set_xticks(x[::step], wear_time.index[::step].strftime('%Y-%m-%d'), rotation=-90)
+        ax.set_ylim(0, 24)
+        ax.set_ylabel('Hours covered (UTC day)')
+        ax.legend()
+    else:
+        fig, axes = plt.subplots(1, len(data_types), figsize=figsize, sharey=True, squeeze=False)
+        for ax, dtype in zip(axes[0], data_types):
+            heatmap = hourly_heatmap(patient_id, dtype)
+            image = ax.imshow(heatmap.to_numpy(), aspect='auto', vmin=0, vmax=1,
+                              interpolation='nearest', cmap='Greens')
+            ax.set_title(dtype)
+            ax.set_xlabel('Hour of day (UTC)')
+            step = max(len(heatmap) // 25, 1)
+            ax.set_yticks(np.arange(len(heatmap))[::step],
+                          heatmap.index[::step].strftime('%Y-%m-%d'))
+        fig.colorbar(image, ax=axes[0].tolist(), label='Fraction of hour covered')
+
+    fig.suptitle(f'Wear time for patient {patient_id}')
+    fp = Path(OUTPUT_PATH) / f'{patient_id}_{mode}_wear_time.png'
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(str(fp))
+    plt.close(fig)
+    return fp
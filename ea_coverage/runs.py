@@ -0,0 +1,99 @@
+"""Threshold-independent table of dropout runs.
+
+`gen_stats` keeps every dropout run at least `min_run` samples long as a row of
+(file_id, start_sample, length), sorted by length. Every run is found with the same criterion,
+which is saved once with the results (`criterion`) rather than per run. The dropouts for any
+`min_dropout >= min_run` are then a suffix of the table, found with a binary search, so other
+thresholds can be tried without reading the edf files again.
+"""
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+RUN_COLUMNS = ['file_id', 'start_sample', 'length']
+
+# shortest run kept by the scan (samples), unless `min_dropout` is shorter
+DEFAULT_MIN_RUN = 128
+
+
+def build_run_table(dropouts: pd.DataFrame) -> pd.DataFrame:
+    """Builds the run table from dropout rows with `start_sample` and `length` columns.
+
+    Args:
+        dropouts: Dropouts DataFrame from `collect_file_stats`.
+
+    Returns:
+        DataFrame with `RUN_COLUMNS`, sorted by `length` (and by file and start within a length).
+    """
+    order = np.argsort(dropouts['length'].to_numpy(), kind='stable')
+    return pd.DataFrame({
+        'file_id': dropouts['file_id'].to_numpy(dtype=np.int32)[order],
+        'start_sample': dropouts['start_sample'].to_numpy(dtype=np.int64)[order],
+        'length': dropouts['length'].to_numpy(dtype=np.int64)[order],
+    })
+
+
+def select_runs(runs: pd.DataFrame, min_dropout: int) -> pd.DataFrame:
+    """Returns the runs at least `min_dropout` samples long (0 selects every run)."""
+    first = np.searchsorted(runs['length'].to_numpy(), max(min_dropout, 1), side='left')
+    return runs.iloc[first:]
+
+
+def dropouts_from_runs(
+    runs: pd.DataFrame,
+    filestats: pd.DataFrame,
+    files: pd.DataFrame,
+    min_dropout: int,
+) -> pd.DataFrame:
+    """Builds the dropouts DataFrame `gen_stats` would have saved for `min_dropout`.
+
+    Args:
+        runs: Run table (see `build_run_table`).
+        filestats: Filestats with at least `time_edf` and `sfreq`, in `file_id` order.
+        files: File table with at least `filepath` (see `build_file_table`).
+        min_dropout: The minimum number of samples to consider a dropout.
+
+    Returns:
+        Dropouts DataFrame with `LABEL_COLUMNS`, in file and start order.
+    """
+    runs = select_runs(runs, min_dropout)
+    file_ids = runs['file_id'].to_numpy()
+    start_samples = runs['start_sample'].to_numpy()
+    order = np.lexsort((start_samples, file_ids))
+    file_ids, start_samples = file_ids[order], start_samples[order]
+    lengths = runs['length'].to_numpy()[order]
+
+    sfreq = filestats['sfreq'].to_numpy()[file_ids]
+    return pd.DataFrame({
+        'file_id': file_ids.astype(np.int32),
+        'filepath': pd.Series(files['filepath'].to_numpy()[file_ids], dtype=object),
+        'time_edf': filestats['time_edf'].iloc[file_ids].reset_index(drop=True),
+        'label_start': start_samples / sfreq,
+        'label_duration': lengths / sfreq,
+    })
+
+
+def sweep_runs(runs: pd.DataFrame, filestats: pd.DataFrame, thresholds: List[int]) -> pd.DataFrame:
+    """Number and total duration of dropouts for each of several `min_dropout` thresholds.
+
+    Args:
+        runs: Run table (see `build_run_table`).
+        filestats: Filestats with at least `sfreq`, in `file_id` order.
+        thresholds: `min_dropout` values (samples).
+
+    Returns:
+        DataFrame indexed by `min_dropout` with columns `n_dropouts` and `dropout_seconds`.
+    """
+    lengths = runs['length'].to_numpy()
+    seconds = lengths / filestats['sfreq'].to_numpy()[runs['file_id'].to_numpy()]
+    # total duration of the runs from each position to the end of the (length-sorted) table
+    suffix_seconds = np.concatenate((np.cumsum(seconds[::-1])[::-1], [0.0]))
+    first = np.searchsorted(lengths, np.maximum(thresholds, 1), side='left')
+    return pd.DataFrame(
+        {
+            'n_dropouts': len(lengths) - first,
+            'dropout_seconds': suffix_seconds[first],
+        },
+        index=pd.Index(thresholds, name='min_dropout'),
+    )
@@ -0,0 +1,149 @@
+"""Streaming per-channel signal statistics for `filestats`.
+
+`SignalStats` is updated chunk by chunk from the same chunks the dropout scan reads, so it adds no
+I/O and keeps constant memory. Means and variances are combined with Chan et al.'s parallel
+update of Welford's algorithm, so the stats of each chunk are merged into the running stats
+without revisiting any samples.
+"""
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+# per-channel `filestats` columns, suffixed with the channel index (e.g. `mean_0`)
+SIGNAL_STATS = ['mean', 'std', 'min', 'max', 'flat_fraction', 'nan_count', 'clipped_fraction']
+
+
+class SignalStats:
+    """Per-channel count, mean, variance, range, and flat, NaN and clipped sample counts.
+
+    Args:
+        n_channels: Number of channels.
+        lower: Per-channel values at or below which a sample is clipped (e.g. the digital or
+            physical minimum from the edf header). Clipping isn't counted if not given.
+        upper: Per-channel values at or above which a sample is clipped.
+        tolerance: Per-channel tolerance of the clipping limits (e.g. half a digital step for
+            physical values, which are rounded).
+    """
+
+    def __init__(
+        self,
+        n_channels: int,
+        lower: Optional[np.ndarray] = None,
+        upper: Optional[np.ndarray] = None,
+        tolerance: Optional[np.ndarray] = None,
+    ):
+        self.lower = None if lower is None else np.asarray(lower, dtype=float)
+        self.upper = None if upper is None else np.asarray(upper, dtype=float)
+        self.tolerance = np.zeros(n_channels) if tolerance is None else np.asarray(tolerance, float)
+
+        self.n_samples = 0
+        self.count = np.zeros(n_channels, dtype=np.int64)  # non-NaN samples
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)  # sum of squared differences from the mean
+        self.min = np.full(n_channels, np.nan)
+        self.max = np.full(n_channels, np.nan)
+        self.n_nan = np.zeros(n_channels, dtype=np.int64)
+        self.n_flat = np.zeros(n_channels, dtype=np.int64)
+        self.n_clipped = np.zeros(n_channels, dtype=np.int64)
+        self.first = np.full(n_channels, np.nan)
+        self.last = np.full(n_channels, np.nan)
+
+    def update(self, chunk: np.ndarray) -> 'SignalStats':
+        """Adds the next chunk of samples, of shape (n_channels, n_samples)."""
+        if chunk.shape[1] == 0:
+            return self
+        chunk = np.asarray(chunk, dtype=float)
+        valid = ~np.isnan(chunk)
+        count = valid.sum(axis=1)
+        values = np.where(valid, chunk, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, values.sum(axis=1) / count, 0.0)
+        m2 = (np.where(valid, chunk - mean[:, None], 0.0)**2).sum(axis=1)
+
+        # samples equal to the previous one, including the last sample of the previous chunk
+        n_flat = (chunk[:, 1:] == chunk[:, :-1]).sum(axis=1)
+        n_clipped = np.zeros(len(count), dtype=np.int64)
+        if self.lower is not None:
+            n_clipped = ((chunk <= (self.lower + self.tolerance)[:, None])
+                         | (chunk >= (self.upper - self.tolerance)[:, None])).sum(axis=1)
+
+        segment = SignalStats(len(count), self.lower, self.upper, self.tolerance)
+        segment.n_samples = chunk.shape[1]
+        segment.count, segment.mean, segment.m2 = count, mean, m2
+        segment.min, segment.max = np.fmin.reduce(chunk, axis=1), np.fmax.reduce(chunk, axis=1)
+        segment.n_nan = chunk.shape[1] - count
+        segment.n_flat, segment.n_clipped = n_flat, n_clipped
+        segment.first, segment.last = chunk[:, 0].copy(), chunk[:, -1].copy()
+        return self._merge_into(segment)
+
+    def scale(self, gain: np.ndarray, offset: np.ndarray) -> 'SignalStats':
+        """Returns the stats of `samples * gain + offset`, e.g. physical values from stats of
+        digital values. Clipping limits aren't carried over."""
+        gain, offset = np.asarray(gain, dtype=float), np.asarray(offset, dtype=float)
+        scaled = SignalStats(len(self.count))
+        scaled.n_samples, scaled.count = self.n_samples, self.count.copy()
+        scaled.mean = self.mean * gain + offset
+        scaled.m2 = self.m2 * gain**2
+        lows, highs = self.min * gain + offset, self.max * gain + offset
+        scaled.min, scaled.max = np.fmin(lows, highs), np.fmax(lows, highs)
+        scaled.n_nan, scaled.n_flat = self.n_nan.copy(), self.n_flat.copy()
+        scaled.n_clipped = self.n_clipped.copy()
+        scaled.first, scaled.last = self.first * gain + offset, self.last * gain + offset
+        return scaled
+
+    @property
+    def std(self) -> np.ndarray:
+        """Population standard deviation of each channel (NaN for channels with no samples)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, np.sqrt(self.m2 / self.count), np.nan)
+
+    def to_row(self) -> dict:
+        """Returns the stats as `filestats` columns (see `SIGNAL_STATS`)."""
+        n_samples = max(self.n_samples, 1)
+        columns = {
+            'mean': np.where(self.count > 0, self.mean, np.nan),
+            'std': self.std,
+            'min': self.min,
+            'max': self.max,
+            'flat_fraction': self.n_flat / n_samples,
+            'nan_count': self.n_nan,
+            'clipped_fraction': self.n_clipped / n_samples,
+        }
+        return {
+            f'{name}_{channel}': values[channel].item()
+            for name, values in columns.items()
+            for channel in range(len(self.count))
+        }
+
+    def _merge_into(self, other: 'SignalStats') -> 'SignalStats':
+        """Merges `other`, the segment following this one, into this one in place."""
+        if other.n_samples == 0:
+            return self
+        if self.n_samples > 0:
+            self.n_flat += other.n_flat + (self.last == other.first)
+        else:
+            self.n_flat += other.n_flat
+            self.first = other.first
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(count > 0, other.count / count, 0.0)
+            self.m2 = self.m2 + other.m2 + np.where(count > 0,
+                                                    delta**2 * self.count * weight, 0.0)
+        self.mean = self.mean + delta * weight
+        self.count = count
+        self.n_samples += other.n_samples
+        self.min, self.max = np.fmin(self.min, other.min), np.fmax(self.max, other.max)
+        self.n_nan = self.n_nan + other.n_nan
+        self.n_clipped = self.n_clipped + other.n_clipped
+        self.last = other.last
+        return self
+
+
+def tracked_chunks(chunks: Iterable[np.ndarray], stats: SignalStats) -> Iterator[np.ndarray]:
+    """Passes chunks through, adding each one to `stats` (or anything else with an `update`
+    method, such as `ea_coverage.envelopes.EnvelopeBuilder`)."""
+    for chunk in chunks:
+        stats.update(chunk)
+        yield chunk
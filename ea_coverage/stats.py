@@ -0,0 +1,556 @@
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import product
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from ea_coverage.cache import FileStatsCache
+from ea_coverage.journal import FileStatsJournal
+from ea_coverage.data import (
+    DEFAULT_READ_AHEAD,
+    DEFAULT_WALK_WORKERS,
+    FILE_STATS_VERSION,
+    CoverageFrames,
+    build_file_table,
+    check_dir_filepaths,
+    check_patient_filepaths,
+    collect_file_stats,
+    get_coverage_dataframes,
+    get_file_stats,
+    get_patient_coverage_dataframes,
+)
+from .globals import PATIENT_IDS, DTYPES
+from .metrics import Metrics
+from .pyramid import build_pyramid
+from .runs import DEFAULT_MIN_RUN, RUN_COLUMNS, build_run_table, dropouts_from_runs
+from .utils import load_results, metrics_path, results_mtime, save_results
+
+
+def gen_stats(
+    patient_id: str,
+    data_type: Union[str, List[str]],
+    min_dropout: int = 128 * 60,
+    header_only: bool = False,
+    criterion: str = 'flat',
+    reader: str = 'mne',
+    use_cache: bool = True,
+    resume: bool = False,
+    min_run: int = DEFAULT_MIN_RUN,
+    walk_workers: int = DEFAULT_WALK_WORKERS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+):
+    """Processes edf files for a given patient and dtype.
+
+    Args:
+        patient_id: The patient ID to process.
+        data_type: The data type to process, a list of data types, or 'all' for every dtype in
+            `DTYPES`. Several dtypes are processed in a single pass over the patient's recording
+            directories, and results are still saved per dtype.
+        min_dropout: The minimum number of samples to consider a dropout. -1 disables dropout
+            detection, 0 looks for all dropouts of any length.
+        header_only: Compute coverage from the edf headers alone without reading sample data.
+            Implies `min_dropout=-1`.
+        criterion: Dropout criterion, one of `ea_coverage.dropouts.CRITERIA` ('flat', 'zero' or
+            'variance').
+        reader: How samples are read, one of `ea_coverage.data.READERS`. 'memmap' reads them
+            in place from memory-mapped files instead of decoding them with mne.
+        use_cache: Reuse per-file results cached in `INTERIM_PATH` by previous runs, so only new
+            or modified files (or files processed with different parameters) are read.
+        resume: Continue an interrupted run, skipping files already in its journal. Every run
+            journals each file to `INTERIM_PATH/journal` as soon as it's processed, and removes
+            the journal once the results are saved.
+        min_run: Shortest dropout run (in samples) kept in the run table, so `load_results` and
+            `plot_bars` can apply any `min_dropout >= min_run` later (see `ea_coverage.runs`).
+        walk_workers: Number of threads checking edf files (see `check_filepaths`).
+        read_ahead: Maximum number of edf files checked ahead (see `check_filepaths`).
+
+    Saves a results dict per dtype with the following keys:
+        - 'files': Pandas DataFrame of files referenced by `file_id` (see `build_file_table`),
+        - 'filepaths': List of valid edf filepaths,
+        - 'filestats': Pandas DataFrame containing stats about the data
+        - 'dodgy_filepaths': Dict mapping filepaths to error messages,
+        - 'coverage': Pandas DataFrame of coverage labels,
+        - 'dropouts': Pandas DataFrame of dropout labels (longer than `min_dropout`),
+        - 'runs': Pandas DataFrame of every dropout run longer than `min_run`, sorted by length
+          (see `ea_coverage.runs`),
+        - 'envelope_1s', 'envelope_1min': Pandas DataFrames of per-channel min/max envelopes of
+          each file (see `ea_coverage.envelopes`),
+    """
+    patient_id = str(patient_id)
+    assert patient_id in PATIENT_IDS, "Invalid patient_id"
+    data_types = _check_data_types(data_type)
+    min_dropout = _check_min_dropout(min_dropout, header_only)
+    min_run = _check_min_run(min_run, min_dropout)
+
+    metrics = {dtype: Metrics() for dtype in data_types}
+    check_start = time.perf_counter()
+    checked = check_patient_filepaths(
+        patient_id,
+        data_types,
+        workers=walk_workers,
+        read_ahead=read_ahead,
+    )
+    # directories are listed once for every dtype, so each dtype is assigned the total
+    for dtype_metrics in metrics.values():
+        dtype_metrics.stages['check_filepaths'] = time.perf_counter() - check_start
+
+    params = _cache_params(min_run, header_only, criterion, reader)
+    caches = {}
+    if use_cache:
+        caches = {dtype: FileStatsCache(patient_id, dtype, params) for dtype in data_types}
+    journals = {
+        dtype: FileStatsJournal(patient_id, dtype, params, resume=resume)
+        for dtype in data_types
+    }
+
+    print("Calulating file statistics from data...")
+    dataframes = get_patient_coverage_dataframes(
+        {dtype: filepaths for dtype, (filepaths, _) in checked.items()},
+        min_run,
+        header_only,
+        criterion,
+        reader=reader,
+        caches=caches,
+        journals=journals,
+        metrics=metrics,
+    )
+
+    for dtype in data_types:
+        if len(data_types) > 1:
+            print(f"-------- Saving {dtype}")
+        if journals[dtype].resumed > 0:
+            print(f"  {journals[dtype].resumed} files resumed from the journal")
+        cache = caches.get(dtype)
+        if cache is not None:
+            print(f"  {cache.hits} files loaded from cache, {cache.misses} files processed")
+            with metrics[dtype].stage('save_cache'):
+                cache.save()
+
+        print("Saving results...")
+        filepaths, dodgy_filepaths = checked[dtype]
+        with metrics[dtype].stage('save_results'):
+            _save_stats(patient_id, dtype, filepaths, dodgy_filepaths, dataframes[dtype],
+                        min_dropout, min_run, criterion)
+        journals[dtype].remove()
+        _save_metrics(metrics[dtype], patient_id, dtype, dodgy_filepaths)
+
+
+def gen_stats_all(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    min_dropout: int = 128 * 60,
+    workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+    header_only: bool = False,
+    criterion: str = 'flat',
+    reader: str = 'mne',
+    use_cache: bool = True,
+    resume: bool = False,
+    min_run: int = DEFAULT_MIN_RUN,
+    walk_workers: int = DEFAULT_WALK_WORKERS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+):
+    """Processes edf files for every (patient, dtype) pair over a pool of processes.
+
+    Individual edf files are distributed over the pool rather than whole (patient, dtype) pairs,
+    so large patients don't serialise the run. Results are collected in submission order and
+    saved to the same files as `gen_stats`.
+
+    Args:
+        patient_ids: Patient IDs to process (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to process (defaults to all of `DTYPES`).
+        min_dropout: The minimum number of samples to consider a dropout. -1 disables dropout
+            detection, 0 looks for all dropouts of any length.
+        workers: Number of worker processes (defaults to the number of CPUs).
+        max_memory: Address space limit for each worker in MB. Files that exceed it (or fail to
+            be processed for any other reason) are recorded in `dodgy_filepaths` instead of
+            crashing the run. If a worker process dies, the run stops without saving the
+            unfinished jobs, and can be continued with `resume`.
+        header_only: Compute coverage from the edf headers alone without reading sample data.
+            Implies `min_dropout=-1`.
+        criterion: Dropout criterion, one of `ea_coverage.dropouts.CRITERIA`.
+        reader: How samples are read, one of `ea_coverage.data.READERS`.
+        use_cache: Reuse per-file results cached in `INTERIM_PATH` by previous runs.
+        resume: Continue an interrupted run, skipping files already in its journal.
+        min_run: Shortest dropout run (in samples) kept in the run table.
+        walk_workers: Number of threads checking edf files in each job (see `check_filepaths`).
+        read_ahead: Maximum number of edf files checked ahead (see `check_filepaths`).
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    data_types = list(data_types or DTYPES)
+    assert all(pid in PATIENT_IDS for pid in patient_ids), "Invalid patient_ids"
+    assert all(dtype in DTYPES for dtype in data_types), "Invalid data_types"
+    min_dropout = _check_min_dropout(min_dropout, header_only)
+    min_run = _check_min_run(min_run, min_dropout)
+    params = _cache_params(min_run, header_only, criterion, reader)
+
+    jobs = list(product(patient_ids, data_types))
+    metrics = {job: Metrics() for job in jobs}
+    check_start = time.perf_counter()
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_limit_memory,
+            initargs=(max_memory, ),
+    ) as executor:
+        print(f"Checking filepaths for {len(patient_ids)} patients...")
+        checked_patients = dict(
+            zip(
+                patient_ids,
+                executor.map(
+                    partial(check_patient_filepaths,
+                            data_types=data_types,
+                            workers=walk_workers,
+                            read_ahead=read_ahead), patient_ids)))
+        checked = [checked_patients[patient_id][data_type] for patient_id, data_type in jobs]
+        # filepaths are checked for every job at once, so each job is assigned the total
+        for job_metrics in metrics.values():
+            job_metrics.stages['check_filepaths'] = time.perf_counter() - check_start
+
+        print("Submitting files...")
+        submit_start = time.perf_counter()
+        caches, journals, futures = [], [], []
+        for (patient_id, data_type), (filepaths, _) in zip(jobs, checked):
+            cache = FileStatsCache(patient_id, data_type, params) if use_cache else None
+            caches.append(cache)
+            journal = FileStatsJournal(patient_id, data_type, params, resume=resume)
+            journals.append(journal)
+
+            # journaled and cached entries are collected as-is, everything else is submitted to
+            # the pool and journaled as soon as it's done (in whatever order files finish)
+            job_futures = []
+            for fp in filepaths:
+                cached = journal.get(fp)
+                if cached is not None:
+                    if cache is not None:
+                        cache.put(fp, cached)
+                elif cache is not None:
+                    cached = cache.get(fp)
+                if cached is None:
+                    cached = executor.submit(get_file_stats,
+                                             fp,
+                                             min_run,
+                                             header_only,
+                                             criterion,
+                                             reader=reader)
+                    cached.add_done_callback(partial(_journal_result, journal, fp))
+                job_futures.append(cached)
+            futures.append(job_futures)
+
+        progress = tqdm(total=sum(len(fps) for fps, _ in checked), unit='file', disable=None)
+        for job, (filepaths, dodgy_filepaths), cache, journal, job_futures in zip(
+                jobs, checked, caches, journals, futures):
+            patient_id, data_type = job
+            progress.write(f'-------- Collecting patient {patient_id} ({data_type})')
+            job_metrics = metrics[patient_id, data_type]
+            file_stats = []
+            for fp, future in zip(filepaths, job_futures):
+                progress.update()
+                if not isinstance(future, Future):
+                    file_stats.append(future)
+                    job_metrics.add_file(None, cached=True)
+                    continue
+                try:
+                    file_stats.append(future.result())
+                except BrokenProcessPool:
+                    # a worker was killed (e.g. by the OOM killer), so every file still pending
+                    # fails too. Stop without saving, keeping the journals of unsaved jobs
+                    for unsaved_journal in journals:
+                        unsaved_journal.close()
+                    progress.close()
+                    print("A worker process died, continue the run with --resume")
+                    raise
+                except MemoryError:
+                    dodgy_filepaths[fp] = f"MemoryError: exceeded {max_memory} MB"
+                    continue
+                except Exception as err:  # pylint: disable=broad-except
+                    # raised by `get_file_stats`, e.g. for a malformed file
+                    dodgy_filepaths[fp] = f"{type(err).__name__}: {err}"
+                    continue
+                job_metrics.add_file(file_stats[-1][0].get('metrics'))
+                if cache is not None:
+                    cache.put(fp, file_stats[-1])
+
+            # jobs are processed concurrently, so this is the time from submission until the job's
+            # last file was done rather than the time spent on it
+            job_metrics.stages['file_stats'] = time.perf_counter() - submit_start
+
+            if journal.resumed > 0:
+                progress.write(f"  {journal.resumed} files resumed from the journal")
+            if cache is not None:
+                progress.write(
+                    f"  {cache.hits} files loaded from cache, {cache.misses} files processed")
+                with job_metrics.stage('save_cache'):
+                    cache.save()
+
+            valid_filepaths = [fp for fp in filepaths if fp not in dodgy_filepaths]
+            with job_metrics.stage('save_results'):
+                _save_stats(patient_id, data_type, valid_filepaths, dodgy_filepaths,
+                            collect_file_stats(file_stats), min_dropout, min_run, criterion)
+            journal.remove()
+            _save_metrics(job_metrics, patient_id, data_type, dodgy_filepaths, workers=workers)
+        progress.close()
+
+
+def update_stats(
+    patient_id: str,
+    dir_paths: Union[str, Iterable[str]],
+    data_types: Optional[List[str]] = None,
+    reader: str = 'mne',
+    use_cache: bool = True,
+) -> List[str]:
+    """Processes new (or changed) recording directories and merges them into saved results.
+
+    Only the edf files in `dir_paths` are read. They're processed with the `min_run` and
+    `criterion` of the saved results, and the merged results are saved as if `gen_stats` had
+    been run on every directory. Dtypes without results are generated from scratch with
+    `gen_stats`.
+
+    Args:
+        patient_id: Patient ID.
+        dir_paths: Recording directory (`<data_dir>/<patient_id>/<split>/<timestamp>`), or a
+            list of them. Relative and absolute paths to the same files are treated alike.
+        data_types: Data types to update (defaults to all of `DTYPES`).
+        reader: How samples are read, one of `ea_coverage.data.READERS`.
+        use_cache: Add the new files to the per-file cache (see `gen_stats`).
+
+    Returns:
+        Data types whose results were saved.
+    """
+    patient_id = str(patient_id)
+    assert patient_id in PATIENT_IDS, "Invalid patient_id"
+    data_types = list(data_types or DTYPES)
+    if isinstance(dir_paths, (str, Path)):
+        dir_paths = [dir_paths]
+    dir_paths = sorted((Path(dir_path) for dir_path in dir_paths),
+                       key=lambda dir_path: int(dir_path.name))
+
+    missing = [dtype for dtype in data_types if results_mtime(patient_id, dtype) is None]
+    if missing:
+        print(f"No results for {patient_id} ({', '.join(missing)}), generating them")
+        gen_stats(patient_id, missing, reader=reader, use_cache=use_cache)
+
+    checked = check_dir_filepaths(dir_paths, data_types)
+    for dtype in data_types:
+        if dtype in missing:
+            continue
+        results = load_results(patient_id, dtype)
+        assert 'runs' in results, f"No run table for {patient_id} ({dtype}), rerun gen-stats"
+        min_run, criterion = results['min_run'], results['criterion']
+
+        filepaths, dodgy_filepaths = checked[dtype]
+        print(f"Updating {patient_id} ({dtype}) with {len(filepaths)} files "
+              f"({len(dodgy_filepaths)} dodgy)...")
+        cache = None
+        if use_cache:
+            cache = FileStatsCache(patient_id, dtype,
+                                   _cache_params(min_run, False, criterion, reader))
+        frames = get_coverage_dataframes(filepaths,
+                                         min_run,
+                                         criterion=criterion,
+                                         reader=reader,
+                                         cache=cache)
+        if cache is not None:
+            cache.save()
+
+        # files in the updated directories replace any earlier results for them
+        updated = {_resolved(dir_path / f'Empatica-{dtype}.edf') for dir_path in dir_paths}
+        all_filepaths = [fp for fp in results['filepaths'] if _resolved(fp) not in updated]
+        all_filepaths = sorted(all_filepaths + filepaths, key=lambda fp: int(Path(fp).parent.stem))
+        all_dodgy_filepaths = {
+            fp: error
+            for fp, error in results['dodgy_filepaths'].items() if _resolved(fp) not in updated
+        }
+        all_dodgy_filepaths.update(dodgy_filepaths)
+
+        _save_stats(patient_id, dtype, all_filepaths, all_dodgy_filepaths,
+                    _merge_frames(results, frames, updated), results['min_dropout'], min_run,
+                    criterion)
+    return data_types
+
+
+def prune_cache(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    clear: bool = False,
+):
+    """Evicts cached per-file results for edf files that no longer exist.
+
+    Args:
+        patient_ids: Patient IDs to prune (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to prune (defaults to all of `DTYPES`).
+        clear: Remove every entry rather than just those for missing files.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    for patient_id, data_type in product(patient_ids, data_types or DTYPES):
+        cache = FileStatsCache(patient_id, data_type)
+        n_entries = len(cache.entries)
+        if clear:
+            cache.entries = {}
+        n_removed = n_entries - len(cache.entries) if clear else cache.prune()
+        print(f"Removed {n_removed}/{n_entries} cache entries for {patient_id} ({data_type})")
+        if n_removed > 0:
+            cache.save()
+
+
+def _journal_result(journal: FileStatsJournal, filepath: Path, future: Future):
+    """Future callback that journals a file's stats as soon as they've been computed."""
+    if not future.cancelled() and future.exception() is None:
+        journal.put(filepath, future.result())
+
+
+def _resolved(filepath: Union[str, Path]) -> str:
+    """Absolute path of a file with symlinks resolved, to compare paths given in any form."""
+    return str(Path(filepath).resolve())
+
+
+def _merge_frames(results: dict, frames: CoverageFrames, updated: set) -> CoverageFrames:
+    """Merges the frames of new files into saved results, renumbering files by directory
+    timestamp like `get_patient_coverage_dataframes`.
+
+    Args:
+        results: Saved results (see `gen_stats`).
+        frames: Frames of the new files (see `collect_file_stats`).
+        updated: Resolved filepaths (str, see `_resolved`) whose saved results are dropped.
+
+    Returns:
+        Frames of every file, with the run table in place of dropouts (see `build_run_table`).
+    """
+    new_filestats, new_coverage, new_runs, new_envelopes = frames
+    old_filestats = results['filestats']
+    kept = np.array([_resolved(fp) not in updated for fp in old_filestats['filepath']], dtype=bool)
+
+    filepaths = (list(old_filestats['filepath'][kept]) + list(new_filestats['filepath']))
+    order = np.argsort([int(Path(fp).parent.stem) for fp in filepaths], kind='stable')
+    merged_ids = np.empty(len(filepaths), dtype=np.int32)
+    merged_ids[order] = np.arange(len(filepaths), dtype=np.int32)
+    # merged file_id of each saved file (-1 if dropped) and of each new file
+    old_ids = np.full(len(old_filestats), -1, dtype=np.int32)
+    old_ids[kept] = merged_ids[:kept.sum()]
+    new_ids = merged_ids[kept.sum():]
+
+    def merge(old: Optional[pd.DataFrame], new: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+        parts = [new.assign(file_id=new_ids[new['file_id'].to_numpy()])]
+        if old is not None:
+            old_file_ids = old_ids[old['file_id'].to_numpy()]
+            parts.insert(0, old[old_file_ids >= 0].assign(file_id=old_file_ids[old_file_ids >= 0]))
+        merged = pd.concat(parts, ignore_index=True).sort_values(by, kind='stable')
+        return merged.reset_index(drop=True).astype({'file_id': np.int32})
+
+    envelopes: Dict[str, pd.DataFrame] = {
+        key: merge(results.get(key), table, ['file_id'])
+        for key, table in new_envelopes.items()
+    }
+    return (
+        merge(old_filestats, new_filestats, ['file_id']),
+        merge(results['coverage'], new_coverage, ['file_id']),
+        merge(results['runs'][RUN_COLUMNS], new_runs[RUN_COLUMNS], ['file_id', 'start_sample']),
+        envelopes,
+    )
+
+
+def _save_stats(
+    patient_id: str,
+    data_type: str,
+    filepaths: List[Path],
+    dodgy_filepaths: dict,
+    dataframes: CoverageFrames,
+    min_dropout: int,
+    min_run: int,
+    criterion: str,
+):
+    """Saves the (filestats, coverage, dropouts, envelopes) of a patient and dtype with its
+    pyramid.
+
+    `dropouts` holds every run of at least `min_run` samples, which is saved as the run table, and
+    only those of at least `min_dropout` samples are saved as dropout labels.
+    """
+    filestats, coverage, runs, envelopes = dataframes
+    files = build_file_table(filestats['filepath'])
+    runs = build_run_table(runs)
+    dropouts = dropouts_from_runs(runs, filestats, files, min_dropout)
+    save_results({
+        'files': files,
+        'filestats': filestats,
+        'filepaths': filepaths,
+        'dodgy_filepaths': dodgy_filepaths,
+        'coverage': coverage,
+        'dropouts': dropouts,
+        'patient_id': patient_id,
+        'data_type': data_type,
+        'min_dropout': min_dropout,
+        'runs': runs,
+        'min_run': min_run,
+        'criterion': criterion,
+        **envelopes,
+        **build_pyramid(coverage, dropouts),
+    })
+
+
+def _save_metrics(
+    metrics: Metrics,
+    patient_id: str,
+    data_type: str,
+    dodgy_filepaths: dict,
+    **extra,
+):
+    """Prints a summary of the run's metrics and saves them next to the results."""
+    metrics.files['dodgy'] = len(dodgy_filepaths)
+    metrics.print_summary()
+    metrics.save(metrics_path(patient_id, data_type),
+                 patient_id=patient_id,
+                 data_type=data_type,
+                 **extra)
+
+
+def _cache_params(min_run: int, header_only: bool, criterion: str, reader: str) -> dict:
+    """Parameters that invalidate cached per-file results when changed.
+
+    Files are scanned for runs of at least `min_run` samples, so changing `min_dropout` alone
+    doesn't invalidate them.
+    """
+    return {
+        'version': FILE_STATS_VERSION,
+        'min_run': min_run,
+        'header_only': header_only,
+        'criterion': criterion,
+        'reader': reader,
+    }
+
+
+def _check_data_types(data_type: Union[str, List[str]]) -> List[str]:
+    """Expands a dtype, list of dtypes or 'all' into a list of dtypes."""
+    if data_type == 'all':
+        return list(DTYPES)
+    data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+    assert data_types and all(dtype in DTYPES for dtype in data_types), "Invalid data_type"
+    return data_types
+
+
+def _check_min_dropout(min_dropout: int, header_only: bool) -> int:
+    """Disables dropout detection for header-only runs, which never see sample data."""
+    if header_only and min_dropout >= 0:
+        print("Dropout detection is disabled for header-only runs (min_dropout=-1)")
+        return -1
+    return min_dropout
+
+
+def _check_min_run(min_run: int, min_dropout: int) -> int:
+    """Shortest run the files are scanned for, which is never longer than `min_dropout`."""
+    if min_dropout < 0:
+        return -1
+    return min(min_run, min_dropout)
+
+
+def _limit_memory(max_memory: Optional[int]):
+    """Pool initializer that caps the address space of a worker process (in MB)."""
+    if max_memory is None:
+        return
+    import resource  # pylint: disable=import-outside-toplevel
+    limit = int(max_memory) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
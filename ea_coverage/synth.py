@@ -0,0 +1,113 @@
+"""Synthetic Empatica-style EDF datasets for benchmarking and testing."""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .data import SPLITS
+from .edf import write_edf
+from .globals import DTYPES
+
+SFREQ = 128.0  # every Empatica stream in the dataset is resampled to 128 Hz
+SAMPLES_PER_RECORD = 1000
+
+DTYPE_CHANNELS = {
+    'ACC': ['Acc x', 'Acc y', 'Acc z', 'Acc Mag'],
+    'BVP': ['BVP'],
+    'EDA': ['EDA'],
+    'HR': ['HR'],
+    'TEMP': ['TEMP'],
+}
+
+
+def gen_synth(
+    data_dir: str,
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    days: int = 30,
+    recordings: int = 30,
+    recording_minutes: float = 60,
+    dropouts: int = 2,
+    dropout_minutes: float = 2,
+    testing_fraction: float = 0.3,
+    start: str = '2021-01-01',
+    seed: int = 0,
+):
+    """Writes a synthetic dataset with the layout of the raw dataset.
+
+    Files are written to `<data_dir>/<patient_id>/{training,testing}/<timestamp>/`, one
+    `Empatica-<dtype>.edf` per dtype, where `<timestamp>` is the start of the recording (and the
+    start time in the edf header).
+
+    Args:
+        data_dir: Root directory to write to. Point this somewhere other than the raw dataset.
+        patient_ids: Patient IDs to generate (defaults to `['2002']`).
+        data_types: Data types to generate (defaults to all of `DTYPES`).
+        days: Number of days that recordings are spread over.
+        recordings: Number of recordings (directories) per patient.
+        recording_minutes: Length of each recording.
+        dropouts: Number of flatline dropouts injected into each recording.
+        dropout_minutes: Length of each dropout.
+        testing_fraction: Fraction of the (latest) recordings put in `testing`.
+        start: Date of the first day.
+        seed: Random seed.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or ['2002'])]
+    data_types = list(data_types or DTYPES)
+    assert all(dtype in DTYPES for dtype in data_types), "Invalid data_types"
+    rng = np.random.default_rng(seed)
+
+    n_samples = int(recording_minutes * 60 * SFREQ)
+    dropout_samples = min(int(dropout_minutes * 60 * SFREQ), n_samples)
+    first_day = int(pd.Timestamp(start, tz='UTC').timestamp())
+
+    for patient_id in patient_ids:
+        timestamps = np.sort(rng.choice(days * 24 * 60 * 60, size=recordings, replace=False))
+        timestamps += first_day
+        n_training = recordings - int(round(recordings * testing_fraction))
+
+        print(f"Writing {recordings} recordings for patient {patient_id}...")
+        for idx, timestamp in enumerate(timestamps):
+            recording_dir = (Path(data_dir) / patient_id / SPLITS[int(idx >= n_training)]
+                             / str(timestamp))
+            start_time = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+            dropout_starts = rng.integers(0, n_samples - dropout_samples + 1, size=dropouts)
+
+            for data_type in data_types:
+                data = synth_signal(data_type, n_samples, rng)
+                for dropout_start in dropout_starts:
+                    dropout = slice(dropout_start, dropout_start + dropout_samples)
+                    data[:, dropout] = data[:, dropout_start:dropout_start + 1]
+
+                write_edf(
+                    recording_dir / f'Empatica-{data_type}.edf',
+                    data,
+                    start_time,
+                    DTYPE_CHANNELS[data_type],
+                    SFREQ,
+                    SAMPLES_PER_RECORD,
+                )
+
+
+def synth_signal(data_type: str, n_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """Generates a plausible signal for a dtype, array of shape (n_channels, n_samples)."""
+    t = np.arange(n_samples) / SFREQ
+
+    def drift(scale):
+        return np.cumsum(rng.normal(0, scale, n_samples))
+
+    if data_type == 'ACC':
+        axes = np.stack([drift(0.05) + rng.normal(offset, 1, n_samples) for offset in [0, 0, 64]])
+        return np.concatenate((axes, np.linalg.norm(axes, axis=0, keepdims=True)))
+    if data_type == 'BVP':
+        return (50 * np.sin(2 * np.pi * 1.2 * t) + rng.normal(0, 5, n_samples))[None, :]
+    if data_type == 'EDA':
+        return np.abs(1 + drift(1e-3))[None, :]
+    if data_type == 'HR':
+        # HR is only updated every second
+        return np.repeat(70 + drift(0.5)[::int(SFREQ)], int(SFREQ))[None, :n_samples]
+    if data_type == 'TEMP':
+        return (33 + drift(1e-4) + rng.normal(0, 0.01, n_samples))[None, :]
+    raise ValueError(f"Invalid data_type {data_type}")
@@ -0,0 +1,96 @@
+from pathlib import Path
+from typing import Optional
+import pickle
+
+from ea_coverage.vis import create_coverage_timeline, draw_coverage_timeline
+from .envelopes import ENVELOPES
+from .globals import PATIENT_IDS, DTYPES, OUTPUT_PATH
+from .intervals import IntervalTable
+from .utils import load_results
+
+BACKENDS = ['plotly', 'matplotlib']
+
+
+def plot_timeline(
+    patient_id: str,
+    batched: bool = True,
+    backend: str = 'plotly',
+    envelope: Optional[str] = None,
+    channel: int = 0,
+) -> Path:
+    """Plot a coverage timeline of all dtypes for a patient.
+
+    Args:
+        patient_id: Patient ID.
+        batched: Draw one trace per (dtype, coverage/dropout) instead of one per interval.
+            Only used by the plotly backend.
+        backend: 'plotly' (exported with kaleido) or 'matplotlib', which draws the same rows
+            with `broken_barh` and saves the PNG directly, and is much faster.
+        envelope: Overlay the signal envelope saved by `gen_stats` on each dtype's row, one of
+            `ea_coverage.envelopes.ENVELOPES` (e.g. '1min'). Only drawn by the matplotlib backend,
+            and saved to a separate file.
+        channel: Channel of the envelope to overlay (channel 0 of dtypes with fewer channels).
+
+    Returns:
+        Path the plot was saved to.
+    """
+    patient_id = str(patient_id)
+    assert patient_id in PATIENT_IDS, f'{patient_id} not in {PATIENT_IDS}'
+    assert backend in BACKENDS, f'backend must be one of {BACKENDS}'
+    assert envelope is None or envelope in ENVELOPES, \
+        f'envelope must be one of {list(ENVELOPES)}'
+    assert envelope is None or backend == 'matplotlib', \
+        'envelopes are only drawn by the matplotlib backend'
+
+    patient_coverage, envelopes = {}, {}
+    for data_type in DTYPES:
+        results = load_results(
+            patient_id,
+            data_type,
+            keys=['coverage', 'dropouts', 'files'],
+            columns=['file_id', 'time_edf', 'label_start', 'label_duration', 'dir_timestamp'],
+        )
+        patient_coverage[data_type] = (
+            IntervalTable.from_results(results, 'coverage', data_type),
+            IntervalTable.from_results(results, 'dropouts', data_type),
+        )
+        if envelope is not None:
+            key = f'envelope_{envelope}'
+            table = load_results(patient_id, data_type, keys=[key]).get(key)
+            assert table is not None, \
+                f"No envelopes for {patient_id} ({data_type}), rerun gen-stats"
+            envelopes[data_type] = (table, channel if f'min_{channel}' in table else 0)
+
+    with open('sztimes.pkl', 'rb') as f:
+        sztimes = pickle.load(f)
+        sztimes = sztimes[patient_id]
+
+    suffix = f'_envelope_{envelope}' if envelope is not None else ''
+    output_filename = f'{patient_id}_coverage_timeline{suffix}.png'
+    fp = Path(OUTPUT_PATH) / Path(output_filename)
+    fp.parent.mkdir(parents=True, exist_ok=True)
+
+    print("Plotting coverage timeline...")
+    if backend == 'matplotlib':
+        import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+        fig = draw_coverage_timeline(patient_id,
+                                     patient_coverage,
+                                     sztimes,
+                                     envelopes=envelopes,
+                                     envelope_seconds=ENVELOPES.get(envelope, 60))
+        print("Saving coverage timeline...")
+        fig.savefig(str(fp))
+        plt.close(fig)
+        return fp
+
+    patient_coverage_fig = create_coverage_timeline(
+        patient_id,
+        patient_coverage,
+        sztimes,
+        batched=batched,
+    )
+
+    print("Saving coverage timeline...")
+    patient_coverage_fig.write_image(str(fp))
+    return fp
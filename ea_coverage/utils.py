@@ -1,37 +1,425 @@
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import time
 import warnings
+from itertools import product
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Union
+from typing import List, Optional, Union
 from pickle import load
 
-import mne
+import numpy as np
+import pandas as pd
 
-from .globals import INTERIM_PATH, PATIENT_IDS, DTYPES
+from .catalog import CatalogWarning, index_results, lookup_results
+from .data import build_file_table
+from .globals import EDF_PATH, INTERIM_PATH, PATIENT_IDS, DTYPES
+from .runs import dropouts_from_runs, sweep_runs
+
+FORMAT_VERSION = 1
+META_FILENAME = 'meta.json'
+
+# default `min_dropout` values for `dropout_sweep` (samples)
+SWEEP_THRESHOLDS = [128 * seconds for seconds in [1, 10, 30, 60, 120, 300, 600, 1800]]
+
+
+def results_path(patient_id: str, data_type: str) -> Path:
+    """Returns the directory that columnar results for a patient and dtype are stored in."""
+    return Path(INTERIM_PATH) / f'{patient_id}_{data_type.lower()}_coverage'
+
+
+def results_mtime(patient_id: str, data_type: str) -> Optional[float]:
+    """Returns when results for a patient and dtype were last saved, or None if there are none."""
+    fp = results_path(patient_id, data_type)
+    for source in [fp / META_FILENAME, fp.with_suffix('.pkl')]:
+        if source.exists():
+            return source.stat().st_mtime
+    return None
+
+
+def metrics_path(patient_id: str, data_type: str) -> Path:
+    """Returns the json file that run metrics for a patient and dtype are saved to."""
+    return Path(INTERIM_PATH) / f'{patient_id}_{data_type.lower()}_metrics.json'
+
+
+def save_results(results: dict) -> Path:
+    """Saves results for a patient and dtype to `INTERIM_PATH` in a columnar format.
+
+    Each DataFrame column and array is written to its own `.npy` file so it can be memory-mapped
+    on load, and everything else (scalars, `dodgy_filepaths`, column types) goes in a small
+    `meta.json` sidecar. Each save is written to a new versioned directory, and `results_path` is
+    a symlink that's switched to it in one atomic rename, so readers always find either the
+    previous or the new results and never a partially written one. The previous version is kept
+    until the next save, for readers that are still loading it. Results are then indexed in the
+    catalog (see `ea_coverage.catalog`). Failing to index them only issues a `CatalogWarning`.
+
+    Args:
+        results: Dict of results, see `gen_stats`. `output_filename` and `data_dir` are added.
+
+    Returns:
+        Path to results directory.
+    """
+    output_filename = f"{results['patient_id']}_{results['data_type'].lower()}_coverage"
+    results = {'output_filename': output_filename, 'data_dir': EDF_PATH, **results}
+
+    fp = results_path(results['patient_id'], results['data_type'])
+    tmp_fp = fp.with_name(f'{fp.name}.{time.time_ns()}')
+    tmp_fp.mkdir(parents=True)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'scalars': {},
+        'tables': {},
+        'arrays': {},
+        'dicts': {},
+    }
+    for key, value in results.items():
+        if isinstance(value, pd.DataFrame):
+            meta['tables'][key] = {
+                'n_rows': len(value),
+                'columns': {
+                    col: _save_column(tmp_fp / f'{key}.{col}.npy', value[col])
+                    for col in value.columns
+                },
+            }
+        elif isinstance(value, (list, np.ndarray)):
+            meta['arrays'][key] = _save_column(tmp_fp / f'{key}.npy', pd.Series(value))
+        elif isinstance(value, dict):
+            meta['dicts'][key] = {
+                'keys': _save_column(tmp_fp / f'{key}.keys.npy', pd.Series(list(value))),
+                'values': _save_column(tmp_fp / f'{key}.values.npy',
+                                       pd.Series(list(value.values()))),
+            }
+        else:
+            meta['scalars'][key] = value
+
+    with open(tmp_fp / META_FILENAME, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    _swap_results(fp, tmp_fp)
+
+    try:
+        index_results(_add_file_table(results), fp)
+    except sqlite3.Error as err:
+        # the results are saved, and `load_results` finds uncatalogued results by name, but the
+        # catalog is stale until it's rebuilt
+        warnings.warn(
+            f"Failed to catalog {fp} ({type(err).__name__}: {err}), run "
+            "`ea-coverage catalog-results` to rebuild the catalog",
+            CatalogWarning,
+            stacklevel=2)
+    return fp
+
+
+def _swap_results(fp: Path, version_fp: Path):
+    """Points the `fp` symlink at a new version of results with an atomic rename, and removes
+    the versions before the one it pointed to."""
+    previous = os.readlink(fp) if fp.is_symlink() else None
+    old_fp = fp.with_name(fp.name + '.old')
+    if fp.is_dir() and not fp.is_symlink():
+        # results saved before they were versioned are moved aside once, and `load_results`
+        # falls back to them until the link is in place
+        if old_fp.exists():
+            shutil.rmtree(old_fp)
+        os.replace(fp, old_fp)
+
+    link_fp = fp.with_name(f'{fp.name}.link{os.getpid()}')
+    if link_fp.is_symlink():
+        link_fp.unlink()
+    os.symlink(version_fp.name, link_fp)
+    os.replace(link_fp, fp)
+
+    # versions are named by when they were started, so versions older than the previous one
+    # aren't used by any reader (e.g. left by interrupted saves), while newer ones may still be
+    # written by another process
+    stale_fps = [fp.with_name(fp.name + '.tmp'), old_fp]
+    for other_fp in fp.parent.glob(glob.escape(fp.name) + '.*'):
+        version = _version(other_fp.name)
+        if previous is not None and version is not None and version < _version(previous):
+            stale_fps.append(other_fp)
+    for stale_fp in stale_fps:
+        shutil.rmtree(stale_fp, ignore_errors=True)
+
+
+def _version(name: str) -> Optional[int]:
+    """Returns the version of a versioned results directory name, or None."""
+    suffix = name.rpartition('.')[2]
+    return int(suffix) if suffix.isdigit() else None
 
 
 def load_results(
     patient_id: str = '2002',
     data_type: str = 'BVP',
+    keys: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+    min_dropout: Optional[int] = None,
 ) -> dict:
-    """Loads results from a pickle file.
+    """Loads results for a patient and dtype.
+
+    Results are located by name, or through the catalog (see `ea_coverage.catalog`) if they
+    aren't there, so the catalog database is only opened for results saved elsewhere. Columns are
+    memory-mapped from the columnar format written by `save_results`, and only the requested keys
+    and columns are read. Falls back to legacy pickled results if there are no columnar results
+    (see `convert_results`).
 
     Args:
-        results_filepath: Path to the pickle file.
+        patient_id: Patient ID.
+        data_type: Data type.
+        keys: Keys of the results dict to load (defaults to all). See `gen_stats`.
+        columns: Columns to load from each DataFrame (defaults to all).
+        min_dropout: Rebuild `dropouts` (and `min_dropout`) for this threshold from the run table
+            instead of loading those saved by `gen_stats`. Must be at least the `min_run` the
+            results were generated with.
 
     Returns:
-        Dictionary of results. See docs for `main` for more info.
+        Dictionary of results. See docs for `gen_stats` for more info.
     """
+    patient_id = str(patient_id)
     assert patient_id in PATIENT_IDS, "Invalid patient_id"
     assert data_type in DTYPES, "Invalid data_type"
 
-    output_filename = f'{patient_id}_{data_type.lower()}_coverage'
-    fp = Path(INTERIM_PATH) / Path(output_filename + '.pkl')
+    fp = results_path(patient_id, data_type)
+    old_fp = fp.with_name(fp.name + '.old')
+    if not (fp / META_FILENAME).exists() and (old_fp / META_FILENAME).exists():
+        # unversioned results that are being replaced (see `save_results`)
+        fp = old_fp
+    if not (fp / META_FILENAME).exists():
+        # only consult the catalog for results that aren't where `save_results` puts them
+        catalogued_fp = lookup_results(patient_id, data_type)
+        if catalogued_fp is not None and (catalogued_fp / META_FILENAME).exists():
+            fp = catalogued_fp
+    if not (fp / META_FILENAME).exists():
+        assert min_dropout is None, f"No run table for {patient_id} ({data_type}), rerun gen-stats"
+        return _load_pickled_results(results_path(patient_id, data_type).with_suffix('.pkl'),
+                                     keys, columns)
+
+    print(f"Loading results from {fp}")
+    # every file is read from the same version, even if new results are swapped in meanwhile
+    fp = fp.resolve()
+    with open(fp / META_FILENAME) as f:
+        meta = json.load(f)
+
+    # results saved before file tables were added need every key to build one
+    legacy = 'files' not in meta['tables']
+    if legacy:
+        keys_, columns_, keys, columns = keys, columns, None, None
+
+    def selected(key):
+        return keys is None or key in keys
+
+    results = {key: value for key, value in meta['scalars'].items() if selected(key)}
+    for key in meta['tables']:
+        if selected(key):
+            results[key] = _load_table(fp, meta, key, columns)
+    for key, kind in meta['arrays'].items():
+        if selected(key):
+            values = _load_column(fp / f'{key}.npy', kind)
+            results[key] = values if kind == 'numeric' else list(values)
+    for key, kinds in meta['dicts'].items():
+        if selected(key):
+            results[key] = dict(
+                zip(
+                    _load_column(fp / f'{key}.keys.npy', kinds['keys']),
+                    _load_column(fp / f'{key}.values.npy', kinds['values']),
+                ))
+
+    if legacy:
+        results = _select(_add_file_table(results), keys_, columns_)
+    if min_dropout is not None and selected('dropouts'):
+        results['dropouts'] = _select_dropouts(fp, meta, min_dropout, columns)
+        if selected('min_dropout'):
+            results['min_dropout'] = min_dropout
+    return results
 
+
+def dropout_sweep(
+    patient_id: str,
+    data_type: str,
+    thresholds: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """Number and total duration of dropouts for a range of `min_dropout` thresholds.
+
+    Computed from the run table saved by `gen_stats`, without reading any edf files.
+
+    Args:
+        patient_id: Patient ID.
+        data_type: Data type.
+        thresholds: `min_dropout` values in samples (defaults to `SWEEP_THRESHOLDS` that are at
+            least the results' `min_run`).
+
+    Returns:
+        DataFrame indexed by `min_dropout` with columns `n_dropouts` and `dropout_seconds`.
+    """
+    results = load_results(
+        patient_id,
+        data_type,
+        keys=['runs', 'filestats', 'min_run'],
+        columns=['file_id', 'length', 'sfreq'],
+    )
+    assert 'runs' in results, f"No run table for {patient_id} ({data_type}), rerun gen-stats"
+    min_run = results['min_run']
+    assert min_run >= 0, "Dropout detection was disabled for these results"
+    if thresholds is None:
+        thresholds = [threshold for threshold in SWEEP_THRESHOLDS if threshold >= min_run]
+    assert all(threshold >= min_run for threshold in thresholds), \
+        f"Thresholds must be at least min_run ({min_run} samples)"
+    return sweep_runs(results['runs'], results['filestats'], list(thresholds))
+
+
+def print_dropout_sweep(
+    patient_id: str,
+    data_type: str,
+    thresholds: Optional[List[int]] = None,
+):
+    """Prints `dropout_sweep` as a table (with `min_dropout` in seconds at 128 Hz as well)."""
+    sweep = dropout_sweep(patient_id, data_type, thresholds)
+    sweep.insert(0, 'min_dropout_sec', sweep.index / 128)
+    print(sweep.to_string())
+
+
+def convert_results(
+    patient_ids: Optional[List[str]] = None,
+    data_types: Optional[List[str]] = None,
+    remove: bool = False,
+):
+    """Converts legacy pickled results in `INTERIM_PATH` to the columnar format.
+
+    Args:
+        patient_ids: Patient IDs to convert (defaults to all of `PATIENT_IDS`).
+        data_types: Data types to convert (defaults to all of `DTYPES`).
+        remove: Delete each pickle once it has been converted.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    for patient_id, data_type in product(patient_ids, data_types or DTYPES):
+        pkl_fp = results_path(patient_id, data_type).with_suffix('.pkl')
+        if not pkl_fp.exists():
+            continue
+
+        print(f"Converting {pkl_fp}")
+        with open(pkl_fp, 'rb') as f:
+            results = load(f)
+        save_results(results)
+
+        if remove:
+            pkl_fp.unlink()
+
+
+def _load_table(fp: Path, meta: dict, key: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    """Loads (the selected columns of) a DataFrame saved by `save_results`."""
+    kinds = meta['tables'][key]
+    return pd.DataFrame(
+        {
+            col: _load_column(fp / f'{key}.{col}.npy', kind)
+            for col, kind in kinds['columns'].items()
+            if columns is None or col in columns
+        },
+        index=pd.RangeIndex(kinds['n_rows']),
+        copy=False,
+    )
+
+
+def _select_dropouts(
+    fp: Path,
+    meta: dict,
+    min_dropout: int,
+    columns: Optional[List[str]],
+) -> pd.DataFrame:
+    """Builds dropouts for `min_dropout` from the run table of columnar results."""
+    assert 'runs' in meta['tables'], f"No run table in {fp}, rerun gen-stats"
+    min_run = meta['scalars']['min_run']
+    assert min_run >= 0, f"Dropout detection was disabled for the results in {fp}"
+    assert min_run <= min_dropout, \
+        f"min_dropout must be at least min_run ({min_run} samples) of the results in {fp}"
+    dropouts = dropouts_from_runs(
+        _load_table(fp, meta, 'runs', None),
+        _load_table(fp, meta, 'filestats', ['time_edf', 'sfreq']),
+        _load_table(fp, meta, 'files', ['filepath']),
+        min_dropout,
+    )
+    return dropouts if columns is None else dropouts[[
+        col for col in dropouts.columns if col in columns
+    ]]
+
+
+def _save_column(fp: Path, values: pd.Series) -> str:
+    """Saves a column to a `.npy` file and returns its kind."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        np.save(fp, values.cat.codes.to_numpy())
+        return 'category:' + json.dumps(values.cat.categories.tolist())
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        utc = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        np.save(fp, utc.to_numpy(dtype='datetime64[ns]').view(np.int64))
+        return f'datetime:{values.dt.tz}'
+    if values.dtype == object and len(values) > 0 and isinstance(values.iloc[0], Path):
+        np.save(fp, values.astype(str).to_numpy(dtype=str))
+        return 'path'
+    if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        np.save(fp, values.astype(str).to_numpy(dtype=str))
+        return 'str'
+    np.save(fp, values.to_numpy())
+    return 'numeric'
+
+
+def _load_column(fp: Path, kind: str) -> Union[np.ndarray, pd.Series]:
+    """Loads a column saved by `_save_column`, memory-mapping its `.npy` file."""
+    values = np.load(fp, mmap_mode='r')
+    if kind.startswith('category:'):
+        categories = json.loads(kind.split(':', 1)[1])
+        return pd.Categorical.from_codes(values, categories=categories)
+    if kind.startswith('datetime:'):
+        tz = kind.split(':', 1)[1]
+        return pd.Series(values.view('datetime64[ns]')).dt.tz_localize('UTC').dt.tz_convert(tz)
+    if kind == 'path':
+        return pd.Series([Path(v) for v in values], dtype=object)
+    if kind == 'str':
+        return pd.Series(values, dtype=object)
+    return values
+
+
+def _load_pickled_results(
+    fp: Path,
+    keys: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+) -> dict:
+    """Loads legacy results from a pickle file."""
     if not fp.exists():
-        print(f"No results found for {patient_id}")
+        print(f"No results found at {fp}")
         return {}
 
     print(f"Loading results from {fp}")
     with open(fp, 'rb') as f:
         results = load(f)
 
+    return _select(_add_file_table(results), keys, columns)
+
+
+def _select(
+    results: dict,
+    keys: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+) -> dict:
+    """Selects keys from results, and columns from each DataFrame."""
+    if keys is not None:
+        results = {key: value for key, value in results.items() if key in keys}
+    if columns is not None:
+        results = {
+            key: value[[col for col in value.columns if col in columns]]
+            if isinstance(value, pd.DataFrame) else value
+            for key, value in results.items()
+        }
+    return results
+
+
+def _add_file_table(results: dict) -> dict:
+    """Adds the file table and `file_id` columns to results saved before they existed."""
+    if 'files' in results:
+        return results
+
+    files = build_file_table(results['filestats']['filepath'])
+    file_ids = {fp: file_id for file_id, fp in zip(files['file_id'], files['filepath'])}
+    results = {**results, 'files': files}
+    for key in ['filestats', 'coverage', 'dropouts']:
+        results[key] = results[key].assign(file_id=results[key]['filepath'].map(file_ids))
     return results
@@ -1,2 +1,25 @@
-from .bars import add_bars, add_ax_index
-from .timeline import add_timeline
+import sys
+from importlib import import_module
+
+# public name -> submodule that defines it, imported on first access so that bar plots don't
+# import plotly and timelines don't import matplotlib
+_LAZY_ATTRS = {
+    'add_bars': 'bars',
+    'add_ax_index': 'bars',
+    'add_envelope': 'bars',
+    'ax_positions': 'bars',
+    'create_coverage_timeline': 'timeline',
+    'draw_coverage_timeline': 'timeline',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f'.{_LAZY_ATTRS[name]}', __name__), name)
+    setattr(sys.modules[__name__], name, value)
+    return value
+
+
+def __dir__():
+    return sorted(set(vars(sys.modules[__name__])) | set(_LAZY_ATTRS))
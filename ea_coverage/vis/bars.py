@@ -1,25 +1,30 @@
-from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, Tuple, Optional
 
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from ..envelopes import envelope_segments
+from ..intervals import DURATION_UNIT, NS_IN_SEC, IntervalTable
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 SEC_IN_HR = 60 * 60
 SEC_IN_DAY = 60 * 60 * 24
 
 
 def add_bars(
-    labels: List[Tuple[Path, float, float]],
-    ax: plt.Axes,
+    intervals: IntervalTable,
+    ax: 'plt.Axes',
     legend: Optional[str] = None,
     color: Optional[str] = None,
     alpha: float = 0.5,
     width: float = 0.8,
-) -> plt.Axes:
-    """Plots time labels as bar graphs on an axis.
+) -> 'plt.Axes':
+    """Plots intervals as bars on an axis, one bar per recording directory.
 
     Args:
-        labels: List of tuples containing labels (filepath, start time, duration).
+        intervals: Coverage or dropout intervals.
         ax: Axis to plot on.
         legend: Legend to use.
         color: Color to use.
@@ -29,17 +34,14 @@ def add_bars(
     Returns:
         Axis with labels plotted.
     """
-    labels = labels.sort_values(by=['ax_index'])
-
-    ax_index = labels['ax_index']
-    offset = labels['start_time']  # start time (seconds)
-    duration = labels['label_duration']  # duration (seconds)
+    ax_index, start_time = ax_positions(intervals)
+    duration = intervals.durations * (DURATION_UNIT / NS_IN_SEC)
 
     ax.bar(
         ax_index,
         duration / SEC_IN_HR,
         width,
-        bottom=offset / SEC_IN_HR,
+        bottom=start_time / SEC_IN_HR,
         label=legend,
         color=color,
         alpha=alpha,
@@ -47,22 +49,77 @@ def add_bars(
     return ax
 
 
-def add_ax_index(labels: pd.DataFrame) -> pd.DataFrame:
-    """Adds `ax_index` and `file_start` to the dataframe.
+def add_envelope(
+    envelope: pd.DataFrame,
+    file_starts: np.ndarray,
+    files: pd.DataFrame,
+    ax: 'plt.Axes',
+    bucket_seconds: float,
+    channel: int = 0,
+    color: Optional[str] = None,
+    width: float = 0.8,
+) -> 'plt.Axes':
+    """Draws the min/max envelope of each file inside its bar, from left (min) to right (max).
+
+    Args:
+        envelope: Envelope table (see `ea_coverage.envelopes.build_envelope_tables`).
+        file_starts: Start of each file (int64 UTC epoch ns, e.g. `IntervalTable.file_starts`).
+        files: File table that `envelope['file_id']` refers to.
+        ax: Axis to plot on.
+        bucket_seconds: Bucket length of the envelope (seconds).
+        channel: Channel to draw.
+        color: Color to use.
+        width: Width of bars.
+
+    Returns:
+        Axis with the envelope plotted.
+    """
+    dir_timestamps = files['dir_timestamp'].to_numpy()
+    for file_id, edges, mins, maxs in envelope_segments(envelope, file_starts, bucket_seconds,
+                                                        channel):
+        file_start = file_starts[file_id]
+        # same vertical position as `ax_positions`
+        start_time = (file_start % (SEC_IN_DAY * NS_IN_SEC) + (edges - file_start)) / NS_IN_SEC
+        left = dir_timestamps[file_id] / SEC_IN_DAY - width / 2
+        ax.fill_betweenx(
+            start_time / SEC_IN_HR,
+            left + width * mins,
+            left + width * maxs,
+            step='post',
+            color=color,
+            linewidth=0,
+        )
+    return ax
+
+
+def ax_positions(intervals: IntervalTable) -> Tuple[np.ndarray, np.ndarray]:
+    """Bar positions of intervals.
+
+    Returns:
+        Tuple of (`ax_index`, the recording directory timestamp in days, and `start_time`, the
+        interval start in seconds since 00:00 UTC of the day its file starts).
+    """
+    file_starts = intervals.file_starts[intervals.file_ids]
+    file_start = (file_starts % (SEC_IN_DAY * NS_IN_SEC)) / NS_IN_SEC
+    start_time = file_start + (intervals.starts - file_starts) / NS_IN_SEC
+    ax_index = intervals.file_column('dir_timestamp') / SEC_IN_DAY
+    return ax_index, start_time
+
+
+def add_ax_index(labels: pd.DataFrame, files: pd.DataFrame, data_type: str) -> pd.DataFrame:
+    """Adds `ax_index` and `start_time` (see `ax_positions`) to a labels DataFrame.
 
     Args:
         labels: Dataframe with labels.
+        files: File table that `labels['file_id']` refers to (see `build_file_table`).
+        data_type: Data type of the labels.
 
     Returns:
-        Dataframe with `ax_index` and `file_start` added.
+        Dataframe with `ax_index` and `start_time` added.
     """
     if len(labels) == 0:
         return labels
 
-    start_time = labels['time_edf'].dt.tz_localize(None)
-    zero_point = start_time.dt.normalize()
-    file_start = (start_time - zero_point).dt.total_seconds()
-
-    labels['start_time'] = file_start + labels['label_start']
-    labels['ax_index'] = labels['filepath'].apply(lambda fp: int(fp.parent.stem) / SEC_IN_DAY)
+    labels['ax_index'], labels['start_time'] = ax_positions(
+        IntervalTable.from_dataframe(labels, files, data_type))
     return labels
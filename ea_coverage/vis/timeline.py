@@ -1,19 +1,40 @@
-from typing import Tuple, Dict
+from typing import TYPE_CHECKING, Tuple, Dict, Optional
 from datetime import datetime, timedelta
 import pytz
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
-from ea_coverage import SPLIT
+from ..envelopes import envelope_segments
+from ..globals import SPLIT
+from ..intervals import IntervalTable
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+ROW_HEIGHT = 1.8
+X_RANGE_PAD = timedelta(days=3)
 
 
 def create_coverage_timeline(
     patient_id: str,
-    patient_coverage: Dict[str, Tuple[pd.DataFrame, pd.DataFrame]],
+    patient_coverage: Dict[str, Tuple[IntervalTable, IntervalTable]],
     sztimes: pd.Series,
+    batched: bool = True,
+    webgl: bool = True,
 ) -> go.Figure:
-    """Create a time series figure from a dictionary of DataFrames."""
+    """Create a time series figure from a dictionary of DataFrames.
+
+    Args:
+        patient_id: Patient ID.
+        patient_coverage: Dict mapping dtypes to (coverage, dropouts) intervals.
+        sztimes: Seizure times.
+        batched: Draw all intervals of each (dtype, coverage/dropout) as a single trace of
+            gap-separated polygons, instead of one trace per interval. Needed for patients with
+            many recordings, but hover text is shown per polygon vertex rather than per fill.
+        webgl: Use WebGL (`go.Scattergl`) for batched traces.
+    """
     num_dtypes = len(patient_coverage)
     start_date, end_date = None, None
 
@@ -33,25 +54,29 @@ def create_coverage_timeline(
                 y=row_idx + 1.2,
                 showarrow=False,
             ))
-        traces, start_date, end_date = _add_traces(
-            coverage,
-            'green',
-            row_idx,
-            traces,
-            start_date,
-            end_date,
-        )
-        traces, start_date, end_date = _add_traces(
-            dropouts,
-            'red',
-            row_idx,
-            traces,
-            start_date,
-            end_date,
-        )
+        for labels, color in [(coverage, 'green'), (dropouts, 'red')]:
+            if batched:
+                traces, start_date, end_date = _add_batched_traces(
+                    labels,
+                    color,
+                    row_idx,
+                    traces,
+                    start_date,
+                    end_date,
+                    name=dtype,
+                    webgl=webgl,
+                )
+            else:
+                traces, start_date, end_date = _add_traces(
+                    labels,
+                    color,
+                    row_idx,
+                    traces,
+                    start_date,
+                    end_date,
+                )
 
-    x_range_pad = timedelta(days=3)
-    x_range = (start_date - x_range_pad, end_date + x_range_pad)
+    x_range = (start_date - X_RANGE_PAD, end_date + X_RANGE_PAD)
     y_range = [1, (num_dtypes + 1.5) * 2]
 
     # add lines for when seizures occur
@@ -68,13 +93,7 @@ def create_coverage_timeline(
             ))
 
     # add line for train/test split
-    # Q: ARE THESE DIRNAMES UTC OR LOCAL??
-    split_date = datetime.fromtimestamp(int(SPLIT[patient_id]))
-    # IF LOCAL:
-    split_date = split_date.replace(tzinfo=pytz.timezone('US/Central'))
-    # IF UTC:
-    # split_date = split_date.replace(tzinfo=pytz.utc)
-    # split_date = split_date.astimezone(pytz.timezone('US/Central'))
+    split_date = _split_date(patient_id)
     traces.append(
         go.Scatter(
             x=[split_date, split_date],
@@ -110,6 +129,125 @@ def create_coverage_timeline(
     return fig
 
 
+def draw_coverage_timeline(
+    patient_id: str,
+    patient_coverage: Dict[str, Tuple[IntervalTable, IntervalTable]],
+    sztimes: pd.Series,
+    fig: Optional['plt.Figure'] = None,
+    envelopes: Optional[Dict[str, Tuple[pd.DataFrame, int]]] = None,
+    envelope_seconds: float = 60,
+) -> 'plt.Figure':
+    """Draws the same timeline as `create_coverage_timeline` with matplotlib.
+
+    Each (dtype, coverage/dropout) row is a single `broken_barh` collection, so the figure can be
+    saved straight to PNG without a browser-based renderer.
+
+    Args:
+        patient_id: Patient ID.
+        patient_coverage: Dict mapping dtypes to (coverage, dropouts) intervals.
+        sztimes: Seizure times.
+        fig: Figure to clear and draw on (defaults to a new figure).
+        envelopes: Dict mapping dtypes to (envelope table, channel) to overlay on their rows
+            (see `ea_coverage.envelopes.build_envelope_tables`).
+        envelope_seconds: Bucket length of the envelopes (seconds).
+    """
+    # matplotlib is slow to import, so only pay for it when actually plotting
+    import matplotlib.dates as mdates  # pylint: disable=import-outside-toplevel
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    num_dtypes = len(patient_coverage)
+    dpi = 100
+    figsize = (5000 / dpi, num_dtypes * 120 / dpi)
+    if fig is None:
+        fig = plt.figure(figsize=figsize, dpi=dpi)
+    else:
+        fig.clear()
+        fig.set_size_inches(figsize)
+        fig.set_dpi(dpi)
+    ax = fig.add_subplot()
+
+    envelopes = envelopes or {}
+    start_date, end_date = None, None
+    y_ticks = []
+    row_idx = 0
+    for data_type, (coverage, dropouts) in patient_coverage.items():
+        row_idx += 2
+        y_ticks.append(row_idx + 1.2)
+        for labels, color in [(coverage, 'green'), (dropouts, 'red')]:
+            if len(labels) == 0:
+                continue
+            start, end = _interval_times(labels)
+            if start_date is None or start.min() < start_date:
+                start_date = start.min()
+            if end_date is None or end.max() > end_date:
+                end_date = end.max()
+
+            start_num = mdates.date2num(labels.starts.view('datetime64[ns]'))
+            end_num = mdates.date2num(labels.ends.view('datetime64[ns]'))
+            ax.broken_barh(
+                np.stack([start_num, end_num - start_num], axis=1),
+                (row_idx, ROW_HEIGHT),
+                facecolors=color,
+                edgecolors=color,
+                alpha=0.5,
+                linewidth=0.5,
+            )
+
+        if data_type in envelopes:
+            envelope, channel = envelopes[data_type]
+            for _, edges, mins, maxs in envelope_segments(envelope, coverage.file_starts,
+                                                          envelope_seconds, channel):
+                ax.fill_between(
+                    mdates.date2num(edges.view('datetime64[ns]')),
+                    row_idx + ROW_HEIGHT * mins,
+                    row_idx + ROW_HEIGHT * maxs,
+                    step='post',
+                    color='black',
+                    linewidth=0,
+                )
+
+    y_range = [1, (num_dtypes + 1.5) * 2]
+    sztimes = pd.to_datetime(pd.Series(list(sztimes), dtype=object), utc=True)
+    if len(sztimes) > 0:
+        ax.vlines(mdates.date2num(sztimes.dt.tz_convert(None).to_numpy()),
+                  *y_range,
+                  colors='black',
+                  linewidth=1)
+    # plotly.js draws dates at their wall-clock time and ignores the UTC offset, so drop it to
+    # draw the split at the same time as `create_coverage_timeline`
+    ax.vlines(mdates.date2num(_split_date(patient_id).replace(tzinfo=None)),
+              *y_range,
+              colors='black',
+              linestyles='dotted',
+              linewidth=2)
+
+    if start_date is not None:
+        ax.set_xlim(
+            mdates.date2num((start_date - X_RANGE_PAD).tz_convert(None)),
+            mdates.date2num((end_date + X_RANGE_PAD).tz_convert(None)),
+        )
+    ax.xaxis_date()
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax.xaxis.get_major_locator()))
+    ax.set_ylim(y_range)
+    ax.set_yticks(y_ticks, list(patient_coverage))
+    ax.tick_params(axis='y', length=0)
+    fig.subplots_adjust(left=100 / 5000, right=0.995, top=1 - 25 / (num_dtypes * 120))
+
+    return fig
+
+
+def _split_date(patient_id: str) -> datetime:
+    """Time of the train/test split for a patient."""
+    # Q: ARE THESE DIRNAMES UTC OR LOCAL??
+    split_date = datetime.fromtimestamp(int(SPLIT[patient_id]))
+    # IF LOCAL:
+    split_date = split_date.replace(tzinfo=pytz.timezone('US/Central'))
+    # IF UTC:
+    # split_date = split_date.replace(tzinfo=pytz.utc)
+    # split_date = split_date.astimezone(pytz.timezone('US/Central'))
+    return split_date
+
+
 def _add_traces(labels, color, row_idx, traces, start_date, end_date):
     """Add traces to the Figure."""
     dt_format = '%-I:%M:%S%p %d/%m'
@@ -117,9 +255,8 @@ def _add_traces(labels, color, row_idx, traces, start_date, end_date):
     if len(labels) == 0:
         return traces, start_date, end_date
 
-    for _, row in labels.iterrows():
-        start = row['time_edf'] + timedelta(seconds=row['label_start'])
-        end = row['time_edf'] + timedelta(seconds=row['label_start'] + row['label_duration'])
+    starts, ends = _interval_times(labels)
+    for start, end, dir_timestamp in zip(starts, ends, labels.file_column('dir_timestamp')):
 
         if start_date is None or start < start_date:
             start_date = start
@@ -135,8 +272,8 @@ def _add_traces(labels, color, row_idx, traces, start_date, end_date):
         traces.append(
             go.Scatter(
                 x=[start, start, end, end, start],
-                y=[row_idx, row_idx + 1.8, row_idx + 1.8, row_idx, row_idx],
-                name=str(row['filepath'].parent.stem),
+                y=[row_idx, row_idx + ROW_HEIGHT, row_idx + ROW_HEIGHT, row_idx, row_idx],
+                name=str(dir_timestamp),
                 mode='lines',
                 marker={'color': color},
                 fill='toself',
@@ -145,3 +282,86 @@ def _add_traces(labels, color, row_idx, traces, start_date, end_date):
             ))
 
     return traces, start_date, end_date
+
+
+def _add_batched_traces(labels, color, row_idx, traces, start_date, end_date, name, webgl):
+    """Add all labels to the Figure as one trace of polygons separated by gaps."""
+    if len(labels) == 0:
+        return traces, start_date, end_date
+
+    start, end = _interval_times(labels)
+
+    if start_date is None or start.min() < start_date:
+        start_date = start.min()
+
+    if end_date is None or end.max() > end_date:
+        end_date = end.max()
+
+    # Each polygon is 5 vertices followed by a point with a NaN y-value, which breaks the line
+    start_ns = labels.starts.view('datetime64[ns]')
+    end_ns = labels.ends.view('datetime64[ns]')
+    x = np.stack([start_ns, start_ns, end_ns, end_ns, start_ns, end_ns], axis=1).ravel()
+    y = np.tile([row_idx, row_idx + ROW_HEIGHT, row_idx + ROW_HEIGHT, row_idx, row_idx, np.nan],
+                len(labels))
+    text = np.repeat(_hover_text(start, end), 6)
+
+    trace_type = go.Scattergl if webgl else go.Scatter
+    traces.append(
+        trace_type(
+            x=x,
+            y=y,
+            name=name,
+            mode='lines',
+            marker={'color': color},
+            fill='toself',
+            connectgaps=False,
+            hoverinfo='text',
+            text=text,
+        ))
+
+    return traces, start_date, end_date
+
+
+def _interval_times(labels: IntervalTable) -> Tuple[pd.Series, pd.Series]:
+    """Start and end times (UTC) of intervals."""
+    return (pd.Series(pd.to_datetime(labels.starts, utc=True)),
+            pd.Series(pd.to_datetime(labels.ends, utc=True)))
+
+
+def _hover_text(start: pd.Series, end: pd.Series) -> np.ndarray:
+    """Column-wise version of the hover text used by `_add_traces`."""
+    start_text = np.where(
+        start.dt.day != end.dt.day,
+        _format_times(start, with_date=True),
+        _format_times(start, with_date=False),
+    )
+    return _concat(start_text, ' - ', _format_times(end, with_date=True))
+
+
+def _format_times(times: pd.Series, with_date: bool) -> np.ndarray:
+    """Vectorized `strftime('%-I:%M:%S%p %d/%m')` (or without ` %d/%m`)."""
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+
+    def two_digits(values):
+        return np.char.zfill(values.to_numpy().astype(str), 2)
+
+    hour = times.dt.hour.to_numpy()
+    text = _concat(
+        ((hour + 11) % 12 + 1).astype(str),
+        ':',
+        two_digits(times.dt.minute),
+        ':',
+        two_digits(times.dt.second),
+        np.where(hour < 12, 'AM', 'PM'),
+    )
+    if with_date:
+        text = _concat(text, ' ', two_digits(times.dt.day), '/', two_digits(times.dt.month))
+    return text
+
+
+def _concat(*parts) -> np.ndarray:
+    text = parts[0]
+    for part in parts[1:]:
+        text = np.char.add(text, part)
+    return text
@@ -0,0 +1,285 @@
+"""Watches the edf dataset for new recording directories and merges them into saved results.
+
+New `<timestamp>` directories under `EDF_PATH/<patient_id>/{training,testing}/` are picked up
+as they're created. Once a directory holds an `Empatica-<dtype>.edf` file for every dtype and
+none of them has changed for `settle` seconds, only that directory is processed and merged into
+the saved results (see `update_stats`), and the plots made from those results are re-rendered.
+
+On Linux, the watcher sleeps until inotify reports a change. Elsewhere (or if inotify can't be
+used), directories are listed with `os.scandir` every `poll_interval` seconds.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .data import SPLITS, _scan_dirs
+from .stats import update_stats
+from .globals import DTYPES, EDF_PATH, PATIENT_IDS
+from .utils import load_results
+
+# inotify events that can mean a new directory or a file being written
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+# (name, size, mtime) of each edf file in a directory
+Snapshot = Tuple[Tuple[str, int, int], ...]
+
+
+class _Inotify:
+    """Minimal inotify wrapper (via libc, so there are no extra dependencies).
+
+    Raises:
+        OSError: If inotify isn't available.
+    """
+
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError, TypeError) as err:
+            raise OSError("inotify isn't available") from err
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: Dict[str, int] = {}
+
+    def add_watch(self, path: Path):
+        """Watches a directory, if it exists and isn't already watched."""
+        if str(path) in self._watches:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), _WATCH_MASK)
+        if wd >= 0:
+            self._watches[str(path)] = wd
+
+    def remove_watch(self, path: Path):
+        wd = self._watches.pop(str(path), None)
+        if wd is not None:
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """Waits for events (or the timeout), and returns whether there were any."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch(
+    patient_ids: Optional[List[str]] = None,
+    settle: float = 10.0,
+    poll_interval: float = 5.0,
+    max_wait: float = 3600.0,
+    reader: str = 'mne',
+    use_cache: bool = True,
+    plot: bool = True,
+    timeline_backend: Optional[str] = 'matplotlib',
+    use_inotify: bool = True,
+    once: bool = False,
+):
+    """Processes recording directories as they arrive, until interrupted.
+
+    Directories that exist when the watcher starts and aren't in the saved results of a patient
+    are processed too. Patients without any saved results are only watched for new directories.
+    Directories that fail to merge are kept pending and retried, waiting `settle` seconds after
+    the first failure and twice as long after each one that follows (up to `max_wait`).
+
+    Args:
+        patient_ids: Patient IDs to watch (defaults to all of `PATIENT_IDS`).
+        settle: Seconds a complete directory's files must go unchanged before it's processed.
+        poll_interval: Seconds between directory listings when inotify isn't used.
+        max_wait: Seconds after which an incomplete directory is processed anyway (its missing
+            files are recorded as dodgy).
+        reader: How samples are read, one of `ea_coverage.data.READERS`.
+        use_cache: Add new files to the per-file cache (see `gen_stats`).
+        plot: Re-render the bar plots (and timelines) of updated results.
+        timeline_backend: Backend to re-render timelines with (see `plot_timeline`), or None to
+            skip them.
+        use_inotify: Wait for inotify events instead of polling, where available.
+        once: Process the directories that are ready (e.g. complete and unchanged for `settle`
+            seconds by their modification times) and return, instead of watching.
+    """
+    patient_ids = [str(pid) for pid in (patient_ids or PATIENT_IDS)]
+    assert all(pid in PATIENT_IDS for pid in patient_ids), "Invalid patient_ids"
+    data_dir = Path(EDF_PATH)
+
+    inotify = None
+    if use_inotify and not once:
+        try:
+            inotify = _Inotify()
+        except OSError:
+            print("inotify isn't available, polling instead")
+
+    known = {pid: _processed_dirs(pid) for pid in patient_ids}
+    # directory -> (snapshot, time it last changed, time it was found)
+    pending: Dict[Path, Tuple[Snapshot, float, float]] = {}
+    # directory -> (failed attempts, time of the next attempt), for directories that failed
+    retries: Dict[Path, Tuple[int, float]] = {}
+    print(f"Watching {data_dir} for new recordings of {len(patient_ids)} patients...")
+    try:
+        while True:
+            now = time.monotonic()
+            if inotify is not None:
+                inotify.add_watch(data_dir)
+            ready = {pid: [] for pid in patient_ids}
+            for patient_id in patient_ids:
+                for dir_path in _new_dirs(data_dir, patient_id, known[patient_id], inotify):
+                    snapshot = _snapshot(dir_path)
+                    previous = pending.get(dir_path)
+                    if previous is None:
+                        print(f"Found new recording {dir_path}")
+                        # files that were written before the watcher started have already settled
+                        idle = time.time() - max((mtime / 1e9 for *_, mtime in snapshot),
+                                                 default=time.time())
+                        pending[dir_path] = (snapshot, now - max(idle, 0.0), now)
+                    elif previous[0] != snapshot:
+                        pending[dir_path] = (snapshot, now, previous[2])
+                    snapshot, changed, found = pending[dir_path]
+                    complete = len(snapshot) == len(DTYPES) and now - changed >= settle
+                    retry_at = retries.get(dir_path, (0, now))[1]
+                    if (complete or now - found >= max_wait) and now >= retry_at:
+                        ready[patient_id].append(dir_path)
+
+            for patient_id, dir_paths in ready.items():
+                if not dir_paths:
+                    continue
+                if not _process(patient_id, dir_paths, reader, use_cache, plot, timeline_backend):
+                    # e.g. a file still being written, or the catalog locked by another process
+                    for dir_path in dir_paths:
+                        attempts = retries.get(dir_path, (0, now))[0] + 1
+                        delay = min(settle * 2**(attempts - 1), max_wait)
+                        retries[dir_path] = (attempts, time.monotonic() + delay)
+                    print(f"  Retrying in {delay:.1f} s")
+                    continue
+                for dir_path in dir_paths:
+                    known[patient_id].add(dir_path.name)
+                    del pending[dir_path]
+                    retries.pop(dir_path, None)
+                    if inotify is not None:
+                        inotify.remove_watch(dir_path)
+
+            if once:
+                return
+            if inotify is None:
+                time.sleep(poll_interval)
+            else:
+                # wake up when something changes, or when a pending directory may have settled
+                inotify.wait(settle if pending else None)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+
+def _processed_dirs(patient_id: str) -> Set[str]:
+    """Names of the recording directories in a patient's saved results, or of every existing
+    directory if there are none."""
+    names = set()
+    for data_type in DTYPES:
+        results = load_results(patient_id, data_type, keys=['filepaths', 'dodgy_filepaths'])
+        for fp in list(results.get('filepaths', [])) + list(results.get('dodgy_filepaths', {})):
+            names.add(Path(fp).parent.name)
+    if not names:
+        names = {
+            Path(dir_path).name
+            for split in SPLITS
+            for dir_path in _scan_dirs(Path(EDF_PATH) / patient_id / split)
+        }
+    return names
+
+
+def _new_dirs(
+    data_dir: Path,
+    patient_id: str,
+    known: Set[str],
+    inotify: Optional[_Inotify],
+) -> List[Path]:
+    """Recording directories of a patient that haven't been processed, watching their parents
+    (and themselves) for changes."""
+    patient_dir = data_dir / patient_id
+    if inotify is not None:
+        inotify.add_watch(patient_dir)
+    dir_paths = []
+    for split in SPLITS:
+        split_dir = patient_dir / split
+        if inotify is not None:
+            inotify.add_watch(split_dir)
+        for dir_path in map(Path, _scan_dirs(split_dir)):
+            if dir_path.name.isdigit() and dir_path.name not in known:
+                if inotify is not None:
+                    inotify.add_watch(dir_path)
+                dir_paths.append(dir_path)
+    return dir_paths
+
+
+def _snapshot(dir_path: Path) -> Snapshot:
+    """(name, size, mtime) of the edf files of every dtype in a recording directory."""
+    expected = {f'Empatica-{dtype}.edf' for dtype in DTYPES}
+    try:
+        with os.scandir(dir_path) as entries:
+            return tuple(
+                sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                       for entry in entries
+                       if entry.name in expected and entry.is_file()))
+    except (FileNotFoundError, NotADirectoryError):
+        return ()
+
+
+def _process(
+    patient_id: str,
+    dir_paths: List[Path],
+    reader: str,
+    use_cache: bool,
+    plot: bool,
+    timeline_backend: Optional[str],
+) -> bool:
+    """Merges recording directories into a patient's results and re-renders its plots.
+
+    Errors are printed rather than raised, so one bad directory doesn't stop the watcher.
+
+    Returns:
+        Whether the results were updated (plots that fail to render aren't retried).
+    """
+    print(f"Processing {len(dir_paths)} new recordings of {patient_id}...")
+    start = time.perf_counter()
+    try:
+        data_types = update_stats(patient_id, [str(fp) for fp in dir_paths],
+                                  reader=reader,
+                                  use_cache=use_cache)
+    except Exception as err:  # pylint: disable=broad-except
+        print(f"  Failed to update {patient_id}: {type(err).__name__}: {err}")
+        return False
+
+    if plot:
+        # plots are rendered off-screen, and matplotlib is only imported when plotting
+        import matplotlib  # pylint: disable=import-outside-toplevel
+        from .bar_plots import plot_bars  # pylint: disable=import-outside-toplevel
+        from .timeline_plots import plot_timeline  # pylint: disable=import-outside-toplevel
+        matplotlib.use('Agg')
+
+        renders = [(plot_bars, (patient_id, data_type), {}) for data_type in data_types]
+        if timeline_backend is not None:
+            renders.append((plot_timeline, (patient_id, ), {'backend': timeline_backend}))
+        for render, args, kwargs in renders:
+            try:
+                print(f"  Saved {render(*args, **kwargs)}")
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"  Failed to render {render.__name__}{args}: {type(err).__name__}: {err}")
+    print(f"  Done in {time.perf_counter() - start:.1f} s")
+    return True
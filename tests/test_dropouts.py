@@ -0,0 +1,86 @@
+"""The chunked dropout kernel against an unchunked reference."""
+import numpy as np
+import pytest
+
+from ea_coverage.dropouts import VarianceCriterion, find_dropouts, iter_chunks, make_criterion
+
+N_SAMPLES = 300
+# (start, stop) of the dropouts in `make_signal`: at the start of the file, crossing several
+# chunk boundaries, too short for `min_dropout=5`, partly NaN, and at the end of the file
+DROPOUTS = [(0, 20), (100, 160), (190, 193), (210, 230), (270, N_SAMPLES)]
+CRITERIA = {
+    'zero': make_criterion('zero'),
+    'flat': make_criterion('flat'),
+    'variance': VarianceCriterion(threshold=1e-6, window=8),
+}
+
+
+def make_signal(criterion: str, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = rng.normal(10.0, 1.0, size=(2, N_SAMPLES))
+    for start, stop in DROPOUTS:
+        data[:, start:stop] = 0.0 if criterion == 'zero' else rng.normal(10.0, 1.0, size=(2, 1))
+    data[0, 215:225] = np.nan
+    return data
+
+
+def reference_mask(data: np.ndarray, criterion: str) -> np.ndarray:
+    """Marks dropout samples one at a time, looking at the whole signal."""
+    mask = np.zeros(data.shape[1], dtype=bool)
+    for i in range(data.shape[1]):
+        if criterion == 'zero':
+            mask[i] = np.all((data[:, i] == 0) | np.isnan(data[:, i]))
+        elif criterion == 'flat' and i > 0:
+            mask[i] = np.all((data[:, i] == data[:, i - 1]) | np.isnan(data[:, i]))
+        elif criterion == 'variance' and i >= CRITERIA['variance'].window - 1:
+            window = data[:, i - CRITERIA['variance'].window + 1:i + 1]
+            variances = [
+                np.var(values[~np.isnan(values)]) if np.any(~np.isnan(values)) else 0.0
+                for values in window
+            ]
+            mask[i] = np.all(np.array(variances) < CRITERIA['variance'].threshold)
+    return mask
+
+
+def reference_dropouts(data: np.ndarray, criterion: str, min_dropout: int):
+    """Runs of marked samples, extended backwards by the criterion's lead."""
+    mask = reference_mask(data, criterion)
+    edges = np.diff(mask.astype(int), prepend=0, append=0)
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    starts = np.maximum(starts - CRITERIA[criterion].lead, 0)
+    return [(int(start), int(end - start))
+            for start, end in zip(starts, ends)
+            if end - start >= max(min_dropout, 1)]
+
+
+@pytest.mark.parametrize('criterion', list(CRITERIA))
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, N_SAMPLES])
+@pytest.mark.parametrize('min_dropout', [0, 5])
+def test_chunked_matches_reference(criterion, chunk_size, min_dropout):
+    data = make_signal(criterion)
+    dropouts = find_dropouts(iter_chunks(data, chunk_size), min_dropout, CRITERIA[criterion])
+    assert dropouts == reference_dropouts(data, criterion, min_dropout)
+
+
+@pytest.mark.parametrize('criterion', list(CRITERIA))
+def test_runs_at_file_start_and_end(criterion):
+    dropouts = find_dropouts(iter_chunks(make_signal(criterion), 7), 5, CRITERIA[criterion])
+    # the first run starts at the first sample, even with a lead, and the last one is closed at
+    # the end of the file
+    assert dropouts[0][0] == 0
+    assert sum(dropouts[-1]) == N_SAMPLES
+
+
+@pytest.mark.parametrize('criterion', list(CRITERIA))
+def test_chunk_boundaries_dont_split_runs(criterion):
+    data = make_signal(criterion)
+    unchunked = find_dropouts(data, 0, CRITERIA[criterion])
+    # a run from 100 to 160 crosses every boundary of these chunk sizes
+    for chunk_size in [1, 5, 13, 50]:
+        assert find_dropouts(iter_chunks(data, chunk_size), 0, CRITERIA[criterion]) == unchunked
+
+
+def test_no_dropouts():
+    data = np.random.default_rng(1).normal(size=(3, 100))
+    assert find_dropouts(iter_chunks(data, 10), 0, 'flat') == []
+    assert find_dropouts(iter([]), 0, 'flat') == []
@@ -0,0 +1,158 @@
+"""Interval algebra and window-coverage queries."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from ea_coverage.intervals import (NS_IN_SEC, CoverageIndex, IntervalTable, intersect_intervals,
+                                   label_intervals, merge_intervals, subtract_intervals, to_ns,
+                                   union_intervals)
+
+EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+
+def intervals(*pairs):
+    return (np.array([start for start, _ in pairs], dtype=np.int64),
+            np.array([end for _, end in pairs], dtype=np.int64))
+
+
+def as_pairs(starts_ends):
+    starts, ends = starts_ends
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+@pytest.mark.parametrize('pairs, expected', [
+    ([], []),
+    ([(0, 10)], [(0, 10)]),
+    # overlapping, adjacent, contained, unsorted and empty intervals
+    ([(5, 15), (0, 10)], [(0, 15)]),
+    ([(0, 10), (10, 20)], [(0, 20)]),
+    ([(0, 30), (5, 10), (12, 20)], [(0, 30)]),
+    ([(20, 30), (0, 10), (15, 15)], [(0, 10), (20, 30)]),
+])
+def test_merge_intervals(pairs, expected):
+    assert as_pairs(merge_intervals(*intervals(*pairs))) == expected
+
+
+@pytest.mark.parametrize('pairs, sub_pairs, expected', [
+    ([], [], []),
+    ([], [(0, 10)], []),
+    ([(0, 10)], [], [(0, 10)]),
+    ([(0, 10)], [(0, 10)], []),
+    ([(0, 10)], [(3, 5)], [(0, 3), (5, 10)]),
+    ([(0, 10)], [(-5, 3), (8, 20)], [(3, 8)]),
+    ([(0, 10), (10, 20)], [(5, 15)], [(0, 5), (15, 20)]),
+    # subtracting an adjacent interval removes nothing
+    ([(0, 10)], [(10, 20), (-10, 0)], [(0, 10)]),
+])
+def test_subtract_intervals(pairs, sub_pairs, expected):
+    assert as_pairs(subtract_intervals(*intervals(*pairs), *intervals(*sub_pairs))) == expected
+
+
+def test_intersect_and_union_intervals():
+    sets = [intervals((0, 10), (20, 30)), intervals((5, 25)), intervals((0, 8), (5, 22))]
+    assert as_pairs(intersect_intervals(sets)) == [(5, 10), (20, 22)]
+    assert as_pairs(union_intervals(sets)) == [(0, 30)]
+
+    # overlaps within one set count once, and touching intervals of two sets don't overlap
+    assert as_pairs(intersect_intervals([intervals((0, 10), (5, 15)), intervals((15, 20))])) == []
+    assert as_pairs(union_intervals([intervals((0, 10)), intervals((10, 20))])) == [(0, 20)]
+
+    assert as_pairs(intersect_intervals([intervals((0, 10)), EMPTY])) == []
+    assert as_pairs(union_intervals([EMPTY, intervals((0, 10))])) == [(0, 10)]
+    assert as_pairs(union_intervals([])) == []
+
+
+def test_to_ns():
+    assert to_ns(1.5) == 1.5 * NS_IN_SEC
+    assert to_ns(2) == 2 * NS_IN_SEC
+    # naive times are UTC
+    assert to_ns('1970-01-01 00:00:01') == to_ns(pd.Timestamp(1, unit='s', tz='UTC')) == NS_IN_SEC
+    assert to_ns('1970-01-01 01:00:01+01:00') == NS_IN_SEC
+    np.testing.assert_array_equal(to_ns(np.array([0, 1])), [0, NS_IN_SEC])
+
+
+def labels_frame():
+    time_edf = pd.to_datetime([0, 0, 100], unit='s', utc=True)
+    return pd.DataFrame({
+        'file_id': [0, 0, 1],
+        'filepath': ['a.edf', 'a.edf', 'b.edf'],
+        'time_edf': time_edf,
+        'label_start': [0.0, 30.5, 10.0],
+        'label_duration': [20.0, 9.5, 0.25],
+    })
+
+
+def test_label_intervals():
+    starts, ends = label_intervals(labels_frame())
+    assert starts.tolist() == [0, 30_500_000_000, 110 * NS_IN_SEC]
+    assert ends.tolist() == [20 * NS_IN_SEC, 40 * NS_IN_SEC, 110_250_000_000]
+    assert [len(a) for a in label_intervals(labels_frame()[:0])] == [0, 0]
+
+
+def test_interval_table_round_trip():
+    labels = labels_frame()
+    files = pd.DataFrame({'filepath': ['a.edf', 'b.edf']})
+    table = IntervalTable.from_dataframe(labels, files, 'BVP')
+    assert len(table) == 3
+    np.testing.assert_array_equal(table.ends, label_intervals(labels)[1])
+    assert table.file_column('filepath').tolist() == labels['filepath'].tolist()
+    pd.testing.assert_frame_equal(table.to_dataframe(), labels, check_dtype=False)
+    assert len(table[table.file_ids == 0]) == 2
+
+    empty = IntervalTable.from_dataframe(labels[:0], files, 'BVP')
+    assert len(empty) == 0
+    assert len(empty.to_dataframe()) == 0
+
+
+def index_of(*pairs):
+    """A `CoverageIndex` of (start, end) pairs in seconds."""
+    return CoverageIndex(*[a * NS_IN_SEC for a in intervals(*pairs)])
+
+
+def test_covered_windows():
+    # overlapping and adjacent labels merge into [10, 30) and [50, 60)
+    index = index_of((10, 20), (15, 25), (25, 30), (50, 60))
+    assert len(index) == 2
+    assert index.total == 30
+    windows = [
+        ((0, 100), 30),
+        ((0, 10), 0),  # ends where coverage starts
+        ((30, 50), 0),  # between intervals
+        ((5, 15), 5),  # partly overlapping the first interval
+        ((25, 55), 10),  # partly overlapping both intervals
+        ((12, 18), 6),  # within an interval
+        ((55, 70), 5),  # partly overlapping the last interval
+        ((70, 80), 0),  # after every interval
+        ((20, 20), 0),  # empty
+    ]
+    for (t0, t1), covered in windows:
+        assert index.covered(t0, t1) == covered
+
+    t0, t1 = np.array([w[0] for w, _ in windows]), np.array([w[1] for w, _ in windows])
+    np.testing.assert_array_equal(index.covered(t0, t1), [covered for _, covered in windows])
+    assert index.fraction(5, 15) == 0.5
+    assert index.fraction(pd.Timestamp(0, tz='UTC'), pd.Timestamp(100, unit='s', tz='UTC')) == 0.3
+
+
+def test_contains_and_gaps():
+    index = index_of((10, 30), (50, 60))
+    np.testing.assert_array_equal(index.contains(np.array([9.5, 10, 29.5, 30, 55, 60])),
+                                  [False, True, True, False, True, False])
+
+    def gaps(t0, t1):
+        return [(start.timestamp(), end.timestamp()) for start, end in index.gaps(t0, t1)]
+
+    assert gaps(0, 100) == [(0, 10), (30, 50), (60, 100)]
+    assert gaps(15, 55) == [(30, 50)]
+    assert gaps(10, 30) == []
+    assert gaps(30, 50) == [(30, 50)]
+
+
+def test_empty_index():
+    index = CoverageIndex(*EMPTY)
+    assert len(index) == 0
+    assert index.total == 0
+    assert index.covered(0, 10) == 0
+    np.testing.assert_array_equal(index.covered(np.array([0, 5]), np.array([10, 20])), [0, 0])
+    assert not index.contains(5)
+    assert [(start.timestamp(), end.timestamp()) for start, end in index.gaps(0, 10)] == [(0, 10)]
@@ -0,0 +1,90 @@
+"""Resuming `FileStatsJournal`s after a crash."""
+import pytest
+
+from ea_coverage import journal as journal_module
+from ea_coverage.journal import FileStatsJournal
+
+PARAMS = {'min_run': 128, 'criterion': 'flat'}
+
+
+@pytest.fixture(autouse=True)
+def interim_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, 'INTERIM_PATH', str(tmp_path / 'interim'))
+
+
+@pytest.fixture
+def filepaths(tmp_path):
+    filepaths = []
+    for i in range(3):
+        fp = tmp_path / 'edf' / str(1600000000 + i) / 'Empatica-BVP.edf'
+        fp.parent.mkdir(parents=True)
+        fp.write_bytes(b' ' * 256)
+        filepaths.append(fp)
+    return filepaths
+
+
+def file_stats(i):
+    return ({'n_samples': i}, [{'label_start': float(i)}], [])
+
+
+def write_journal(filepaths):
+    journal = FileStatsJournal('2002', 'BVP', PARAMS)
+    sizes = [journal.filepath.stat().st_size]
+    for i, fp in enumerate(filepaths):
+        journal.put(fp, file_stats(i))
+        sizes.append(journal.filepath.stat().st_size)
+    journal.close()
+    return journal.filepath, sizes
+
+
+# where a crash while appending the last record cut it off: in its 8-byte length prefix, right
+# after it, or in its pickle
+@pytest.mark.parametrize('torn_at', [4, 8, -1])
+def test_resume_drops_torn_record(filepaths, torn_at):
+    journal_fp, sizes = write_journal(filepaths)
+    with open(journal_fp, 'r+b') as f:
+        f.truncate(sizes[-2] + torn_at if torn_at > 0 else sizes[-1] + torn_at)
+
+    journal = FileStatsJournal('2002', 'BVP', PARAMS, resume=True)
+    assert [journal.get(fp) for fp in filepaths] == [file_stats(0), file_stats(1), None]
+    assert journal.resumed == 2
+    # the torn bytes are discarded, so records appended after resuming are readable
+    assert journal_fp.stat().st_size == sizes[-2]
+    journal.put(filepaths[2], file_stats(2))
+    journal.close()
+
+    journal = FileStatsJournal('2002', 'BVP', PARAMS, resume=True)
+    assert [journal.get(fp) for fp in filepaths] == [file_stats(i) for i in range(3)]
+    journal.close()
+
+
+def test_resume_ignores_other_params(filepaths):
+    journal_fp, _ = write_journal(filepaths)
+
+    journal = FileStatsJournal('2002', 'BVP', {**PARAMS, 'min_run': 256}, resume=True)
+    assert [journal.get(fp) for fp in filepaths] == [None, None, None]
+    journal.close()
+    # the journal is restarted with the new parameters
+    journal = FileStatsJournal('2002', 'BVP', {**PARAMS, 'min_run': 256}, resume=True)
+    assert journal.entries == {}
+    journal.close()
+    assert journal_fp.exists()
+
+
+def test_resume_skips_changed_files(filepaths):
+    write_journal(filepaths)
+    filepaths[1].write_bytes(b' ' * 512)
+
+    journal = FileStatsJournal('2002', 'BVP', PARAMS, resume=True)
+    assert [journal.get(fp) for fp in filepaths] == [file_stats(0), None, file_stats(2)]
+    journal.close()
+
+
+def test_no_resume_discards_journal(filepaths):
+    write_journal(filepaths)
+
+    journal = FileStatsJournal('2002', 'BVP', PARAMS)
+    journal.close()
+    journal = FileStatsJournal('2002', 'BVP', PARAMS, resume=True)
+    assert journal.entries == {}
+    journal.close()
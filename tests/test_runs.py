@@ -0,0 +1,61 @@
+"""Applying `min_dropout` at query time from the run table."""
+import os
+
+import pytest
+
+from ea_coverage.stats import gen_stats
+from ea_coverage.synth import gen_synth
+from ea_coverage.utils import load_results
+
+# the synthetic recordings have flat runs of 2 samples (repeated digital values), 201 samples
+# and 1920 samples (injected dropouts), so these select every run, some of them, or none
+THRESHOLDS = [1, 2, 3, 201, 1920, 1921]
+LABELS = ['file_id', 'filepath', 'time_edf', 'label_start', 'label_duration']
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    cwd = os.getcwd()
+    root = tmp_path_factory.mktemp('runs')
+    # results are saved relative to the working directory (see `ea_coverage.globals`)
+    os.chdir(root)
+    gen_synth('data/edf',
+              patient_ids=['2002'],
+              data_types=['BVP'],
+              days=1,
+              recordings=2,
+              recording_minutes=10,
+              dropouts=4,
+              dropout_minutes=0.25)
+    yield root
+    os.chdir(cwd)
+
+
+def scanned_dropouts(min_dropout, min_run):
+    gen_stats('2002', 'BVP', min_dropout=min_dropout, min_run=min_run, use_cache=False)
+    return load_results('2002', 'BVP', keys=['dropouts'], columns=LABELS)['dropouts']
+
+
+# pylint: disable=unused-argument,redefined-outer-name
+
+
+def test_min_dropout_matches_scan(data_dir):
+    expected = {
+        min_dropout: scanned_dropouts(min_dropout, min_dropout)
+        for min_dropout in THRESHOLDS
+    }
+    assert len(expected[1]) > len(expected[3]) > len(expected[1920]) > len(expected[1921]) == 0
+
+    scanned_dropouts(128 * 60, 1)
+    for min_dropout in THRESHOLDS:
+        dropouts = load_results('2002', 'BVP', keys=['dropouts'], columns=LABELS,
+                                min_dropout=min_dropout)['dropouts']
+        # saved columns are memory-mapped, so compare values rather than array types
+        assert dropouts.to_dict('list') == expected[min_dropout].to_dict('list')
+
+
+def test_min_dropout_below_min_run_is_rejected(data_dir):
+    scanned_dropouts(128 * 60, 128)
+    load_results('2002', 'BVP', keys=['dropouts'], min_dropout=128)
+    with pytest.raises(AssertionError, match='min_run'):
+        load_results('2002', 'BVP', keys=['dropouts'], min_dropout=127)
@@ -0,0 +1,68 @@
+"""Streaming `SignalStats` against the stats of the whole signal."""
+import numpy as np
+import pytest
+
+from ea_coverage.dropouts import iter_chunks
+from ea_coverage.signal_stats import SignalStats
+
+
+def make_signal(seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = rng.normal(1e4, 3.0, size=(3, 200))  # a large mean, where naive variances lose precision
+    data[:, 50:60] = np.nan  # NaN-only chunks for chunk sizes that divide 10
+    data[0, 100:130] = np.nan
+    data[1, 150:] = 5.0  # flat, across chunk boundaries
+    data[2, :] = np.nan  # a channel with no samples
+    return data
+
+
+def streamed(data: np.ndarray, chunk_size: int) -> SignalStats:
+    stats = SignalStats(len(data))
+    for chunk in iter_chunks(data, chunk_size):
+        stats.update(chunk)
+    return stats
+
+
+# numpy warns about the channel with no samples
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 7, 10, 64, 200])
+def test_chunks_match_whole_signal(chunk_size):
+    data = make_signal()
+    stats = streamed(data, chunk_size)
+
+    assert stats.n_samples == data.shape[1]
+    np.testing.assert_array_equal(stats.count, np.sum(~np.isnan(data), axis=1))
+    np.testing.assert_array_equal(stats.n_nan, np.sum(np.isnan(data), axis=1))
+    np.testing.assert_allclose(stats.to_row()['mean_0'], np.nanmean(data[0]), rtol=1e-12)
+    np.testing.assert_allclose(stats.std, np.nanstd(data, axis=1), rtol=1e-9)
+    np.testing.assert_array_equal(stats.min, np.nanmin(data, axis=1))
+    np.testing.assert_array_equal(stats.max, np.nanmax(data, axis=1))
+    np.testing.assert_array_equal(stats.n_flat, np.sum(data[:, 1:] == data[:, :-1], axis=1))
+
+    row = stats.to_row()
+    assert row['mean_1'] == pytest.approx(np.nanmean(data[1]), rel=1e-12)
+    assert np.isnan(row['mean_2']) and np.isnan(row['std_2'])
+    assert row['nan_count_2'] == data.shape[1]
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_nan_only_chunks():
+    data = np.full((2, 30), np.nan)
+    stats = streamed(data, 10)
+    assert stats.n_samples == 30
+    np.testing.assert_array_equal(stats.n_nan, [30, 30])
+    assert np.all(np.isnan(stats.std)) and np.all(np.isnan(stats.min))
+
+    # valid samples after NaN-only chunks, and NaN-only chunks after valid samples
+    data[:, 10:20] = np.arange(20).reshape(2, 10)
+    stats = streamed(data, 10)
+    np.testing.assert_array_equal(stats.count, [10, 10])
+    np.testing.assert_allclose(stats.to_row()['mean_1'], np.nanmean(data[1]))
+    np.testing.assert_allclose(stats.std, np.nanstd(data, axis=1))
+
+
+def test_empty_chunks_are_ignored():
+    data = make_signal()
+    stats = streamed(data, 64)
+    stats.update(np.empty((3, 0)))
+    np.testing.assert_array_equal(stats.n_flat, streamed(data, 200).n_flat)